@@ -1,3 +1,7 @@
+from __future__ import annotations
+from datetime import datetime
+import re
+
 from pyairtable import Table
 from pyairtable.formulas import match
 
@@ -7,20 +11,60 @@ airtable_config = {'api_key': AIRTABLE_API_KEY,
                    'base_id': BASE_ID,
                    'table_name': TABLE_NAME}
 
-phone_not_found_err = NameError('AirTable: phone number not found')
+phone_column_name = 'Phone'
+name_column_name = 'Name'
+
+
+class PhoneNotFound(Exception):
+    pass
+
+
+def get_table() -> Table:
+    return Table(**airtable_config)
+
 
+def normalize_phone(phone: str) -> str:
+    """Digits only, so '+7 (900) 123-45-67' matches '79001234567'"""
+    return re.sub(r'\D', '', phone)
 
-def find_name_by_phone(phone: str) -> str:
-    table = Table(**airtable_config)
-    phone_column_name = 'Phone'
-    name_column_name = 'Name'
+
+def _record_to_entry(record: dict) -> tuple | None:
+    fields = record['fields']
+    phone = normalize_phone(str(fields.get(phone_column_name, '')))
+    if not phone:
+        return None
+    return phone, fields.get(name_column_name, '')
+
+
+def find_name_by_phone(phone: str, table: Table = None) -> str:
+    table = table or get_table()
     formula = match({phone_column_name: phone})
     record = table.first(formula=formula)
     if record is None:
-        raise phone_not_found_err
+        raise PhoneNotFound('AirTable: phone number not found')
     else:
         try:
             name = record['fields'][name_column_name]
         except KeyError:
             name = ''
     return name
+
+
+def fetch_phone_names(table: Table,
+                      modified_after: datetime = None) -> list:
+    """All (phone, name) pairs, page by page, or only the records
+    modified after `modified_after` (UTC)"""
+    options = {'fields': [phone_column_name, name_column_name],
+               'page_size': 100}
+    if modified_after is not None:
+        timestamp = modified_after.strftime('%Y-%m-%dT%H:%M:%SZ')
+        options['formula'] = (
+            f"IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('{timestamp}'))"
+        )
+    entries = []
+    for page in table.iterate(**options):
+        for record in page:
+            entry = _record_to_entry(record)
+            if entry is not None:
+                entries.append(entry)
+    return entries
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+
+from aiogram import types
+
+from dedup import current_update_id
+
+log = logging.getLogger('albums')
+
+
+class AlbumCollector:
+    """Collects the photos of an album, sent by Telegram one update each.
+
+    Updates sharing a media_group_id are buffered until none has come for
+    `window` seconds, then `on_album(messages)` gets all of them at once,
+    in the order the customer sent them. pending_update_ids() are the
+    updates of the photos not sent yet, see dedup.UpdateDeduplicator.
+    """
+
+    def __init__(self, on_album, window: float):
+        self._on_album = on_album
+        self._window = window
+        # media_group_id -> (messages, update_ids, timer)
+        self._albums = {}
+        self._tasks = set()
+        self._update_ids = set()
+
+    def add(self, message: types.Message) -> None:
+        """Queue a photo of an album"""
+        media_group_id = message.media_group_id
+        messages, update_ids, timer = self._albums.get(
+            media_group_id, ([], [], None))
+        messages.append(message)
+        update_id = current_update_id()
+        if update_id is not None:
+            update_ids.append(update_id)
+            self._update_ids.add(update_id)
+        if timer is not None:
+            timer.cancel()
+        timer = asyncio.get_running_loop().call_later(
+            self._window, self._flush, media_group_id)
+        self._albums[media_group_id] = (messages, update_ids, timer)
+
+    def _flush(self, media_group_id: str) -> None:
+        messages, update_ids, timer = self._albums.pop(media_group_id)
+        timer.cancel()
+        messages.sort(key=lambda message: message.message_id)
+        task = asyncio.create_task(self._send(messages, update_ids))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, messages: list, update_ids: list) -> None:
+        try:
+            await self._on_album(messages)
+        except Exception:
+            log.exception(f'album of {messages[0].from_user.id} not sent')
+        finally:
+            self._update_ids.difference_update(update_ids)
+
+    def pending_update_ids(self):
+        return self._update_ids
+
+    async def close(self) -> None:
+        """Send the albums still collected, on shutdown"""
+        for media_group_id in list(self._albums):
+            self._flush(media_group_id)
+        await asyncio.gather(*self._tasks)
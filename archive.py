@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import time
+
+from db_async import AsyncMessageArchiveData
+
+log = logging.getLogger('archive')
+
+
+class MessageArchiver:
+    """Keeps the message table small.
+
+    Every `interval` seconds it creates the monthly partitions for the
+    next `partitions_ahead` months, moves messages answered more than
+    `archive_after` seconds ago to message_archive in batches of
+    `batch_size` rows, and drops the old partitions left empty.
+    Lookups by support_chat_message_id fall back to the archive.
+    """
+
+    def __init__(self, archive_after: int, interval: int, batch_size: int,
+                 batch_pause: float = 0, partitions_ahead: int = 2,
+                 lock_timeout: str = '1s'):
+        self._archive_after = archive_after
+        self._interval = interval
+        self._batch_size = batch_size
+        self._batch_pause = batch_pause
+        self._partitions_ahead = partitions_ahead
+        self._lock_timeout = lock_timeout
+        self._data = AsyncMessageArchiveData()
+        self._task = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._archive_forever())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _archive_forever(self) -> None:
+        while True:
+            try:
+                await self.archive()
+            except Exception:
+                log.exception('message archival failed')
+            await asyncio.sleep(self._interval)
+
+    async def archive(self) -> int:
+        """One archival round, returns the number of archived messages"""
+        created = await self._data.ensure_partitions(
+            self._partitions_ahead, self._lock_timeout)
+        started = time.perf_counter()
+        archived = 0
+        while True:
+            moved = await self._data.archive_batch(
+                self._archive_after, self._batch_size)
+            archived += moved
+            if moved < self._batch_size:
+                break
+            # lets the bot's own queries through between batches
+            await asyncio.sleep(self._batch_pause)
+        elapsed = time.perf_counter() - started
+        dropped = await self._data.drop_empty_partitions(
+            self._archive_after, self._lock_timeout)
+        log.info(f'archived {archived} messages in {elapsed:.1f} s, '
+                 f'{created} partitions created, dropped: {dropped}')
+        return archived
@@ -0,0 +1,61 @@
+"""Scratch schema for the benchmarks and tests that need the database.
+
+Call use() before anything connects: every later connection, those of
+the bot's pool and of spawned processes too, works in the schema.
+
+    _schema.use('writes_bench')
+    _schema.create()
+    try:
+        ...
+    finally:
+        _schema.drop()
+"""
+import os
+
+import psycopg2
+
+from db_pool import db_config, db_pool
+from migrate import apply_migrations
+
+name = None
+
+
+def use(schema: str) -> None:
+    global name
+    name = schema
+    os.environ['PGOPTIONS'] = f'-c search_path={schema}'
+
+
+def connect():
+    return psycopg2.connect(**db_config)
+
+
+def execute(script: str, values: tuple = None) -> None:
+    """Run one statement in the schema and commit it, e.g. to fill it"""
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(script, values)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def create() -> None:
+    """The schema, empty, with every migration applied"""
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {name} CASCADE;')
+            cursor.execute(f'CREATE SCHEMA {name};')
+        connection.commit()
+        apply_migrations(connection)
+    finally:
+        connection.close()
+
+
+def drop() -> None:
+    """Close the bot's pool, its connections are in the schema, and drop
+    the schema"""
+    db_pool.close()
+    execute(f'DROP SCHEMA IF EXISTS {name} CASCADE;')
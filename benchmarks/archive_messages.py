@@ -0,0 +1,136 @@
+"""Message archival throughput and its impact on the bot's queries.
+
+Fills a scratch schema with `rows` messages (1M by default) spread over
+the last 180 days, then runs the bot's message queries (add_message,
+get_message_view, set_message_answered) from a thread, first alone and
+then while MessageArchiver moves everything answered more than 90 days
+ago to message_archive. Prints archived rows/s, the latency of the bot's
+queries in both runs and the most lock waits seen at once.
+
+    python -m benchmarks.archive_messages [rows] [batch_size]
+"""
+import asyncio
+import sys
+import threading
+import time
+
+from archive import MessageArchiver
+from benchmarks import _schema
+from db_async import db_executor
+from db_managing import SupportBotData
+
+SCHEMA = 'archive_bench'
+
+USERS = 100_000
+DAYS = 180
+ARCHIVE_AFTER = 90 * 24 * 60 * 60
+
+fill_scripts = (
+    '''SELECT message_ensure_partitions(
+           now() - make_interval(days => {days}), now());''',
+    '''INSERT INTO tg_user (tg_id, tg_username)
+       SELECT g, 'user' || g FROM generate_series(1, {users}) g;''',
+    '''INSERT INTO message (tg_id, support_chat_message_id, is_answered,
+                           created_at, answered_at)
+       SELECT g % {users} + 1, g, TRUE,
+              now() - make_interval(secs => {days} * 86400.0 * g / {rows}),
+              now() - make_interval(secs => {days} * 86400.0 * g / {rows})
+       FROM generate_series(1, {rows}) g;''',
+    # a few recent messages are still waiting for an answer
+    '''UPDATE message SET is_answered = FALSE, answered_at = NULL
+       WHERE support_chat_message_id % 50 = 0
+       AND created_at > now() - interval '30 days';''',
+    'ANALYZE;',
+)
+
+
+class Workload(threading.Thread):
+    """The queries of a customer message and its answer, in a loop"""
+
+    def __init__(self, first_id: int):
+        super().__init__(daemon=True)
+        self.next_id = first_id
+        self.latencies = []
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            scm_id = self.next_id
+            self.next_id += 1
+            started = time.perf_counter()
+            SupportBotData.add_message(scm_id % USERS + 1, scm_id)
+            SupportBotData.get_message_view(scm_id)
+            SupportBotData.set_message_answered(scm_id, True)
+            self.latencies.append(time.perf_counter() - started)
+
+    def report(self, title: str) -> None:
+        latencies = sorted(self.latencies)
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000
+        print(f'{title}: {len(latencies)} messages, p50 {p50:.2f} ms, '
+              f'p99 {p99:.2f} ms, max {latencies[-1] * 1000:.2f} ms')
+
+
+class LockWaits(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.most = 0
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        connection = _schema.connect()
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            while not self.stopped.is_set():
+                cursor.execute('SELECT count(*) FROM pg_locks '
+                               'WHERE NOT granted;')
+                waits, = cursor.fetchone()
+                self.most = max(self.most, waits)
+                time.sleep(0.01)
+        connection.close()
+
+
+def setup(rows: int) -> None:
+    _schema.create()
+    print(f'filling {rows} messages...')
+    for script in fill_scripts:
+        _schema.execute(script.format(users=USERS, rows=rows, days=DAYS))
+
+
+async def main(rows: int, batch_size: int) -> None:
+    baseline = Workload(first_id=rows + 1)
+    baseline.start()
+    await asyncio.sleep(5)
+    baseline.stopped.set()
+    baseline.join()
+    baseline.report('without archival')
+
+    archiver = MessageArchiver(archive_after=ARCHIVE_AFTER, interval=0,
+                               batch_size=batch_size)
+    workload = Workload(first_id=baseline.next_id)
+    lock_waits = LockWaits()
+    workload.start()
+    lock_waits.start()
+    started = time.perf_counter()
+    archived = await archiver.archive()
+    elapsed = time.perf_counter() - started
+    workload.stopped.set()
+    lock_waits.stopped.set()
+    workload.join()
+    lock_waits.join()
+    workload.report('during archival')
+    print(f'archived {archived} messages in {elapsed:.1f} s: '
+          f'{archived / elapsed:.0f} rows/s with batches of {batch_size}')
+    print(f'most lock waits at once: {lock_waits.most}')
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    _schema.use(SCHEMA)
+    setup(rows)
+    try:
+        asyncio.run(main(rows, batch_size))
+    finally:
+        db_executor.shutdown(wait=True)
+        _schema.drop()
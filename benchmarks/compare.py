@@ -0,0 +1,35 @@
+"""Compares two result files of benchmarks.suite.
+
+    python -m benchmarks.compare benchmarks/results/<old>.json \
+        benchmarks/results/<new>.json
+"""
+import json
+import sys
+
+METRICS = ('updates_per_sec', 'p50_ms', 'p95_ms', 'p99_ms',
+           'queries_per_update')
+
+
+def load(path: str) -> dict:
+    with open(path) as results:
+        return json.load(results)
+
+
+def main(old_path: str, new_path: str) -> None:
+    old, new = load(old_path), load(new_path)
+    print(f'{old["commit"]} -> {new["commit"]}')
+    for name, new_result in new['scenarios'].items():
+        old_result = old['scenarios'].get(name)
+        if old_result is None:
+            print(f'{name}: new scenario')
+            continue
+        changes = []
+        for metric in METRICS:
+            before, after = old_result[metric], new_result[metric]
+            change = (after - before) / before * 100 if before else 0
+            changes.append(f'{metric} {before} -> {after} ({change:+.1f}%)')
+        print(f'{name}:\n    ' + '\n    '.join(changes))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,82 @@
+"""Handler latency and event loop lag with N concurrent users.
+
+Every simulated user repeats the database part of `new_text_message`
+(customer lookup) and of `replay_on_message` (message lookup) through
+the async business logic. A ticker coroutine measures how late the
+event loop wakes it up: if a query blocked the loop, the lag grows
+with the number of users. Runs in a scratch schema of the local
+database, dropped afterwards.
+
+    python -m benchmarks.concurrent_users [requests_per_user]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from benchmarks import _schema
+from business_logic import SupportBot
+from db_async import db_executor
+
+SCHEMA = 'concurrent_users_bench'
+USERS = (1, 10, 50, 100)
+TICK = 0.005
+
+
+def percentile(values: list, percent: float) -> float:
+    values = sorted(values)
+    return values[max(int(len(values) * percent) - 1, 0)]
+
+
+async def user(support_bot: SupportBot, tg_id: int, requests: int,
+               latencies: list) -> None:
+    for i in range(requests):
+        started = time.perf_counter()
+        await support_bot.get_customer_by_tg_id(tg_id)
+        await support_bot.get_textmessage_by(support_chat_message_id=i)
+        latencies.append(time.perf_counter() - started)
+
+
+async def ticker(lags: list, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+
+
+async def run(users: int, requests: int) -> None:
+    support_bot = SupportBot()
+    latencies, lags = [], []
+    stop = asyncio.Event()
+    ticker_task = asyncio.create_task(ticker(lags, stop))
+    await asyncio.gather(*(
+        user(support_bot, tg_id, requests, latencies)
+        for tg_id in range(users)
+    ))
+    stop.set()
+    await ticker_task
+    print(
+        f'{users:>4} users: '
+        f'p50 {statistics.median(latencies) * 1000:7.2f} ms  '
+        f'p99 {percentile(latencies, 0.99) * 1000:7.2f} ms  '
+        f'loop lag p99 {percentile(lags, 0.99) * 1000:6.2f} ms'
+    )
+
+
+if __name__ == '__main__':
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    _schema.use(SCHEMA)
+    _schema.create()
+    # every simulated user is a customer
+    _schema.execute('''INSERT INTO tg_user (tg_id, tg_username)
+                       SELECT g, 'user' || g
+                       FROM generate_series(0, %s) g;''', (max(USERS),))
+    _schema.execute('''INSERT INTO customer (tg_id, phone)
+                       SELECT tg_id, (70000000000 + tg_id)::text
+                       FROM tg_user;''')
+    try:
+        for users in USERS:
+            asyncio.run(run(users, requests))
+    finally:
+        db_executor.shutdown(wait=True)
+        _schema.drop()
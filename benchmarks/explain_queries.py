@@ -0,0 +1,146 @@
+"""Checks with EXPLAIN that the db_managing lookups use indexes at scale.
+
+Builds the schema from migrations/ in a scratch schema, fills it with
+`rows` messages (10M by default) spread over monthly partitions, a
+tenth of that in message_archive, 1M users with an FSM state each and
+500k customers, then fails if a point lookup plans a sequential scan
+of a filled table. The statements are db_managing's own. Bulk queries
+that return whole lists are only reported. The scratch schema is
+dropped at the end.
+
+    python -m benchmarks.explain_queries [rows]
+"""
+import json
+import sys
+
+import db_managing
+from benchmarks import _schema
+
+SCHEMA = 'explain_bench'
+USERS = 1_000_000
+
+fill_scripts = (
+    '''INSERT INTO tg_user (tg_id, tg_username, is_banned)
+       SELECT g, 'user' || g, g % 100 = 0
+       FROM generate_series(1, {users}) g;''',
+    '''INSERT INTO customer (tg_id, phone, first_name, last_name)
+       SELECT g, (70000000000 + g)::text, 'first', 'last'
+       FROM generate_series(1, {users}, 2) g;''',
+    '''SELECT message_ensure_partitions(
+           now() - make_interval(secs => {rows}), now());''',
+    '''INSERT INTO message (tg_id, support_chat_message_id, is_answered,
+                           created_at)
+       SELECT g % {users} + 1, g, g % 50 <> 0,
+              now() - make_interval(secs => {rows} - g)
+       FROM generate_series(1, {rows}) g;''',
+    '''INSERT INTO message_archive (text_message_id, tg_id,
+                                   support_chat_message_id, created_at,
+                                   answered_at)
+       SELECT {rows} + g, g % {users} + 1, {rows} + g,
+              now() - make_interval(secs => {rows} + g),
+              now() - make_interval(secs => {rows} + g)
+       FROM generate_series(1, {rows} / 10) g;''',
+    '''INSERT INTO fsm_state (chat_id, user_id, state)
+       SELECT g, g, 'CustomerState:test'
+       FROM generate_series(1, {users}) g;''',
+    'ANALYZE;',
+)
+
+# (name, query, params, must use an index), the statements db_managing
+# runs and two lookups the indexes of 005_message_indexes.sql are for
+queries = (
+    ('add_tg_user', db_managing.add_tg_user_script, (5, 'user5'), True),
+    ('does_user_exist', db_managing.does_user_exist_script, (5,), True),
+    ('does_phone_exist', db_managing.does_phone_exist_script, ('70000000005',),
+     True),
+    ('onboard_customer', db_managing.onboard_customer_script,
+     {'tg_id': 5, 'phone': '70000000005', 'first_name': 'first'}, True),
+    ('add_message', db_managing.add_message_script, (5, 5, 5), True),
+    # execute_values expands VALUES %s, a tuple is adapted alike
+    ('add_messages', db_managing.add_messages_script, ((5, 5),), True),
+    ('get_textmessage_id', db_managing.get_textmessage_id_script, (5, 5),
+     True),
+    ('archived textmessage_id', db_managing.get_textmessage_id_script,
+     (10**9, 10**9), True),
+    ('get_message_view', db_managing.get_message_view_script, (5, 5), True),
+    ('set_message_answered', db_managing.set_message_answered_script,
+     (True, True, 5), True),
+    ('get_customer_id', db_managing.get_customer_id_script, (5,), True),
+    ('get_customer_name', db_managing.get_customer_name_script, (5,), True),
+    ('get_ban_list', db_managing.get_ban_list_script, (), True),
+    ('messages of a user', '''SELECT text_message_id FROM message
+        WHERE tg_id = %s;''', (5,), True),
+    ('unanswered messages', '''SELECT text_message_id FROM message
+        WHERE is_answered = FALSE ORDER BY created_at LIMIT 100;''',
+        (), True),
+    ('TgUserData', db_managing.load_tg_user_script, (5,), True),
+    ('CustomerData', db_managing.load_customer_script, (5,), True),
+    ('TextMessageData', db_managing.load_text_message_script, (5, 5), True),
+    ('FSMStateData.get', db_managing.get_fsm_state_script, (5, 5, 3600), True),
+    ('FSMStateData.set_state', db_managing.set_fsm_state_script,
+     (5, 5, 'CustomerState:test', 3600), True),
+    ('archive_batch', db_managing.archive_batch_script,
+     (90 * 24 * 60 * 60, 1000), True),
+    *((f'broadcast recipients ({audience})', script, (5, 1000), True)
+      for audience, script
+      in db_managing.BroadcastData.recipients_scripts.items()),
+    ('assign', db_managing.assign_script, (5, 5, 1, 0), True),
+    ('get_watermark', db_managing.get_watermark_script, (0, 1, 86400), True),
+    ('save_watermark', db_managing.save_watermark_script, (0, 1, 5), True),
+    ('get_customer_list', db_managing.get_customer_list_script, (), False),
+    ('get_tg_users', db_managing.get_tg_users_script, (), False),
+)
+
+
+def plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def main(rows: int) -> bool:
+    _schema.create()
+    connection = _schema.connect()
+    ok = True
+    try:
+        with connection.cursor() as cursor:
+            print(f'filling {rows} messages...')
+            for script in fill_scripts:
+                cursor.execute(script.format(users=USERS, rows=rows))
+            connection.commit()
+            # empty partitions are scanned sequentially at no cost
+            cursor.execute('''SELECT relname FROM pg_class
+                              WHERE relnamespace = %s::regnamespace
+                              AND reltuples > 10000;''', (SCHEMA,))
+            filled = {relname for relname, in cursor.fetchall()}
+
+            for name, query, params, needs_index in queries:
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + query, params)
+                plan, = cursor.fetchone()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                seq_scans = sorted({
+                    node['Relation Name']
+                    for node in plan_nodes(plan[0]['Plan'])
+                    if node['Node Type'] == 'Seq Scan'
+                    and node['Relation Name'] in filled
+                })
+                if not seq_scans:
+                    result = 'index'
+                elif needs_index:
+                    result = 'FAIL seq scan on ' + ', '.join(seq_scans)
+                    ok = False
+                else:
+                    result = 'seq scan (bulk query)'
+                print(f'{name:>32}: {result}')
+            connection.rollback()
+    finally:
+        connection.close()
+        _schema.drop()
+    return ok
+
+
+if __name__ == '__main__':
+    _schema.use(SCHEMA)
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    sys.exit(0 if main(rows) else 1)
@@ -0,0 +1,64 @@
+"""In-process stand-in for the Telegram Bot API.
+
+Answers every method the bot uses with a plausible result and counts
+the calls. Point the bot at it with
+`bot.server = TelegramAPIServer.from_base(fake_bot_api.url)`.
+"""
+from collections import Counter
+import itertools
+import json
+import time
+
+from aiohttp import web
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = '127.0.0.1', port: int = 8081):
+        self.host = host
+        self.port = port
+        self.calls = Counter()
+        # unique across runs, message rows of earlier runs may still exist
+        self._message_ids = itertools.count(int(time.time() * 1000))
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    def _message(self, data) -> dict:
+        chat_id = int(data.get('chat_id', 0))
+        return {'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id,
+                         'type': 'private' if chat_id > 0 else 'supergroup'},
+                'text': data.get('text', '')}
+
+    def result(self, method: str, data):
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'support_bot',
+                    'username': 'support_bot'}
+        if method in ('sendMessage', 'sendPhoto', 'editMessageText'):
+            return self._message(data)
+        if method == 'sendMediaGroup':
+            return [self._message(data)
+                    for _ in json.loads(data['media'])]
+        if method == 'getUpdates':
+            return []
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] += 1
+        data = await request.post()
+        return web.json_response(
+            {'ok': True, 'result': self.result(method, data)})
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
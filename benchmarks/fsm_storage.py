@@ -0,0 +1,64 @@
+"""get_state/set_state throughput of the FSM storages.
+
+The Postgres ones run in a scratch schema of the local database,
+dropped afterwards.
+
+    python -m benchmarks.fsm_storage [operations] [concurrency]
+"""
+import asyncio
+import sys
+import time
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+from benchmarks import _schema
+from db_async import db_executor
+from fsm_storage import PostgresStorage
+
+SCHEMA = 'fsm_bench'
+CHAT_ID_BASE = 9_200_000_000
+USERS = 1000
+
+
+async def measure(name: str, storage, operations: int,
+                  concurrency: int) -> None:
+    async def worker(worker_id: int, method: str) -> None:
+        for i in range(worker_id, operations, concurrency):
+            chat = CHAT_ID_BASE + i % USERS
+            if method == 'set_state':
+                await storage.set_state(chat=chat, user=chat,
+                                        state='CustomerState:test')
+            else:
+                await storage.get_state(chat=chat, user=chat)
+
+    for method in ('set_state', 'get_state'):
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(worker_id, method)
+                               for worker_id in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        print(f'{name:>24} {method}: {operations / elapsed:10.1f} ops/s')
+
+    for i in range(USERS):
+        chat = CHAT_ID_BASE + i
+        await storage.finish(chat=chat, user=chat)
+
+
+async def main(operations: int, concurrency: int) -> None:
+    await measure('memory', MemoryStorage(), operations, concurrency)
+    await measure('postgres', PostgresStorage(ttl=3600),
+                  operations, concurrency)
+    await measure('postgres + memory layer',
+                  PostgresStorage(ttl=3600, cache_size=USERS),
+                  operations, concurrency)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    operations, concurrency = args + [10000, 10][len(args):]
+    _schema.use(SCHEMA)
+    _schema.create()
+    try:
+        asyncio.run(main(operations, concurrency))
+    finally:
+        db_executor.shutdown(wait=True)
+        _schema.drop()
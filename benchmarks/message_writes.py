@@ -0,0 +1,97 @@
+"""Throughput of writing new message rows one by one and write-behind.
+
+In a scratch schema, writes `rows` messages (20k by default) with one
+add_message call each, as many at a time as the pool allows, then
+through message_writer.MessageWriter with several batch sizes. Prints
+rows/s and transactions for each.
+
+    python -m benchmarks.message_writes [rows]
+"""
+import asyncio
+import sys
+import time
+
+from benchmarks import _schema
+from config import DB_POOL_MAX_SIZE
+from db_async import db_executor, run_in_db
+from db_managing import SupportBotData
+from db_pool import db_pool
+from message_writer import MessageWriter
+
+SCHEMA = 'writes_bench'
+USERS = 1000
+BATCH_SIZES = (10, 100, 500, 2000)
+INTERVAL = 0.005
+
+
+def report(name: str, rows: int, elapsed: float, transactions: int) -> None:
+    print(f'{name:>24}: {rows / elapsed:>8.0f} rows/s, '
+          f'{transactions} transactions')
+
+
+async def one_by_one(first_id: int, rows: int) -> None:
+    semaphore = asyncio.Semaphore(DB_POOL_MAX_SIZE)
+
+    async def add(support_chat_message_id: int) -> None:
+        async with semaphore:
+            await run_in_db(SupportBotData.add_message,
+                            support_chat_message_id % USERS + 1,
+                            support_chat_message_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(add(support_chat_message_id)
+                           for support_chat_message_id
+                           in range(first_id, first_id + rows)))
+    report('add_message', rows, time.perf_counter() - started, rows)
+
+
+async def write_behind(first_id: int, rows: int, batch_size: int) -> None:
+    writer = MessageWriter(interval=INTERVAL, batch_size=batch_size)
+    transactions = 0
+    add_messages = writer._data.add_messages
+
+    async def counted(batch: list) -> int:
+        nonlocal transactions
+        transactions += 1
+        return await add_messages(batch)
+
+    writer._data.add_messages = counted
+    started = time.perf_counter()
+    for support_chat_message_id in range(first_id, first_id + rows):
+        writer.add(support_chat_message_id % USERS + 1,
+                   support_chat_message_id)
+        if support_chat_message_id % 50 == 0:
+            # messages come from many updates, let the writer run
+            await asyncio.sleep(0)
+    await writer.close()
+    report(f'batches of {batch_size}', rows,
+           time.perf_counter() - started, transactions)
+
+
+async def main(rows: int) -> None:
+    await one_by_one(1, rows)
+    for number, batch_size in enumerate(BATCH_SIZES, start=1):
+        await write_behind(number * rows + 1, rows, batch_size)
+    with db_pool.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM message;')
+        count, = cursor.fetchone()
+    print(f'{count} messages written, '
+          f'{rows * (len(BATCH_SIZES) + 1)} expected')
+
+
+def setup() -> None:
+    _schema.create()
+    _schema.execute('''INSERT INTO tg_user (tg_id, tg_username)
+                       SELECT g, 'user' || g
+                       FROM generate_series(1, %s) g;''', (USERS,))
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    _schema.use(SCHEMA)
+    setup()
+    try:
+        asyncio.run(main(rows))
+    finally:
+        db_executor.shutdown(wait=True)
+        _schema.drop()
@@ -0,0 +1,48 @@
+"""Cost of the instrumentation on the hot path.
+
+Times a bare function against the same function wrapped by
+metrics.instrument_db, and a single Histogram.observe, without a
+database.
+
+    python -m benchmarks.metrics_overhead [calls]
+"""
+import sys
+import time
+
+from metrics import Histogram, instrument_db
+
+
+class Data:
+    @staticmethod
+    def query(value: int) -> int:
+        return value
+
+
+class InstrumentedData:
+    @staticmethod
+    def query(value: int) -> int:
+        return value
+
+
+instrument_db(InstrumentedData)
+
+
+def per_call(func, calls: int) -> float:
+    started = time.perf_counter()
+    for value in range(calls):
+        func(value)
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def main(calls: int) -> None:
+    histogram = Histogram('benchmark_seconds', 'benchmark', ('label',))
+    bare = per_call(Data.query, calls)
+    wrapped = per_call(InstrumentedData.query, calls)
+    observe = per_call(lambda value: histogram.observe(0.01, 'label'), calls)
+    print(f'bare call: {bare:.2f} us, instrumented: {wrapped:.2f} us, '
+          f'overhead {wrapped - bare:.2f} us per db_managing call')
+    print(f'Histogram.observe: {observe:.2f} us')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,72 @@
+"""Latency of making a tg user a customer, step by step and at once.
+
+In a scratch schema with `users` tg users (2000 by default), onboards
+each of them twice: the way add_customer used to (insert, load, rename,
+load again, four transactions) and with onboard_customer (one
+statement). Prints p50/p95/p99 latency and db_managing calls of both.
+
+    python -m benchmarks.onboarding [users]
+"""
+import sys
+import time
+
+from benchmarks import _schema
+from db_managing import CustomerData, SupportBotData
+from db_pool import db_pool
+from metrics import db_usage
+
+SCHEMA = 'onboarding_bench'
+
+
+def percentile(values: list, percent: float) -> float:
+    values = sorted(values)
+    return values[max(int(len(values) * percent) - 1, 0)]
+
+
+def step_by_step(tg_id: int, phone: str, name: str) -> None:
+    customer_id = SupportBotData.add_customer(tg_id, phone)
+    customer_data = CustomerData(customer_id)
+    customer_data.change_first_name(name)
+    CustomerData(customer_id)
+
+
+def at_once(tg_id: int, phone: str, name: str) -> None:
+    SupportBotData.onboard_customer(tg_id, phone, name)
+
+
+def measure(name: str, onboard, users: int, phone_base: int) -> None:
+    latencies = []
+    db_usage.set([0, 0.0])
+    for tg_id in range(1, users + 1):
+        started = time.perf_counter()
+        onboard(tg_id, str(phone_base + tg_id), f'name{tg_id}')
+        latencies.append(time.perf_counter() - started)
+    queries, _ = db_usage.get()
+    print(f'{name:>14}: p50 {percentile(latencies, 0.50) * 1000:.2f} ms  '
+          f'p95 {percentile(latencies, 0.95) * 1000:.2f} ms  '
+          f'p99 {percentile(latencies, 0.99) * 1000:.2f} ms  '
+          f'{queries / users:.0f} queries')
+
+
+def main(users: int) -> None:
+    measure('step by step', step_by_step, users, 70_000_000_000)
+    with db_pool.cursor() as cursor:
+        cursor.execute('DELETE FROM customer;')
+    measure('at once', at_once, users, 71_000_000_000)
+
+
+def setup(users: int) -> None:
+    _schema.create()
+    _schema.execute('''INSERT INTO tg_user (tg_id, tg_username)
+                       SELECT g, 'user' || g
+                       FROM generate_series(1, %s) g;''', (users,))
+
+
+if __name__ == '__main__':
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    _schema.use(SCHEMA)
+    setup(users)
+    try:
+        main(users)
+    finally:
+        _schema.drop()
@@ -0,0 +1,69 @@
+"""OutboundQueue against a mocked Bot.
+
+A burst of support chat mirrors and operator replies is sent through
+the queue. The mocked Bot answers after `API_LATENCY` and enforces
+Telegram's per-chat limit by raising RetryAfter, so the output shows
+queue depth, send latency and how many retries the limits let through.
+
+    python -m benchmarks.outbound_queue [customers]
+"""
+import asyncio
+import sys
+import time
+
+from aiogram.utils import exceptions
+
+from outbound import OutboundQueue, OPERATOR_REPLY, SUPPORT_CHAT_MIRROR
+
+API_LATENCY = 0.05
+SUPPORT_CHAT_ID = -100
+
+
+class MockedBot:
+    def __init__(self):
+        self.last_sent = {}
+        self.calls = 0
+
+    async def send_message(self, chat_id: int, text: str):
+        self.calls += 1
+        await asyncio.sleep(API_LATENCY)
+        min_interval = 3 if chat_id < 0 else 1
+        now = time.monotonic()
+        last_sent = self.last_sent.get(chat_id)
+        if last_sent is not None and now - last_sent < min_interval * 0.9:
+            raise exceptions.RetryAfter(min_interval)
+        self.last_sent[chat_id] = now
+        return text
+
+
+async def report(outbox: OutboundQueue, done: asyncio.Event) -> None:
+    while not done.is_set():
+        print(outbox.stats())
+        await asyncio.sleep(1)
+
+
+async def main(customers: int) -> None:
+    bot = MockedBot()
+    outbox = OutboundQueue(bot=bot, global_rate=30, private_chat_rate=1,
+                           group_chat_rate=20 / 60)
+    outbox.start()
+    done = asyncio.Event()
+    reporter = asyncio.create_task(report(outbox, done))
+    started = time.perf_counter()
+    sends = [outbox.send_message(SUPPORT_CHAT_MIRROR, SUPPORT_CHAT_ID,
+                                 text='mirror') for _ in range(5)]
+    sends += [outbox.send_message(OPERATOR_REPLY, tg_id, text='reply')
+              for tg_id in range(1, customers + 1) for _ in range(2)]
+    await asyncio.gather(*sends)
+    elapsed = time.perf_counter() - started
+    done.set()
+    await reporter
+    await outbox.close()
+    print(f'{len(sends)} messages in {elapsed:.1f} s, '
+          f'{bot.calls} Bot API calls')
+    print(outbox.stats())
+
+
+if __name__ == '__main__':
+    customers = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    asyncio.run(main(customers))
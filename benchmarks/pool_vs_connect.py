@@ -0,0 +1,69 @@
+"""Connect-per-call vs pooled connections on a local Postgres.
+
+Run from the repository root, in a scratch schema of the local
+database dropped afterwards:
+
+    python -m benchmarks.pool_vs_connect [iterations]
+"""
+import statistics
+import sys
+import time
+
+import psycopg2
+
+from benchmarks import _schema
+from db_pool import ConnectionPool, db_config
+
+SCHEMA = 'pool_bench'
+
+select_script = '''SELECT exists(
+                       SELECT tg_id
+                       FROM tg_user
+                       WHERE tg_id = %s);'''
+
+
+def connect_per_call(tg_id: int) -> None:
+    connection = psycopg2.connect(**db_config)
+    with connection.cursor() as cursor:
+        cursor.execute(select_script, (tg_id,))
+        cursor.fetchone()
+    connection.commit()
+    connection.close()
+
+
+def make_pooled_call(db_pool: ConnectionPool):
+    def pooled_call(tg_id: int) -> None:
+        with db_pool.cursor() as cursor:
+            cursor.execute(select_script, (tg_id,))
+            cursor.fetchone()
+    return pooled_call
+
+
+def measure(name: str, call, iterations: int) -> None:
+    timings = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        call(i)
+        timings.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    timings.sort()
+    print(
+        f'{name:>18}: {iterations / elapsed:8.1f} calls/s  '
+        f'p50 {statistics.median(timings) * 1000:6.2f} ms  '
+        f'p99 {timings[int(len(timings) * 0.99) - 1] * 1000:6.2f} ms'
+    )
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    _schema.use(SCHEMA)
+    _schema.create()
+    db_pool = ConnectionPool(
+        min_size=1, max_size=1, health_check_interval=30, **db_config)
+    try:
+        measure('connect per call', connect_per_call, iterations)
+        measure('pool', make_pooled_call(db_pool), iterations)
+    finally:
+        db_pool.close()
+        _schema.drop()
@@ -0,0 +1,89 @@
+"""Round trips per SupportBotData operation.
+
+Counts statements and transactions sent to a local Postgres for every
+operation, on the happy path and on each error path. Runs in a scratch
+schema of the local database, dropped afterwards.
+
+    python -m benchmarks.query_count
+"""
+from psycopg2 import extensions
+
+import db_managing
+from benchmarks import _schema
+from db_managing import SupportBotData, OperatorData
+from db_pool import ConnectionPool, db_config
+
+SCHEMA = 'query_count_bench'
+TG_ID_BASE = 9_000_000_000
+
+
+class Counter:
+    statements = 0
+    transactions = 0
+
+
+class CountingCursor(extensions.cursor):
+    def execute(self, query, vars=None):
+        Counter.statements += 1
+        return super().execute(query, vars)
+
+
+class CountingConnection(extensions.connection):
+    def commit(self):
+        Counter.transactions += 1
+        return super().commit()
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault('cursor_factory', CountingCursor)
+        return super().cursor(*args, **kwargs)
+
+
+def count(name: str, operation, *args) -> None:
+    Counter.statements = Counter.transactions = 0
+    try:
+        operation(*args)
+        outcome = 'ok'
+    except Exception as error:
+        outcome = type(error).__name__
+    print(f'{name:>36}: {Counter.statements} statements, '
+          f'{Counter.transactions} commits ({outcome})')
+
+
+def main() -> None:
+    user_id, customer_tg_id, stranger_id = \
+        TG_ID_BASE, TG_ID_BASE + 1, TG_ID_BASE + 2
+    phone = '999000000001'
+    SupportBotData.add_tg_user(user_id, 'bench_user')
+    SupportBotData.add_tg_user(customer_tg_id, 'bench_customer')
+    SupportBotData.add_customer(customer_tg_id, phone)
+    message_id = TG_ID_BASE
+
+    count('add_message', SupportBotData.add_message, user_id, message_id)
+    count('add_message (duplicate)',
+          SupportBotData.add_message, user_id, message_id)
+    count('get_textmessage_id', SupportBotData.get_textmessage_id, message_id)
+    count('get_textmessage_id (missing)',
+          SupportBotData.get_textmessage_id, message_id + 1)
+    count('get_customer_id', SupportBotData.get_customer_id, customer_tg_id)
+    count('get_customer_id (not a customer)',
+          SupportBotData.get_customer_id, user_id)
+    count('get_customer_id (unknown user)',
+          SupportBotData.get_customer_id, stranger_id)
+    count('add_customer (phone taken)',
+          SupportBotData.add_customer, user_id, phone)
+    count('ban', OperatorData.ban, user_id)
+    count('ban (unknown user)', OperatorData.ban, stranger_id)
+    count('unban', OperatorData.unban, user_id)
+
+
+if __name__ == '__main__':
+    _schema.use(SCHEMA)
+    _schema.create()
+    db_managing.db_pool = ConnectionPool(
+        min_size=1, max_size=1, health_check_interval=30,
+        connection_factory=CountingConnection, **db_config)
+    try:
+        main()
+    finally:
+        db_managing.db_pool.close()
+        _schema.drop()
@@ -0,0 +1,154 @@
+"""Checks that updates delivered again are handled only once.
+
+Runs support_bot's dispatcher against a fake Bot API in a scratch
+schema and delivers a backlog of customer texts, photos and albums the
+way polling does, through the update middlewares:
+
+    first half       the bot handles half the backlog and stops
+    after restart    Telegram delivers the whole backlog again, only the
+                     second half may be handled
+    in process       the whole backlog once more, e.g. webhook retries
+    second restart   and once more after another restart
+
+Prints the Bot API calls and message rows every delivery caused and
+fails if a delivery of handled updates caused any.
+
+    python -m benchmarks.replay_updates [updates] [users]
+"""
+import asyncio
+import sys
+
+import config
+
+config.OUTBOUND_GLOBAL_RATE = 1_000_000
+config.OUTBOUND_PRIVATE_CHAT_RATE = 1_000_000
+config.OUTBOUND_GROUP_CHAT_RATE = 1_000_000
+config.METRICS_ENABLED = False
+
+from aiogram import Bot, Dispatcher, types  # noqa: E402
+from aiogram.bot.api import TelegramAPIServer  # noqa: E402
+
+import support_bot  # noqa: E402
+from benchmarks import _schema, updates  # noqa: E402
+from benchmarks.fake_bot_api import FakeBotAPI  # noqa: E402
+from db_pool import db_pool  # noqa: E402
+from db_async import run_in_db  # noqa: E402
+from dedup import UpdateDeduplicator  # noqa: E402
+
+SCHEMA = 'replay_bench'
+TG_ID_BASE = 9_300_000_000
+# getUpdates returns at most 100 updates at a time
+BATCH_SIZE = 100
+
+
+def build_backlog(update_count: int, users: int) -> list:
+    backlog = []
+    for update_id in range(1, update_count + 1):
+        tg_id = TG_ID_BASE + update_id % users
+        if update_id % 10 < 6:
+            backlog.append(updates.private_text(
+                update_id, tg_id, f'question {update_id}'))
+        elif update_id % 10 < 7:
+            backlog.append(updates.private_photo(
+                update_id, tg_id, caption=f'photo {update_id}'))
+        else:
+            # three updates in a row, the album's parts
+            tg_id = TG_ID_BASE + update_id // 10 % users
+            backlog.append(updates.private_photo(
+                update_id, tg_id, media_group_id=f'album{update_id // 10}'))
+    return backlog
+
+
+def message_rows() -> int:
+    with db_pool.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM message;')
+        count, = cursor.fetchone()
+    return count
+
+
+async def restart(dp: Dispatcher) -> None:
+    """A new deduplicator, as after a restart of the bot"""
+    old = support_bot.deduplicator
+    await old.close()
+    dp.middleware.applications.remove(old)
+    support_bot.deduplicator = UpdateDeduplicator(
+        ring_size=config.UPDATE_DEDUP_RING_SIZE,
+        flush_interval=config.UPDATE_WATERMARK_FLUSH_INTERVAL,
+        buffered=old._buffered,
+        before_save=old._before_save
+    )
+    dp.middleware.setup(support_bot.deduplicator)
+    await support_bot.deduplicator.start()
+
+
+async def deliver(dp: Dispatcher, fake_bot_api: FakeBotAPI,
+                  backlog: list) -> tuple:
+    """(Bot API calls, new message rows, dropped updates) of a delivery"""
+    fake_bot_api.calls.clear()
+    support_bot.deduplicator.dropped = 0
+    rows = await run_in_db(message_rows)
+    for start in range(0, len(backlog), BATCH_SIZE):
+        await dp.process_updates(
+            [types.Update.to_object(update)
+             for update in backlog[start:start + BATCH_SIZE]])
+    # texts and albums are posted after a debounce
+    await support_bot.albums.close()
+    await support_bot.threader.close_all()
+    await support_bot.support_bot.message_writer.flush()
+    await support_bot.deduplicator.flush()
+    return (sum(fake_bot_api.calls.values()),
+            await run_in_db(message_rows) - rows,
+            support_bot.deduplicator.dropped)
+
+
+async def main(update_count: int, users: int) -> bool:
+    fake_bot_api = FakeBotAPI()
+    await fake_bot_api.start()
+    dp = support_bot.dp
+    dp.bot.server = TelegramAPIServer.from_base(fake_bot_api.url)
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+
+    for tg_id in range(TG_ID_BASE, TG_ID_BASE + users):
+        await support_bot.support_bot.add_tg_user(tg_id, f'user{tg_id}')
+    await support_bot.on_startup(dp)
+
+    backlog = build_backlog(update_count, users)
+    half = len(backlog) // 2
+    # a half without a split album
+    while half < len(backlog) and \
+            'media_group_id' in backlog[half]['message']:
+        half += 1
+    ok = True
+    try:
+        deliveries = (('first half', backlog[:half], 0),
+                      ('after restart', backlog, half),
+                      ('in process', backlog, len(backlog)),
+                      ('second restart', backlog, len(backlog)))
+        for name, delivered, duplicates in deliveries:
+            if name.endswith('restart'):
+                await restart(dp)
+            calls, rows, dropped = await deliver(dp, fake_bot_api, delivered)
+            result = 'ok'
+            if dropped != duplicates or \
+                    (dropped == len(delivered) and (calls or rows)):
+                result = 'FAILED'
+                ok = False
+            print(f'{name:>16}: {len(delivered)} updates, {dropped} dropped, '
+                  f'{calls} Bot API calls, {rows} messages: {result}')
+    finally:
+        await fake_bot_api.stop()
+        await support_bot.on_shutdown(dp)
+    return ok
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    update_count, users = args + [1000, 50][len(args):]
+    _schema.use(SCHEMA)
+    _schema.create()
+    try:
+        ok = asyncio.run(main(update_count, users))
+    finally:
+        _schema.drop()
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,209 @@
+"""Throughput of the real dispatcher, saved as JSON per commit.
+
+Feeds synthetic updates into support_bot's Dispatcher, through its
+update middlewares as polling does, with the bot pointed at an
+in-process fake Bot API and a scratch schema of the local database,
+dropped afterwards. Scenarios run one after another, `concurrency`
+updates at a time:
+
+    private_text      customer text messages, queued for the support chat
+                      (bursts of a customer are posted together later)
+    private_photo     the same with photos
+    private_album     albums of ALBUM_SIZE photos, posted as one message
+    operator_reply    operator replies to those messages
+    answered_button   "answered" / "not answered" buttons
+    ban_button        ban and unban buttons
+
+For every scenario it reports updates/s, p50/p95/p99 latency of
+handling an update and db_managing calls per update, and writes them
+to benchmarks/results/<commit>.json. Compare two runs with
+benchmarks.compare. The outbound rate limits and the flood limit of
+customers are lifted: the numbers are what the bot itself can do, not
+what Telegram lets through or what a customer may send.
+
+Needs a well-formed API_TOKEN in config (any value like '123:abc' will
+do, no request leaves the machine).
+
+    python -m benchmarks.suite [updates] [concurrency] [users]
+"""
+import asyncio
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+
+import config
+
+config.OUTBOUND_GLOBAL_RATE = 1_000_000
+config.OUTBOUND_PRIVATE_CHAT_RATE = 1_000_000
+config.OUTBOUND_GROUP_CHAT_RATE = 1_000_000
+config.FLOOD_RATE = 1_000_000
+config.FLOOD_BURST = 1_000_000
+config.METRICS_ENABLED = False
+
+from aiogram import Bot, Dispatcher, types  # noqa: E402
+from aiogram.bot.api import TelegramAPIServer  # noqa: E402
+
+import support_bot  # noqa: E402
+from benchmarks import _schema, updates  # noqa: E402
+from benchmarks.fake_bot_api import FakeBotAPI  # noqa: E402
+from db_pool import db_pool  # noqa: E402
+from metrics import db_usage  # noqa: E402
+
+SCHEMA = 'suite_bench'
+TG_ID_BASE = 9_200_000_000
+OPERATOR_ID = TG_ID_BASE - 1
+ALBUM_SIZE = 4
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'results')
+
+
+def percentile(values: list, percent: float) -> float:
+    values = sorted(values)
+    return values[max(int(len(values) * percent) - 1, 0)]
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+async def handle(dp: Dispatcher, update: dict) -> tuple:
+    """(seconds, db_managing calls) of handling one update"""
+    db_usage.set([0, 0.0])
+    started = time.perf_counter()
+    # through the update middlewares, like polling does
+    await dp.updates_handler.notify(types.Update.to_object(update))
+    elapsed = time.perf_counter() - started
+    queries, _ = db_usage.get()
+    return elapsed, queries
+
+
+async def run_scenario(dp: Dispatcher, fake_bot_api: FakeBotAPI,
+                       update_list: list, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    fake_bot_api.calls.clear()
+
+    async def limited(update: dict) -> tuple:
+        async with semaphore:
+            # a task of its own, like every update in polling or webhook mode
+            return await asyncio.create_task(handle(dp, update))
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(limited(update)
+                                     for update in update_list))
+    elapsed = time.perf_counter() - started
+    latencies = [latency for latency, _ in results]
+    queries = [count for _, count in results]
+    return {'updates': len(update_list),
+            'seconds': round(elapsed, 3),
+            'updates_per_sec': round(len(update_list) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'queries_per_update': round(sum(queries) / len(queries), 2),
+            'bot_api_calls': dict(fake_bot_api.calls)}
+
+
+def support_chat_message_ids(users: int) -> list:
+    with db_pool.cursor() as cursor:
+        cursor.execute('''SELECT support_chat_message_id FROM message
+                          WHERE tg_id >= %s AND tg_id < %s
+                          ORDER BY support_chat_message_id;''',
+                       (TG_ID_BASE, TG_ID_BASE + users))
+        return [scm_id for scm_id, in cursor.fetchall()]
+
+
+def build_scenarios(update_count: int, users: int):
+    """Yields (name, updates), later scenarios need the earlier ones"""
+    update_ids = iter(range(10 ** 9))
+    yield 'private_text', [
+        updates.private_text(next(update_ids), TG_ID_BASE + i % users,
+                             f'question {i}')
+        for i in range(update_count)]
+    yield 'private_photo', [
+        updates.private_photo(next(update_ids), TG_ID_BASE + i % users,
+                              caption=f'photo {i}')
+        for i in range(update_count)]
+    yield 'private_album', [
+        updates.private_photo(next(update_ids),
+                              TG_ID_BASE + i // ALBUM_SIZE % users,
+                              media_group_id=f'album{i // ALBUM_SIZE}')
+        for i in range(update_count)]
+    scm_ids = support_chat_message_ids(users)
+    yield 'operator_reply', [
+        updates.operator_reply(next(update_ids), OPERATOR_ID,
+                               scm_ids[i % len(scm_ids)], f'answer {i}')
+        for i in range(update_count)]
+    buttons = (support_bot.answered_button, support_bot.unanswered_button)
+    yield 'answered_button', [
+        updates.keyboard_callback(next(update_ids), OPERATOR_ID,
+                                  scm_ids[i % len(scm_ids)], buttons[i % 2])
+        for i in range(update_count)]
+    # one user per update pair, so a ban and its unban don't interleave
+    buttons = (support_bot.ban_button, support_bot.unban_button)
+    yield 'ban_button', [
+        updates.keyboard_callback(next(update_ids), OPERATOR_ID,
+                                  scm_ids[(i // 2) % len(scm_ids)],
+                                  buttons[i % 2])
+        for i in range(update_count)]
+
+
+async def main(update_count: int, concurrency: int, users: int) -> None:
+    fake_bot_api = FakeBotAPI()
+    await fake_bot_api.start()
+    dp = support_bot.dp
+    dp.bot.server = TelegramAPIServer.from_base(fake_bot_api.url)
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+
+    for tg_id in range(TG_ID_BASE - 1, TG_ID_BASE + users):
+        await support_bot.support_bot.add_tg_user(tg_id, f'user{tg_id}')
+    await support_bot.on_startup(dp)
+
+    scenarios = {}
+    try:
+        for name, update_list in build_scenarios(update_count, users):
+            result = await run_scenario(
+                dp, fake_bot_api, update_list, concurrency)
+            # texts and albums are posted after a debounce
+            await support_bot.albums.close()
+            await support_bot.threader.close_all()
+            await support_bot.support_bot.message_writer.flush()
+            scenarios[name] = result
+            print(f'{name:>16}: {result["updates_per_sec"]:>8} updates/s  '
+                  f'p50 {result["p50_ms"]} ms  p95 {result["p95_ms"]} ms  '
+                  f'p99 {result["p99_ms"]} ms  '
+                  f'{result["queries_per_update"]} queries/update')
+    finally:
+        await fake_bot_api.stop()
+        await support_bot.on_shutdown(dp)
+
+    commit = current_commit()
+    report = {'commit': commit,
+              'date': datetime.datetime.now().isoformat(timespec='seconds'),
+              'updates': update_count,
+              'concurrency': concurrency,
+              'users': users,
+              'scenarios': scenarios}
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f'{commit}.json')
+    with open(path, 'w') as results:
+        json.dump(report, results, indent=2)
+    print(f'saved to {path}')
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    update_count, concurrency, users = args + [2000, 50, 100][len(args):]
+    _schema.use(SCHEMA)
+    _schema.create()
+    try:
+        asyncio.run(main(update_count, concurrency, users))
+    finally:
+        _schema.drop()
@@ -0,0 +1,76 @@
+"""Cost of the flood throttle on every customer message.
+
+Fills throttle.FloodThrottle with `users` tracked customers (100k by
+default), then times FloodThrottle.hit and the whole middleware call
+for messages of random customers, the same while customers are evicted
+as idle on every call, and the memory the buckets take. No database.
+
+    python -m benchmarks.throttle_overhead [users] [calls]
+"""
+import asyncio
+import random
+import sys
+import time
+import tracemalloc
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+
+from benchmarks import updates
+from throttle import FloodThrottle
+
+TG_ID_BASE = 9_400_000_000
+
+
+def per_call_us(func, tg_ids: list) -> float:
+    started = time.perf_counter()
+    for tg_id in tg_ids:
+        func(tg_id)
+    return (time.perf_counter() - started) / len(tg_ids) * 1e6
+
+
+async def middleware_per_call_us(throttle: FloodThrottle,
+                                 messages: list) -> float:
+    started = time.perf_counter()
+    for message in messages:
+        try:
+            await throttle.on_pre_process_message(message, {})
+        except CancelHandler:
+            pass
+    return (time.perf_counter() - started) / len(messages) * 1e6
+
+
+def main(users: int, calls: int) -> None:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    # nobody is evicted for an hour
+    throttle = FloodThrottle(rate=1, burst=3600)
+    for tg_id in range(TG_ID_BASE, TG_ID_BASE + users):
+        throttle.hit(tg_id)
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f'{len(throttle)} customers tracked in {memory / 2 ** 20:.1f} MiB, '
+          f'{memory / users:.0f} bytes each')
+
+    tg_ids = [random.randrange(TG_ID_BASE, TG_ID_BASE + users)
+              for _ in range(calls)]
+    print(f'hit: {per_call_us(throttle.hit, tg_ids):.2f} us')
+
+    messages = [
+        types.Message.to_object(
+            updates.private_text(i, tg_id, 'question')['message'])
+        for i, tg_id in enumerate(tg_ids[:min(calls, 100_000)])]
+    middleware = asyncio.run(middleware_per_call_us(throttle, messages))
+    print(f'middleware: {middleware:.2f} us per message')
+
+    # every customer goes idle right away and is evicted by the next call
+    churn = FloodThrottle(rate=1_000_000, burst=1)
+    new_ids = list(range(TG_ID_BASE, TG_ID_BASE + calls))
+    print(f'hit with eviction: {per_call_us(churn.hit, new_ids):.2f} us, '
+          f'{len(churn)} left tracked')
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    users, calls = args + [100_000, 1_000_000][len(args):]
+    main(users, calls)
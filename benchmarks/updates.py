@@ -0,0 +1,71 @@
+"""Synthetic Telegram updates as the Bot API would deliver them"""
+import time
+
+from config import SUPPORT_CHAT_ID
+
+
+def _user(tg_id: int) -> dict:
+    return {'id': tg_id, 'is_bot': False,
+            'first_name': 'User', 'last_name': str(tg_id),
+            'username': f'user{tg_id}'}
+
+
+def _message(message_id: int, tg_id: int, chat: dict, **fields) -> dict:
+    message = {'message_id': message_id,
+               'from': _user(tg_id),
+               'chat': chat,
+               'date': int(time.time())}
+    message.update(fields)
+    return message
+
+
+def _private_chat(tg_id: int) -> dict:
+    return {'id': tg_id, 'type': 'private'}
+
+
+def _support_chat() -> dict:
+    return {'id': SUPPORT_CHAT_ID, 'type': 'supergroup', 'title': 'support'}
+
+
+def private_text(update_id: int, tg_id: int, text: str) -> dict:
+    return {'update_id': update_id,
+            'message': _message(update_id, tg_id, _private_chat(tg_id),
+                                text=text)}
+
+
+def private_photo(update_id: int, tg_id: int, caption: str = None,
+                  media_group_id: str = None) -> dict:
+    photo = [{'file_id': f'photo{update_id}_{size}',
+              'file_unique_id': f'photo{update_id}_{size}',
+              'width': size, 'height': size}
+             for size in (90, 320, 1280)]
+    fields = {'photo': photo}
+    if caption is not None:
+        fields['caption'] = caption
+    if media_group_id is not None:
+        fields['media_group_id'] = media_group_id
+    return {'update_id': update_id,
+            'message': _message(update_id, tg_id, _private_chat(tg_id),
+                                **fields)}
+
+
+def operator_reply(update_id: int, operator_id: int,
+                   support_chat_message_id: int, text: str) -> dict:
+    replied = _message(support_chat_message_id, 1, _support_chat(),
+                       text='question')
+    return {'update_id': update_id,
+            'message': _message(update_id, operator_id, _support_chat(),
+                                text=text, reply_to_message=replied)}
+
+
+def keyboard_callback(update_id: int, operator_id: int,
+                      support_chat_message_id: int, answer: str) -> dict:
+    message = _message(support_chat_message_id, 1, _support_chat(),
+                       text='question')
+    return {'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': _user(operator_id),
+                'message': message,
+                'chat_instance': str(SUPPORT_CHAT_ID),
+                'data': f'btn:customer_textmessage:{answer}:0'}}
@@ -0,0 +1,107 @@
+"""Updates/sec and end-to-end latency of the webhook entry point.
+
+Serves the real dispatcher from support_bot on a local aiohttp server,
+points the bot at an in-process fake Bot API and POSTs synthetic
+private text messages from `users` customers, `concurrency` at a time.
+A webhook request returns when its handler has finished, so request
+latency is the handler's end-to-end latency.
+
+Runs in a scratch schema of the local database, dropped afterwards, so
+the deployed tables and the saved update watermark are left alone.
+Needs a well-formed API_TOKEN in config (any value like '123:abc' will
+do, no request leaves the machine).
+
+    python -m benchmarks.webhook_load [updates] [concurrency] [users]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.dispatcher.webhook import get_new_configured_app
+
+import support_bot
+from benchmarks import _schema, updates
+from benchmarks.fake_bot_api import FakeBotAPI
+from config import WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH
+
+SCHEMA = 'webhook_bench'
+TG_ID_BASE = 9_100_000_000
+
+
+def percentile(values: list, percent: float) -> float:
+    values = sorted(values)
+    return values[max(int(len(values) * percent) - 1, 0)]
+
+
+async def post_updates(url: str, update_list: list,
+                       concurrency: int) -> list:
+    latencies = []
+    queue = asyncio.Queue()
+    for update in update_list:
+        queue.put_nowait(update)
+
+    async def worker(session: aiohttp.ClientSession) -> None:
+        while not queue.empty():
+            update = queue.get_nowait()
+            started = time.perf_counter()
+            async with session.post(url, json=update) as response:
+                await response.read()
+                response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    return latencies
+
+
+async def main(update_count: int, concurrency: int, users: int) -> None:
+    fake_bot_api = FakeBotAPI()
+    await fake_bot_api.start()
+    support_bot.bot.server = TelegramAPIServer.from_base(fake_bot_api.url)
+
+    for tg_id in range(TG_ID_BASE, TG_ID_BASE + users):
+        await support_bot.support_bot.add_tg_user(tg_id, f'user{tg_id}')
+    await support_bot.on_startup(support_bot.dp)
+
+    runner = web.AppRunner(get_new_configured_app(support_bot.dp,
+                                                  WEBHOOK_PATH))
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+
+    update_list = [
+        updates.private_text(update_id, TG_ID_BASE + update_id % users,
+                             f'question {update_id}')
+        for update_id in range(update_count)
+    ]
+    url = f'http://{WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}'
+    started = time.perf_counter()
+    latencies = await post_updates(url, update_list, concurrency)
+    elapsed = time.perf_counter() - started
+    # texts are posted after a debounce, while the fake Bot API is up
+    await support_bot.threader.close_all()
+
+    print(f'{update_count} updates, concurrency {concurrency}: '
+          f'{update_count / elapsed:.1f} updates/s')
+    print(f'latency p50 {statistics.median(latencies) * 1000:.2f} ms  '
+          f'p95 {percentile(latencies, 0.95) * 1000:.2f} ms  '
+          f'p99 {percentile(latencies, 0.99) * 1000:.2f} ms')
+    print(f'Bot API calls: {dict(fake_bot_api.calls)}')
+
+    await runner.cleanup()
+    await fake_bot_api.stop()
+    await support_bot.on_shutdown(support_bot.dp)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    update_count, concurrency, users = args + [2000, 50, 100][len(args):]
+    _schema.use(SCHEMA)
+    _schema.create()
+    try:
+        asyncio.run(main(update_count, concurrency, users))
+    finally:
+        _schema.drop()
@@ -0,0 +1,166 @@
+"""Throughput of the sharded bot with 1 to `workers` worker processes.
+
+In a scratch schema, starts sharding.Supervisor with 1, 2, ... worker
+processes against a fake Bot API running in a process of its own and
+routes `updates` customer texts and photos of `users` customers (20k,
+500 by default) through it, the way supervisor.py does. Prints
+updates/s until the last update has been handled, the speedup over one
+worker process and whether every customer's updates were handled in
+the order they came. Flood and outbound rate limits are lifted.
+
+Needs a well-formed API_TOKEN in config (any value like '123:abc' will
+do, no request leaves the machine).
+
+    python -m benchmarks.worker_scaling [workers] [updates] [users]
+"""
+import asyncio
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+from benchmarks import _schema, updates
+from benchmarks.fake_bot_api import FakeBotAPI
+from db_async import db_executor
+from sharding import Supervisor, shard_of
+
+SCHEMA = 'sharding_bench'
+
+TG_ID_BASE = 9_500_000_000
+FAKE_BOT_API_PORT = 8082
+OVERRIDES = {
+    'TELEGRAM_API_SERVER': f'http://127.0.0.1:{FAKE_BOT_API_PORT}',
+    'OUTBOUND_GLOBAL_RATE': 1_000_000,
+    'OUTBOUND_PRIVATE_CHAT_RATE': 1_000_000,
+    'OUTBOUND_GROUP_CHAT_RATE': 1_000_000,
+    'FLOOD_RATE': 1_000_000,
+    'FLOOD_BURST': 1_000_000,
+    'METRICS_ENABLED': False,
+}
+# seconds to wait for the worker processes to start and for an ack
+START_TIMEOUT = 120
+ACK_TIMEOUT = 60
+
+
+def serve_fake_bot_api() -> None:
+    async def serve() -> None:
+        await FakeBotAPI(port=FAKE_BOT_API_PORT).start()
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def build_updates(first_update_id: int, update_count: int,
+                  users: int) -> list:
+    update_list = []
+    for i in range(update_count):
+        update_id = first_update_id + i
+        tg_id = TG_ID_BASE + i % users
+        if i % 10 < 8:
+            update_list.append(updates.private_text(
+                update_id, tg_id, f'question {update_id}'))
+        else:
+            update_list.append(updates.private_photo(
+                update_id, tg_id, caption=f'photo {update_id}'))
+    return update_list
+
+
+def wait_for_acks(acks: multiprocessing.Queue, count: int) -> list:
+    handled = []
+    while len(handled) < count:
+        handled.append(acks.get(timeout=ACK_TIMEOUT))
+    return handled
+
+
+def in_order(update_list: list, handled: list) -> bool:
+    customer = {update['update_id']: update['message']['from']['id']
+                for update in update_list}
+    last = {}
+    for update_id in handled:
+        tg_id = customer[update_id]
+        if last.get(tg_id, -1) > update_id:
+            return False
+        last[tg_id] = update_id
+    return True
+
+
+async def run(workers: int, first_update_id: int, update_count: int,
+              users: int) -> tuple:
+    """(updates/s, order kept) with `workers` worker processes"""
+    acks = multiprocessing.get_context('spawn').Queue()
+    supervisor = Supervisor(workers=workers, overrides=OVERRIDES, acks=acks)
+    supervisor.start()
+    loop = asyncio.get_running_loop()
+    try:
+        # an update for every worker process, once all of them are
+        # handled the worker processes are up
+        warm_up = []
+        for shard in range(workers):
+            tg_id = next(tg_id for tg_id in range(TG_ID_BASE,
+                                                  TG_ID_BASE + users)
+                         if shard_of(tg_id, workers) == shard)
+            warm_up.append(updates.private_text(
+                first_update_id + shard, tg_id, 'hello'))
+        for update in warm_up:
+            await supervisor.route(update)
+        await loop.run_in_executor(
+            None, lambda: [acks.get(timeout=START_TIMEOUT) for _ in warm_up])
+
+        update_list = build_updates(
+            first_update_id + workers, update_count, users)
+        started = time.perf_counter()
+        for update in update_list:
+            await supervisor.route(update)
+        handled = await loop.run_in_executor(
+            None, wait_for_acks, acks, len(update_list))
+        elapsed = time.perf_counter() - started
+    finally:
+        await supervisor.stop()
+    return update_count / elapsed, in_order(update_list, handled)
+
+
+async def main(max_workers: int, update_count: int, users: int) -> None:
+    fake_bot_api = multiprocessing.get_context('spawn').Process(
+        target=serve_fake_bot_api, daemon=True)
+    fake_bot_api.start()
+    try:
+        base = None
+        first_update_id = 1
+        for workers in range(1, max_workers + 1):
+            try:
+                rate, ordered = await run(
+                    workers, first_update_id, update_count, users)
+            except queue.Empty:
+                print(f'{workers:>2} workers: updates were not handled '
+                      f'within {ACK_TIMEOUT} s')
+                return
+            first_update_id += update_count + workers
+            base = base or rate
+            print(f'{workers:>2} workers: {rate:>8.0f} updates/s  '
+                  f'x{rate / base:.2f}  '
+                  f'order {"kept" if ordered else "BROKEN"}')
+    finally:
+        fake_bot_api.kill()
+
+
+def setup(users: int) -> None:
+    _schema.create()
+    _schema.execute('''INSERT INTO tg_user (tg_id, tg_username)
+                       SELECT g, 'user' || g
+                       FROM generate_series(%s, %s) g;''',
+                    (TG_ID_BASE, TG_ID_BASE + users - 1))
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    max_workers, update_count, users = \
+        args + [os.cpu_count(), 20_000, 500][len(args):]
+    # the worker processes inherit the schema
+    _schema.use(SCHEMA)
+    setup(users)
+    try:
+        asyncio.run(main(max_workers, update_count, users))
+    finally:
+        db_executor.shutdown(wait=True)
+        _schema.drop()
@@ -0,0 +1,108 @@
+import time
+
+from aiogram import Bot, types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.utils import exceptions
+
+from metrics import COUNT_BUCKETS, Counter, Histogram, db_usage
+
+UPDATES = Counter(
+    'bot_updates_total', 'updates received by type', ('type',))
+UPDATE_SECONDS = Histogram(
+    'bot_update_duration_seconds', 'time to handle an update', ('type',))
+HANDLER_SECONDS = Histogram(
+    'bot_handler_duration_seconds', 'time spent in a handler', ('handler',))
+UPDATE_DB_QUERIES = Histogram(
+    'bot_update_db_queries', 'db_managing calls per update', ('type',),
+    buckets=COUNT_BUCKETS)
+UPDATE_DB_SECONDS = Histogram(
+    'bot_update_db_seconds', 'time in db_managing calls per update',
+    ('type',))
+API_SECONDS = Histogram(
+    'telegram_api_duration_seconds', 'Bot API requests', ('method',))
+API_ERRORS = Counter(
+    'telegram_api_errors_total', 'Bot API requests that failed',
+    ('method', 'error'))
+
+UPDATE_TYPES = ('message', 'edited_message', 'channel_post',
+                'edited_channel_post', 'inline_query',
+                'chosen_inline_result', 'callback_query', 'shipping_query',
+                'pre_checkout_query', 'poll', 'poll_answer',
+                'my_chat_member', 'chat_member', 'chat_join_request')
+
+
+def update_type(update: types.Update) -> str:
+    for name in UPDATE_TYPES:
+        if getattr(update, name) is not None:
+            return name
+    return 'unknown'
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Update counts and latency, handler latency, database use per update.
+
+    Handler latency is recorded for handlers that return normally.
+    """
+
+    async def on_pre_process_update(self, update: types.Update,
+                                    data: dict) -> None:
+        data['_metrics_started'] = time.perf_counter()
+        data['_metrics_type'] = update_type(update)
+        # filled in by the db_managing calls of this update's task
+        db_usage.set([0, 0.0])
+
+    async def on_post_process_update(self, update: types.Update,
+                                     results: list, data: dict) -> None:
+        kind = data['_metrics_type']
+        UPDATES.inc(kind)
+        UPDATE_SECONDS.observe(
+            time.perf_counter() - data['_metrics_started'], kind)
+        usage = db_usage.get()
+        if usage is not None:
+            UPDATE_DB_QUERIES.observe(usage[0], kind)
+            UPDATE_DB_SECONDS.observe(usage[1], kind)
+
+    @staticmethod
+    def _handler_started(data: dict) -> None:
+        data['_metrics_handler'] = current_handler.get().__name__
+        data['_metrics_handler_started'] = time.perf_counter()
+
+    @staticmethod
+    def _handler_finished(data: dict) -> None:
+        handler = data.pop('_metrics_handler', None)
+        if handler is not None:
+            HANDLER_SECONDS.observe(
+                time.perf_counter() - data['_metrics_handler_started'],
+                handler)
+
+    async def on_process_message(self, message: types.Message,
+                                 data: dict) -> None:
+        self._handler_started(data)
+
+    async def on_post_process_message(self, message: types.Message,
+                                      results: list, data: dict) -> None:
+        self._handler_finished(data)
+
+    async def on_process_callback_query(self, query: types.CallbackQuery,
+                                        data: dict) -> None:
+        self._handler_started(data)
+
+    async def on_post_process_callback_query(
+            self, query: types.CallbackQuery, results: list,
+            data: dict) -> None:
+        self._handler_finished(data)
+
+
+class InstrumentedBot(Bot):
+    """Bot that times every Bot API request"""
+
+    async def request(self, method: str, data=None, files=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().request(method, data, files, **kwargs)
+        except exceptions.TelegramAPIError as error:
+            API_ERRORS.inc(method, type(error).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method)
@@ -0,0 +1,185 @@
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import socket
+
+import aiohttp
+from aiogram.utils import exceptions
+
+from db_async import AsyncBroadcastData
+from db_managing import BroadcastData
+from outbound import OutboundQueue, BROADCAST
+
+log = logging.getLogger('broadcast')
+
+AUDIENCES = tuple(BroadcastData.recipients_scripts)
+
+
+class Broadcaster:
+    """Copies one support chat message to every non-banned recipient.
+
+    Recipients are read from the database in chunks of `chunk_size`, a
+    query per chunk, so no connection is held while a chunk is sent.
+    A chunk is handed to the outbound queue at once, so it goes out at
+    the highest rate Telegram allows. Progress is saved every
+    `progress_every` recipients, in tg_id order: an interrupted broadcast
+    resumes after the last saved recipient, so at most that many are sent
+    to again. Recipients who blocked the bot or were deleted, or could not
+    be reached, are recorded.
+
+    A broadcast is sent by the process holding its lease of `lease`
+    seconds in the database, renewed while it runs. Every process checks
+    for unfinished broadcasts without a lease (interrupted, or of a
+    process that died) every third of `lease` and claims them, so each
+    one is sent by a single process at a time.
+    """
+
+    def __init__(self, outbox: OutboundQueue, chunk_size: int, lease: int,
+                 progress_every: int = 10, on_finished=None):
+        self._outbox = outbox
+        self._chunk_size = chunk_size
+        self._progress_every = progress_every
+        self._lease = lease
+        self._on_finished = on_finished
+        self._data = AsyncBroadcastData()
+        self._owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._tasks = {}
+        self._resume_task = None
+
+    async def start(self, audience: str, from_chat_id: int,
+                    message_id: int) -> int:
+        if audience not in AUDIENCES:
+            raise ValueError(f'unknown audience: {audience}')
+        broadcast_id = await self._data.create(
+            audience, from_chat_id, message_id, self._owner, self._lease)
+        self._spawn(broadcast_id, audience, from_chat_id, message_id, 0)
+        return broadcast_id
+
+    def start_resuming(self) -> None:
+        """Keep the leases of running broadcasts and claim the unfinished
+        ones in background"""
+        self._resume_task = asyncio.create_task(self._resume_forever())
+
+    async def _resume_forever(self) -> None:
+        while True:
+            try:
+                await self.renew_leases()
+                await self.resume_unfinished()
+            except Exception:
+                log.exception('resuming broadcasts failed')
+            await asyncio.sleep(self._lease / 3)
+
+    async def renew_leases(self) -> None:
+        if not self._tasks:
+            return
+        renewed = await self._data.renew(
+            list(self._tasks), self._owner, self._lease)
+        for broadcast_id in set(self._tasks) - set(renewed):
+            log.error(f'lease of broadcast {broadcast_id} lost, stopping it')
+            self._tasks[broadcast_id].cancel()
+
+    async def resume_unfinished(self) -> None:
+        for broadcast_id, audience, from_chat_id, message_id, \
+                last_tg_id, _, _ in await self._data.claim_unfinished(
+                    self._owner, self._lease):
+            # its lease ran out while it was still running here
+            if broadcast_id in self._tasks:
+                continue
+            log.info(f'resuming broadcast {broadcast_id} '
+                     f'after tg_id {last_tg_id}')
+            self._spawn(broadcast_id, audience, from_chat_id,
+                        message_id, last_tg_id)
+
+    async def close(self) -> None:
+        """Stop running broadcasts and release them, they resume in the
+        next process that checks for them"""
+        if self._resume_task is not None:
+            self._resume_task.cancel()
+            self._resume_task = None
+        broadcast_ids = list(self._tasks)
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        if broadcast_ids:
+            await self._data.release(broadcast_ids, self._owner)
+
+    def _spawn(self, broadcast_id: int, *args) -> None:
+        task = asyncio.create_task(self._run(broadcast_id, *args))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(
+            lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _send(self, tg_id: int, from_chat_id: int,
+                    message_id: int) -> str | None:
+        """None if sent, otherwise the reason why not"""
+        try:
+            await self._outbox.call(
+                BROADCAST,
+                chat_id=tg_id,
+                method='copy_message',
+                from_chat_id=from_chat_id,
+                message_id=message_id
+            )
+        except exceptions.BotBlocked:
+            return 'blocked'
+        except exceptions.UserDeactivated:
+            return 'deactivated'
+        except exceptions.ChatNotFound:
+            return 'chat not found'
+        except exceptions.TelegramAPIError as error:
+            return f'error: {error}'
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            log.warning(f'broadcast to {tg_id} failed: {error!r}')
+            return f'network error: {error!r}'
+        return None
+
+    async def _save_as_sent(self, broadcast_id: int, chunk: list,
+                            sends: list) -> bool:
+        """Save progress every `progress_every` recipients of a chunk
+        being sent; False if the broadcast was claimed by another process"""
+        sent = 0
+        failures = []
+        for number, (tg_id, send) in enumerate(zip(chunk, sends), start=1):
+            reason = await send
+            if reason:
+                failures.append((tg_id, reason))
+            else:
+                sent += 1
+            if number % self._progress_every and number < len(chunk):
+                continue
+            if not await self._data.save_progress(
+                    broadcast_id, self._owner, tg_id, sent, failures):
+                return False
+            sent = 0
+            failures = []
+        return True
+
+    async def _run(self, broadcast_id: int, audience: str,
+                   from_chat_id: int, message_id: int,
+                   last_tg_id: int) -> None:
+        while True:
+            chunk = await self._data.get_recipients(
+                audience, last_tg_id, self._chunk_size)
+            if not chunk:
+                break
+            sends = [asyncio.create_task(
+                         self._send(tg_id, from_chat_id, message_id))
+                     for tg_id in chunk]
+            try:
+                owned = await self._save_as_sent(
+                    broadcast_id, chunk, sends)
+            finally:
+                # those not sent yet, when stopped
+                for send in sends:
+                    send.cancel()
+            if not owned:
+                log.error(f'broadcast {broadcast_id} was claimed by '
+                          f'another process, stopping it')
+                return
+            last_tg_id = chunk[-1]
+        sent, failed = await self._data.finish(broadcast_id)
+        log.info(f'broadcast {broadcast_id} finished: '
+                 f'{sent} sent, {failed} failed')
+        if self._on_finished is not None:
+            await self._on_finished(broadcast_id, sent, failed)
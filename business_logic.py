@@ -1,11 +1,21 @@
 from __future__ import annotations
-from collections import defaultdict
+import abc
+import asyncio
 import logging
 
-from db_managing import CustomerData, OperatorData, SupportBotData,\
-    TgUserData,  TextMessageData, UserNotFound, PhoneAlreadyExists,\
-    CustomerNotFound, MsgNotFound
-from airtable_db import PhoneNotFound, find_name_by_phone_test
+from cache import ObjectCache
+from config import OBJECT_CACHE_CAPACITY, OBJECT_CACHE_TTL, \
+    AIRTABLE_SYNC_INTERVAL, AIRTABLE_FULL_SYNC_INTERVAL, \
+    AIRTABLE_NEGATIVE_TTL, AIRTABLE_LOOKUP_ON_MISS, PROFILE_CACHE_CAPACITY, \
+    PROFILE_CACHE_TTL, MESSAGE_WRITE_INTERVAL, MESSAGE_WRITE_BATCH_SIZE
+from db_managing import BAN_CHANNEL, UserNotFound, PhoneAlreadyExists,\
+    CustomerNotFound, MsgNotFound, CustomerData
+from db_async import AsyncCustomerData, AsyncOperatorData,\
+    AsyncSupportBotData, AsyncTgUserData, AsyncTextMessageData
+from db_notify import NotifyListener
+from message_writer import MessageWriter
+from airtable_db import PhoneNotFound, get_table
+from phone_directory import PhoneDirectory
 
 
 # Configure logging
@@ -21,37 +31,190 @@ class PhoneAlreadyBelongsCustomer(Exception):
     pass
 
 
-class CacheMixin(object):
-    __all_objects = defaultdict(dict)
+class CacheMixin(abc.ABC):
+    """Keeps one instance per key in a bounded per-class ObjectCache.
+
+    Subclasses implement `load(key)` and may override `cache_capacity`
+    and `cache_ttl`.
+    """
+    cache_capacity = OBJECT_CACHE_CAPACITY
+    cache_ttl = OBJECT_CACHE_TTL
+    __caches = {}
 
     def __init__(self, key):
-        self.__all_objects[self.__class__][key] = self
+        self.cache().put(key, self)
+
+    @classmethod
+    def cache(cls) -> ObjectCache:
+        if cls not in cls.__caches:
+            cls.__caches[cls] = ObjectCache(
+                capacity=cls.cache_capacity,
+                ttl=cls.cache_ttl
+            )
+        return cls.__caches[cls]
+
+    @classmethod
+    async def get(cls, key):
+        object_ = cls.cache().get(key)
+        if object_ is not None:
+            return object_
+        return await cls.load(key)
+
+    @classmethod
+    @abc.abstractmethod
+    async def load(cls, key):
+        """The instance of `key` read from the database"""
+
+    @classmethod
+    def invalidate(cls, key) -> None:
+        cls.cache().invalidate(key)
 
     @classmethod
-    def get(cls, key):
-        if key in cls.__all_objects[cls]:
-            object_ = cls.__all_objects[cls][key]
-            if object_ is not None:
-                return object_
-        return cls(key)
+    def cache_stats(cls) -> dict:
+        return {class_.__name__: cache.stats()
+                for class_, cache in cls.__caches.items()}
+
+
+class BanIndex():
+    """Set of banned tg ids, checked without any I/O"""
+
+    def __init__(self):
+        self._banned = set()
+
+    def __contains__(self, tg_id: int) -> bool:
+        return tg_id in self._banned
+
+    def __len__(self) -> int:
+        return len(self._banned)
+
+    def reload(self, tg_ids: list) -> None:
+        self._banned = set(tg_ids)
+
+    def ban(self, tg_id: int) -> None:
+        self._banned.add(tg_id)
+
+    def unban(self, tg_id: int) -> None:
+        self._banned.discard(tg_id)
+
+    def apply_notify(self, payload: str) -> None:
+        """Apply a '<tg_id>:TRUE|FALSE' notification from BAN_CHANNEL"""
+        tg_id, is_banned = payload.split(':')
+        if is_banned == 'TRUE':
+            self.ban(int(tg_id))
+        else:
+            self.unban(int(tg_id))
+
+
+ban_index = BanIndex()
+
+# cached for tg users who are not customers
+NOT_A_CUSTOMER = ()
+
+
+class ProfileCache():
+    """Names of customers by tg_id, for the signature of their posts.
+
+    Tg users who are not customers are cached as such, so a message of
+    any known user needs no query. Concurrent misses for a tg_id share
+    one query. Filled when a customer registers or changes their name.
+    """
+
+    def __init__(self, capacity: int, ttl: float):
+        self._cache = ObjectCache(capacity=capacity, ttl=ttl)
+        self._loading = {}
+        self._data = AsyncSupportBotData()
+
+    async def get(self, tg_id: int) -> tuple | None:
+        """(first_name, last_name) of a customer, None for others"""
+        profile = self._cache.get(tg_id)
+        if profile is None:
+            task = self._loading.get(tg_id)
+            if task is None:
+                task = self._loading[tg_id] = \
+                    asyncio.create_task(self._load(tg_id))
+                task.add_done_callback(
+                    lambda _: self._forget_loading(tg_id, task))
+            # a cancelled caller doesn't cancel the others' query
+            profile = await asyncio.shield(task)
+        return profile or None
+
+    async def _load(self, tg_id: int) -> tuple:
+        profile = await self._data.get_customer_name(tg_id) or NOT_A_CUSTOMER
+        # unless put() has been called meanwhile
+        if self._loading.get(tg_id) is asyncio.current_task():
+            self._cache.put(tg_id, tuple(profile))
+        return profile
+
+    def _forget_loading(self, tg_id: int, task: asyncio.Task) -> None:
+        if self._loading.get(tg_id) is task:
+            del self._loading[tg_id]
+
+    def put(self, tg_id: int, first_name: str, last_name: str) -> None:
+        self._loading.pop(tg_id, None)
+        self._cache.put(tg_id, (first_name, last_name))
+
+    def invalidate(self, tg_id: int) -> None:
+        self._loading.pop(tg_id, None)
+        self._cache.invalidate(tg_id)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+customer_profiles = ProfileCache(
+    capacity=PROFILE_CACHE_CAPACITY,
+    ttl=PROFILE_CACHE_TTL
+)
 
 
 class SupportBot():
     def __init__(self):
-        self.support_bot_data = SupportBotData()
+        self.support_bot_data = AsyncSupportBotData()
+        self.ban_index = ban_index
+        self.customer_profiles = customer_profiles
+        self.message_writer = MessageWriter(
+            interval=MESSAGE_WRITE_INTERVAL,
+            batch_size=MESSAGE_WRITE_BATCH_SIZE
+        )
+        self.ban_listener = NotifyListener(
+            channel=BAN_CHANNEL,
+            on_notify=self.ban_index.apply_notify,
+            on_connect=self.load_ban_list
+        )
+        self.phone_directory = PhoneDirectory(
+            table=get_table(),
+            sync_interval=AIRTABLE_SYNC_INTERVAL,
+            full_sync_interval=AIRTABLE_FULL_SYNC_INTERVAL,
+            negative_ttl=AIRTABLE_NEGATIVE_TTL,
+            lookup_on_miss=AIRTABLE_LOOKUP_ON_MISS
+        )
+
+    async def load_ban_list(self) -> None:
+        self.ban_index.reload(await self.support_bot_data.get_ban_list())
+        log.info(f'ban list loaded: {len(self.ban_index)} users')
 
-    def add_tg_user(self, tg_id: int, tg_username: int) -> None:
-        self.support_bot_data.add_tg_user(
+    async def start_ban_sync(self) -> None:
+        """Load the ban list and keep it in sync with other bot processes"""
+        await self.ban_listener.start()
+        if not self.ban_listener.connected:
+            # no LISTEN yet, the list is loaded again once it is up
+            await self.load_ban_list()
+
+    def is_banned(self, tg_id: int) -> bool:
+        return tg_id in self.ban_index
+
+    async def add_tg_user(self, tg_id: int, tg_username: int) -> None:
+        await self.support_bot_data.add_tg_user(
           tg_id=tg_id,
           tg_username=tg_username
         )
 
-    def add_operator(self, tg_id: int):
-        self.support_bot_data.add_operator(
+    async def add_operator(self, tg_id: int):
+        await self.support_bot_data.add_operator(
           tg_id=tg_id
         )
 
-    def add_customer(self, tg_id: int, phone: str) -> Customer:
+    async def add_customer(self, tg_id: int, phone: str) -> Customer:
         """_summary_
 
         Args:
@@ -66,55 +229,91 @@ class SupportBot():
         Returns:
             Customer: _description_
         """
+        # from memory, Airtable is asked only about unknown phones
         try:
-            name = find_name_by_phone_test(phone=phone)  # test !!!
+            name = await self.phone_directory.find_name(phone)
         except PhoneNotFound:
             raise UserNotFoundOnSite('phone not found')
 
+        # written and read back in one statement
         try:
-            customer_id = self.support_bot_data.add_customer(tg_id, phone)
-            customer = Customer(customer_id)
+            row = await self.support_bot_data.onboard_customer(
+                tg_id, phone, name)
         except PhoneAlreadyExists:
-            customer = self.get_customer_by_tg_id(tg_id)
-            if not customer:
-                raise PhoneAlreadyBelongsCustomer()
-
-        customer.change_first_name(name)
+            raise PhoneAlreadyBelongsCustomer()
+        customer = Customer(
+            row[0], AsyncCustomerData(CustomerData.from_row(*row)))
+        customer._update_profile()
         return customer
 
-    def add_textmessage(self, tg_id: int, support_chat_message_id: int):
-        self.support_bot_data.add_message(
+    async def add_textmessage(self, tg_id: int, support_chat_message_id: int,
+                              album_part_ids: list = ()):
+        """Queued, written together with other new messages"""
+        self.message_writer.add(
             tg_id=tg_id,
-            support_chat_message_id=support_chat_message_id
+            support_chat_message_id=support_chat_message_id,
+            album_part_ids=album_part_ids
         )
 
-    def get_customer_list(self) -> list:
-        customers_tg_ids = self.support_bot_data.get_customer_list()
+    async def get_customer_list(self) -> list:
+        customers_tg_ids = await self.support_bot_data.get_customer_list()
         return customers_tg_ids
 
-    def get_tg_users(self) -> list:
+    async def get_tg_users(self) -> list:
         """Returning not customers tg ids"""
-        not_customers_tg_id = self.support_bot_data.get_tg_users()
+        not_customers_tg_id = await self.support_bot_data.get_tg_users()
         return not_customers_tg_id
 
-    def get_ban_list(self) -> list:
-        ban_tg_ids = self.support_bot_data.get_ban_list()
+    async def get_ban_list(self) -> list:
+        ban_tg_ids = await self.support_bot_data.get_ban_list()
         return ban_tg_ids
 
-    def get_textmessage_by(
+    async def get_textmessage_by(
                 self, support_chat_message_id: int) -> TextMessage | None:
+        await self.message_writer.flush_for(support_chat_message_id)
         try:
-            textmsg_id = self.support_bot_data.get_textmessage_id(
+            textmsg_id = await self.support_bot_data.get_textmessage_id(
                 support_chat_message_id=support_chat_message_id
             )
-            return TextMessage.get(textmsg_id)
+            return await TextMessage.get(textmsg_id)
+        except MsgNotFound:
+            return None
+
+    async def get_message_view(
+            self, support_chat_message_id: int) -> MessageView | None:
+        await self.message_writer.flush_for(support_chat_message_id)
+        try:
+            view = await self.support_bot_data.get_message_view(
+                support_chat_message_id=support_chat_message_id
+            )
+            return MessageView(*view)
+        except MsgNotFound:
+            return None
+
+    async def set_message_answered(
+            self, support_chat_message_id: int,
+            is_answered: bool) -> MessageView | None:
+        await self.message_writer.flush_for(support_chat_message_id)
+        try:
+            view = await self.support_bot_data.set_message_answered(
+                support_chat_message_id=support_chat_message_id,
+                is_answered=is_answered
+            )
         except MsgNotFound:
             return None
+        message_view = MessageView(*view)
+        TextMessage.invalidate(message_view.text_message_id)
+        return message_view
+
+    async def get_customer_name(self, tg_id: int) -> tuple | None:
+        """(first_name, last_name) of a customer, None for other tg users,
+        served from memory once known"""
+        return await self.customer_profiles.get(tg_id)
 
-    def get_customer_by_tg_id(self, tg_id: int) -> Customer | None:
+    async def get_customer_by_tg_id(self, tg_id: int) -> Customer | None:
         try:
-            customer_id = self.support_bot_data.get_customer_id(tg_id)
-            return Customer.get(customer_id)
+            customer_id = await self.support_bot_data.get_customer_id(tg_id)
+            return await Customer.get(customer_id)
         except CustomerNotFound:
             log.error('customer not found')
             return None
@@ -123,11 +322,32 @@ class SupportBot():
             return None
 
 
+class MessageView():
+    """State of a support chat message, loaded in one query.
+
+    support_chat_message_id is the post with the keyboard, which differs
+    from the one asked for when that is a photo of an album.
+    """
+
+    def __init__(self, text_message_id: int, tg_id: int,
+                 is_answered: bool, is_banned: bool,
+                 support_chat_message_id: int):
+        self.text_message_id = text_message_id
+        self.tg_id = tg_id
+        self.is_answered = is_answered
+        self.is_banned = is_banned
+        self.support_chat_message_id = support_chat_message_id
+
+
 class TgUser(CacheMixin):
-    def __init__(self, tg_id: int):
+    def __init__(self, tg_id: int, tg_data: AsyncTgUserData):
         super(TgUser, self).__init__(key=tg_id)
         self.tg_id = tg_id
-        self.tg_data = TgUserData(tg_id)
+        self.tg_data = tg_data
+
+    @classmethod
+    async def load(cls, tg_id: int) -> TgUser:
+        return cls(tg_id, await AsyncTgUserData.load(tg_id))
 
     def get_tg_id(self) -> int:
         return self.tg_id
@@ -139,40 +359,49 @@ class TgUser(CacheMixin):
         else:
             return username
 
-    def is_banned(self) -> bool:
-        return self.tg_data.is_banned()
+    async def is_banned(self) -> bool:
+        return await self.tg_data.is_banned()
 
 
 class Operator(TgUser):
-    def __init__(self, tg_id: int):
-        super(Operator, self).__init__(tg_id=tg_id)
+    def __init__(self, tg_id: int, tg_data: AsyncTgUserData):
+        super(Operator, self).__init__(tg_id=tg_id, tg_data=tg_data)
 
-        self.operator_data = OperatorData()
+        self.operator_data = AsyncOperatorData()
 
     def get_tg_id(self):
         return self.operator_data.get_tg_id()
 
     @staticmethod
-    def ban(tg_id: int) -> None:
+    async def ban(tg_id: int) -> None:
         try:
-            OperatorData.ban(tg_id)
+            await AsyncOperatorData.ban(tg_id)
+            ban_index.ban(tg_id)
+            TgUser.invalidate(tg_id)
             log.info(f'tg_user going to the ban: {tg_id}')
         except UserNotFound:
             log.error(f'tg_user_not_found: {tg_id}')
 
     @staticmethod
-    def unban(tg_id: int) -> None:
+    async def unban(tg_id: int) -> None:
         try:
-            OperatorData.unban(tg_id)
+            await AsyncOperatorData.unban(tg_id)
+            ban_index.unban(tg_id)
+            TgUser.invalidate(tg_id)
             log.info(f'tg_user was unbaned: {tg_id}')
         except UserNotFound:
             log.error(f'tg_user_not_found: {tg_id}')
 
 
 class Customer(CacheMixin):
-    def __init__(self, gameuser_id: int):
+    def __init__(self, gameuser_id: int, customer_data: AsyncCustomerData):
+        super(Customer, self).__init__(key=gameuser_id)
         self.gameuser_id = gameuser_id
-        self.customer_data = CustomerData(self.gameuser_id)
+        self.customer_data = customer_data
+
+    @classmethod
+    async def load(cls, gameuser_id: int) -> Customer:
+        return cls(gameuser_id, await AsyncCustomerData.load(gameuser_id))
 
     def get_tg_id(self) -> int:
         return self.customer_data.get_tg_id()
@@ -183,40 +412,59 @@ class Customer(CacheMixin):
     def get_last_name(self) -> str:
         return self.customer_data.get_last_name()
 
-    def change_last_name(self, new_last_name: str) -> None:
-        self.customer_data.change_last_name(
+    async def change_last_name(self, new_last_name: str) -> None:
+        await self.customer_data.change_last_name(
             new_last_name=new_last_name
         )
+        Customer.invalidate(self.gameuser_id)
         # update data from DB
-        self.customer_data = CustomerData(self.gameuser_id)
+        self.customer_data = await AsyncCustomerData.load(self.gameuser_id)
+        self._update_profile()
 
-    def change_first_name(self, new_first_name: str) -> None:
-        self.customer_data.change_first_name(
+    async def change_first_name(self, new_first_name: str) -> None:
+        await self.customer_data.change_first_name(
             new_first_name=new_first_name
         )
+        Customer.invalidate(self.gameuser_id)
         # update data from DB
-        self.customer_data = CustomerData(self.gameuser_id)
+        self.customer_data = await AsyncCustomerData.load(self.gameuser_id)
+        self._update_profile()
+
+    def _update_profile(self) -> None:
+        customer_profiles.put(
+            self.get_tg_id(), self.get_first_name(), self.get_last_name())
 
 
 class TextMessage(CacheMixin):
-    def __init__(self, text_message_id: int):
+    def __init__(self, text_message_id: int,
+                 text_message_data: AsyncTextMessageData):
+        super(TextMessage, self).__init__(key=text_message_id)
         self.text_message_id = text_message_id
-        self.text_message_data = TextMessageData(self.text_message_id)
+        self.text_message_data = text_message_data
+
+    @classmethod
+    async def load(cls, text_message_id: int) -> TextMessage:
+        return cls(
+            text_message_id,
+            await AsyncTextMessageData.load(text_message_id)
+        )
 
     def get_tg_id(self) -> int:
         return self.text_message_data.get_tg_id()
 
-    def get_tg_user(self) -> TgUser:
-        return TgUser.get(self.get_tg_id())
+    async def get_tg_user(self) -> TgUser:
+        return await TgUser.get(self.get_tg_id())
 
     def get_support_chat_message_id(self) -> str:
         return self.text_message_data.get_support_chat_message_id()
 
-    def is_answered(self) -> bool:
-        return self.text_message_data.is_answered()
+    async def is_answered(self) -> bool:
+        return await self.text_message_data.is_answered()
 
-    def mark_answered(self) -> None:
-        self.text_message_data.mark_answered()
+    async def mark_answered(self) -> None:
+        await self.text_message_data.mark_answered()
+        TextMessage.invalidate(self.text_message_id)
 
-    def mark_unanswered(self) -> None:
-        self.text_message_data.mark_unanswered()
+    async def mark_unanswered(self) -> None:
+        await self.text_message_data.mark_unanswered()
+        TextMessage.invalidate(self.text_message_id)
@@ -1,4 +1,77 @@
 API_TOKEN = ''
+SUPPORT_CHAT_ID = 0
+# Bot API server, may point to a local Bot API server or a fake one for tests
+TELEGRAM_API_SERVER = 'https://api.telegram.org'
+
+# webhook mode instead of long polling, TLS is terminated by a reverse proxy
+# which forwards WEBHOOK_HOST + WEBHOOK_PATH to WEBAPP_HOST:WEBAPP_PORT
+USE_WEBHOOK = False
+WEBHOOK_HOST = 'https://example.com'
+WEBHOOK_PATH = '/support_bot'
+WEBAPP_HOST = '127.0.0.1'
+WEBAPP_PORT = 8080
+# parallel webhook connections Telegram may open (1-100)
+WEBHOOK_MAX_CONNECTIONS = 40
+# seconds to wait for in-flight updates on shutdown
+WEBHOOK_SHUTDOWN_TIMEOUT = 30
+
+# worker processes handling updates, every customer is always handled by
+# the same one; with more than 1 run `python supervisor.py`, which
+# receives the updates and routes them. Outbound rates below are split
+# between the workers, each has its own DB pool of DB_POOL_MAX_SIZE
+WORKERS = 1
+# index of this worker process, set by the supervisor
+SHARD = 0
+
+# Telegram flood limits for outgoing messages (messages per second)
+OUTBOUND_GLOBAL_RATE = 30
+OUTBOUND_PRIVATE_CHAT_RATE = 1
+OUTBOUND_GROUP_CHAT_RATE = 20 / 60
+OUTBOUND_WORKERS = 8
+# RetryAfter answers waited out before a send is given up
+OUTBOUND_MAX_RETRIES = 5
+# recipients read from the database and sent at once per broadcast step
+BROADCAST_CHUNK_SIZE = 1000
+# recipients between saves of a broadcast's progress, at most this many
+# get the message twice when the broadcast is resumed
+BROADCAST_PROGRESS_EVERY = 10
+# seconds a process holds a running broadcast without renewing it, after
+# that another process resumes it
+BROADCAST_LEASE = 5 * 60
+
+# assign every customer message to an operator on shift:
+# 'least_outstanding', 'round_robin' or None to leave it to whoever replies
+OPERATOR_ASSIGNMENT = 'least_outstanding'
+# seconds after which an unanswered message goes to another operator
+OPERATOR_REASSIGN_AFTER = 15 * 60
+OPERATOR_ASSIGNMENT_CHECK_INTERVAL = 30
+
+# seconds to wait for more texts of a customer before posting them together
+TICKET_DEBOUNCE = 2
+# texts are appended to the customer's open post until it is answered
+# or has not changed for this many seconds
+TICKET_IDLE_TIMEOUT = 30 * 60
+# seconds to wait for more photos of an album before posting it
+MEDIA_GROUP_WINDOW = 1
+
+# update_ids remembered in memory to drop updates delivered twice
+UPDATE_DEDUP_RING_SIZE = 10000
+# seconds between saves of the last handled update_id, which drops
+# the updates Telegram delivers again after a restart
+UPDATE_WATERMARK_FLUSH_INTERVAL = 1
+
+# private messages per second a customer may send after a burst of
+# FLOOD_BURST, the rest is dropped before any handler (an album is a
+# message per photo)
+FLOOD_RATE = 1
+FLOOD_BURST = 20
+# messages dropped in a row that get a customer banned, 0 never bans
+FLOOD_BAN_AFTER = 0
+
+# Prometheus-style /metrics on a local port, scraped by the monitoring
+METRICS_ENABLED = True
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9100
 
 DB_HOST = "localhost"
 DB_NAME = "support_db"
@@ -6,6 +79,54 @@ DB_USER = "bot"
 DB_PASS = "bot"
 DB_PORT = "5432"
 
+DB_POOL_MIN_SIZE = 1
+DB_POOL_MAX_SIZE = 10
+# seconds of idle time after which a pooled connection is pinged before use
+DB_POOL_HEALTH_CHECK_INTERVAL = 30
+
+# per-class bound and lifetime (seconds) of cached TgUser/Customer/TextMessage
+OBJECT_CACHE_CAPACITY = 10000
+OBJECT_CACHE_TTL = 600
+# names of customers by tg_id for the signature of their posts; names
+# change only through the bot, the ttl is for other bot processes
+PROFILE_CACHE_CAPACITY = 100000
+PROFILE_CACHE_TTL = 60 * 60
+
+# new message rows are written together, this many seconds after the
+# first of them or once this many are queued
+MESSAGE_WRITE_INTERVAL = 0.005
+MESSAGE_WRITE_BATCH_SIZE = 500
+
+# answered messages older than this (seconds) move to message_archive
+MESSAGE_ARCHIVE_AFTER = 90 * 24 * 60 * 60
+# seconds between archival rounds and rows moved per transaction
+MESSAGE_ARCHIVE_INTERVAL = 60 * 60
+MESSAGE_ARCHIVE_BATCH_SIZE = 1000
+# seconds between batches, leaves room for the bot's own queries
+MESSAGE_ARCHIVE_BATCH_PAUSE = 0.1
+# monthly partitions of message created in advance
+MESSAGE_PARTITIONS_AHEAD = 2
+
+# 'postgres' keeps FSM states in the fsm_state table, 'memory' in the process
+FSM_STORAGE = 'postgres'
+# seconds after which an untouched state (e.g. abandoned onboarding) expires
+FSM_STATE_TTL = 24 * 60 * 60
+# size of the write-through in-memory layer, 0 to read every state from DB;
+# every private update looks its state up, states are only kept for
+# private chats and a customer is always handled by the same process
+FSM_MEMORY_CACHE_SIZE = 10_000
+
+# keep the in-memory ban list of several bot processes in sync
+# through Postgres LISTEN/NOTIFY
+BAN_LIST_SYNC = True
+
 AIRTABLE_API_KEY = ''
 BASE_ID = ''
 TABLE_NAME = ''
+# seconds between pulls of records modified in Airtable / of the whole table
+AIRTABLE_SYNC_INTERVAL = 5 * 60
+AIRTABLE_FULL_SYNC_INTERVAL = 24 * 60 * 60
+# seconds an unknown phone is not looked up again
+AIRTABLE_NEGATIVE_TTL = 10 * 60
+# look up a phone missing from the local directory in Airtable directly
+AIRTABLE_LOOKUP_ON_MISS = True
@@ -0,0 +1,115 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+
+from config import DB_POOL_MAX_SIZE
+from db_managing import BroadcastData, CustomerData, FSMStateData, \
+    MessageArchiveData, OperatorAssignmentData, OperatorData, \
+    PhoneDirectoryData, SupportBotData, TgUserData, TextMessageData, \
+    UpdateWatermarkData
+
+# one worker per pooled connection, so a query never waits for the pool
+# and at most DB_POOL_MAX_SIZE queries run at the same time
+db_executor = ThreadPoolExecutor(
+    max_workers=DB_POOL_MAX_SIZE,
+    thread_name_prefix='db'
+)
+
+
+async def run_in_db(func, *args, **kwargs):
+    """Run a blocking db_managing call without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    # the call sees the caller's context vars, e.g. metrics.db_usage
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        db_executor, functools.partial(context.run, func, *args, **kwargs))
+
+
+def awaitable(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_db(func, *args, **kwargs)
+    return wrapper
+
+
+class _AsyncStaticData:
+    """Awaitable facade over a class of static db methods"""
+    _data_class = None
+
+    def __getattr__(self, name):
+        method = awaitable(getattr(self._data_class, name))
+        setattr(self, name, method)
+        return method
+
+
+class _AsyncData:
+    """Awaitable facade over a db_managing data object.
+
+    Methods listed in `_blocking_methods` hit the database and become
+    coroutines, everything else is served from the loaded object.
+    """
+    _data_class = None
+    _blocking_methods = ()
+
+    def __init__(self, data):
+        self._data = data
+
+    @classmethod
+    async def load(cls, key: int):
+        return cls(await run_in_db(cls._data_class, key))
+
+    def __getattr__(self, name):
+        attr = getattr(self._data, name)
+        if name in self._blocking_methods:
+            return awaitable(attr)
+        return attr
+
+
+class AsyncSupportBotData(_AsyncStaticData):
+    _data_class = SupportBotData
+
+
+class AsyncFSMStateData(_AsyncStaticData):
+    _data_class = FSMStateData
+
+
+class AsyncPhoneDirectoryData(_AsyncStaticData):
+    _data_class = PhoneDirectoryData
+
+
+class AsyncBroadcastData(_AsyncStaticData):
+    _data_class = BroadcastData
+
+
+class AsyncMessageArchiveData(_AsyncStaticData):
+    _data_class = MessageArchiveData
+
+
+class AsyncOperatorAssignmentData(_AsyncStaticData):
+    _data_class = OperatorAssignmentData
+
+
+class AsyncUpdateWatermarkData(_AsyncStaticData):
+    _data_class = UpdateWatermarkData
+
+
+class AsyncTgUserData(_AsyncData):
+    _data_class = TgUserData
+    _blocking_methods = ('is_banned',)
+
+
+class AsyncOperatorData(_AsyncData):
+    _data_class = OperatorData
+    ban = staticmethod(awaitable(OperatorData.ban))
+    unban = staticmethod(awaitable(OperatorData.unban))
+
+
+class AsyncCustomerData(_AsyncData):
+    _data_class = CustomerData
+    _blocking_methods = ('change_first_name', 'change_last_name')
+
+
+class AsyncTextMessageData(_AsyncData):
+    _data_class = TextMessageData
+    _blocking_methods = ('is_answered', 'mark_answered', 'mark_unanswered')
@@ -1,18 +1,17 @@
+import logging
+
 import psycopg2
-from config import DB_HOST, DB_NAME, DB_USER, DB_PASS, DB_PORT
+from db_pool import db_config
+from migrate import apply_migrations
 
-db_config = {'host': DB_HOST,
-             'dbname': DB_NAME,
-             'user': DB_USER,
-             'password': DB_PASS,
-             'port': DB_PORT}
+logging.basicConfig(level=logging.INFO)
 
 print('connection to database')
 connection = psycopg2.connect(**db_config)
-with connection.cursor() as cursor:
-    print('starting sql file')
-    cursor.execute(open("./migrations/001_init_tables.sql", "r").read())
-    print('end of sql file')
-connection.commit()
+print('applying migrations')
+applied = apply_migrations(connection)
 connection.close()
-print('data base successfully deployed')
+if applied:
+    print(f'data base successfully migrated: {applied}')
+else:
+    print('data base is up to date')
@@ -1,11 +1,15 @@
-import psycopg2
-from config import DB_HOST, DB_NAME, DB_USER, DB_PASS, DB_PORT
+from __future__ import annotations
 
-db_config = {'host': DB_HOST,
-             'dbname': DB_NAME,
-             'user': DB_USER,
-             'password': DB_PASS,
-             'port': DB_PORT}
+from psycopg2 import errors, sql
+from psycopg2.extras import Json, execute_values
+
+from db_pool import db_pool
+from metrics import instrument_db
+
+BAN_CHANNEL = 'tg_user_ban'
+# first key of pg_advisory_xact_lock(MESSAGE_LOCK, hashint8(scm_id)):
+# the partitioned message table can't keep support_chat_message_id unique
+MESSAGE_LOCK = 1
 
 
 class UserNotFound(Exception):
@@ -28,55 +32,203 @@ class PhoneAlreadyExists(Exception):
     pass
 
 
+def _restore_archived(cursor, column: str, value: int) -> tuple | None:
+    """Move an archived message back to message as unanswered,
+    returns its view like SupportBotData.get_message_view"""
+    restore_script = sql.SQL('''
+        WITH restored AS (
+            DELETE FROM message_archive
+            WHERE {column} = %s
+            RETURNING text_message_id, tg_id, support_chat_message_id,
+                      created_at),
+        inserted AS (
+            INSERT INTO message (text_message_id, tg_id,
+                                 support_chat_message_id, created_at)
+            SELECT text_message_id, tg_id, support_chat_message_id,
+                   created_at
+            FROM restored
+            RETURNING text_message_id, tg_id, is_answered,
+                      support_chat_message_id)
+        SELECT inserted.text_message_id, inserted.tg_id,
+               inserted.is_answered, tg_user.is_banned,
+               inserted.support_chat_message_id
+        FROM inserted
+        INNER JOIN tg_user
+        ON tg_user.tg_id = inserted.tg_id;''').format(
+            column=sql.Identifier(column))
+    cursor.execute(restore_script, (value,))
+    return cursor.fetchone()
+
+
+# the statements of the hot paths are module constants, so that
+# benchmarks/explain_queries.py and the query plan tests EXPLAIN exactly
+# what runs
+add_tg_user_script = '''
+    INSERT INTO tg_user (tg_id, tg_username)
+    VALUES (%s, %s)
+    ON CONFLICT (tg_id)
+    DO UPDATE
+    SET tg_username = EXCLUDED.tg_username;'''
+
+does_user_exist_script = '''
+    SELECT exists(
+       SELECT tg_id
+       FROM tg_user
+       WHERE tg_id = %s);'''
+
+onboard_customer_script = '''
+    WITH taken AS (
+        SELECT 1
+        FROM customer
+        WHERE phone = %(phone)s
+        AND tg_id IS DISTINCT FROM %(tg_id)s),
+    upserted AS (
+        INSERT INTO customer (tg_id, phone, first_name)
+        SELECT %(tg_id)s, %(phone)s, %(first_name)s
+        WHERE NOT EXISTS (SELECT 1 FROM taken)
+        ON CONFLICT (tg_id)
+        DO UPDATE
+        SET phone = EXCLUDED.phone,
+            first_name = EXCLUDED.first_name
+        RETURNING customer_id, tg_id, phone, first_name,
+                  last_name),
+    renamed AS (
+        UPDATE customer
+        SET first_name = %(first_name)s
+        WHERE tg_id = %(tg_id)s
+        AND EXISTS (SELECT 1 FROM taken)
+        RETURNING customer_id, tg_id, phone, first_name,
+                  last_name)
+    SELECT * FROM upserted
+    UNION ALL
+    SELECT * FROM renamed;'''
+
+does_phone_exist_script = '''
+    SELECT exists(
+       SELECT phone
+       FROM customer
+       WHERE phone = %s);'''
+
+add_message_script = '''
+    INSERT INTO message (tg_id, support_chat_message_id)
+    SELECT %s, %s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM message
+        WHERE support_chat_message_id = %s)
+    RETURNING text_message_id;'''
+
+add_messages_script = '''
+    INSERT INTO message (tg_id, support_chat_message_id)
+    SELECT new.tg_id, new.support_chat_message_id
+    FROM (VALUES %s) AS new (tg_id, support_chat_message_id)
+    WHERE NOT EXISTS (
+        SELECT 1 FROM message
+        WHERE message.support_chat_message_id =
+              new.support_chat_message_id)
+    RETURNING support_chat_message_id;'''
+
+get_textmessage_id_script = '''
+    SELECT text_message_id
+    FROM message
+    WHERE support_chat_message_id = %s
+    UNION ALL
+    SELECT text_message_id
+    FROM message_archive
+    WHERE support_chat_message_id = %s
+    LIMIT 1;'''
+
+get_message_view_script = '''
+    WITH post AS (
+        SELECT coalesce(
+            (SELECT post_support_chat_message_id
+             FROM message_album_part
+             WHERE support_chat_message_id = %s),
+            %s) AS support_chat_message_id)
+    SELECT message.text_message_id, message.tg_id,
+           message.is_answered, tg_user.is_banned,
+           message.support_chat_message_id
+    FROM (
+        SELECT text_message_id, tg_id, is_answered,
+               support_chat_message_id
+        FROM message
+        WHERE support_chat_message_id = (
+            SELECT support_chat_message_id FROM post)
+        UNION ALL
+        SELECT text_message_id, tg_id, TRUE,
+               support_chat_message_id
+        FROM message_archive
+        WHERE support_chat_message_id = (
+            SELECT support_chat_message_id FROM post)
+        LIMIT 1) AS message
+    INNER JOIN tg_user
+    ON tg_user.tg_id = message.tg_id;'''
+
+set_message_answered_script = '''
+    UPDATE message
+    SET is_answered = %s,
+        answered_at = CASE WHEN %s THEN now() END
+    FROM tg_user
+    WHERE message.support_chat_message_id = %s
+    AND tg_user.tg_id = message.tg_id
+    RETURNING message.text_message_id, message.tg_id,
+              message.is_answered, tg_user.is_banned,
+              message.support_chat_message_id;'''
+
+get_customer_id_script = '''
+    SELECT customer.customer_id
+    FROM tg_user
+    LEFT JOIN customer
+    ON customer.tg_id = tg_user.tg_id
+    WHERE tg_user.tg_id = %s;'''
+
+get_customer_name_script = '''
+    SELECT first_name, last_name
+    FROM customer
+    WHERE tg_id = %s;'''
+
+get_customer_list_script = '''
+    SELECT tg_user.tg_id FROM tg_user
+    INNER JOIN customer
+    ON tg_user.tg_id = customer.tg_id
+    WHERE tg_user.is_banned = FALSE;'''
+
+get_tg_users_script = '''
+    SELECT tg_id FROM tg_user
+    WHERE is_banned = FALSE
+    EXCEPT SELECT tg_id FROM customer;'''
+
+get_ban_list_script = '''
+    SELECT tg_id FROM tg_user
+    WHERE is_banned = TRUE;'''
+
+
+@instrument_db
 class SupportBotData:
     @staticmethod
     def add_tg_user(tg_id: int, tg_username: str) -> None:
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
+        with db_pool.cursor() as cursor:
             insert_values = (tg_id, tg_username)
-            insert_script = '''INSERT INTO tg_user (tg_id, tg_username)
-                                VALUES (%s, %s)
-                                ON CONFLICT (tg_id)
-                                DO UPDATE
-                                SET tg_username = EXCLUDED.tg_username;'''
-            cursor.execute(insert_script, insert_values)
-        connection.commit()
-        connection.close()
+            cursor.execute(add_tg_user_script, insert_values)
 
     @staticmethod
     def does_user_exist(tg_id: int) -> bool:
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
-            select_script = '''
-                    SELECT exists(
-                       SELECT tg_id
-                       FROM tg_user
-                       WHERE tg_id = %s);'''
-            cursor.execute(select_script, (tg_id,))
+        with db_pool.cursor() as cursor:
+            cursor.execute(does_user_exist_script, (tg_id,))
             exists, = cursor.fetchone()
-        connection.commit()
-        connection.close()
         return exists
 
     @staticmethod
     def add_operator(tg_id: int) -> None:
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
+        with db_pool.cursor() as cursor:
             insert_values = (tg_id,)
             insert_script = '''INSERT INTO operator (tg_id) VALUES (%s)
                                 ON CONFLICT (tg_id) DO NOTHING;'''
             cursor.execute(insert_script, insert_values)
-        connection.commit()
-        connection.close()
 
     @staticmethod
     def add_customer(tg_id: int, phone: str) -> int:
-        if SupportBotData.does_phone_exist(phone):
-            raise PhoneAlreadyExists(
-                'db: customer with given phone number already exists')
-        else:
-            connection = psycopg2.connect(**db_config)
-            with connection.cursor() as cursor:
+        try:
+            with db_pool.cursor() as cursor:
                 insert_values = (tg_id, phone)
                 insert_script = '''
                     INSERT INTO customer (tg_id, phone)
@@ -87,154 +239,238 @@ class SupportBotData:
                     RETURNING customer_id;'''
                 cursor.execute(insert_script, insert_values)
                 customer_id, = cursor.fetchone()
-            connection.commit()
-            connection.close()
+        except errors.UniqueViolation:
+            raise PhoneAlreadyExists(
+                'db: customer with given phone number already exists')
         return customer_id
 
+    @staticmethod
+    def onboard_customer(tg_id: int, phone: str, first_name: str) -> tuple:
+        """Make tg_id a customer with this phone and name in one statement,
+        returns (customer_id, tg_id, phone, first_name, last_name).
+
+        If the phone belongs to another customer, a tg user who is a
+        customer already only gets the new name and keeps their phone.
+        """
+        try:
+            with db_pool.cursor() as cursor:
+                insert_values = {'tg_id': tg_id, 'phone': phone,
+                                 'first_name': first_name}
+                cursor.execute(onboard_customer_script, insert_values)
+                result = cursor.fetchone()
+        except errors.UniqueViolation:
+            # the phone was taken by a customer added meanwhile
+            result = None
+        if result is None:
+            raise PhoneAlreadyExists(
+                'db: customer with given phone number already exists')
+        return result
+
     @staticmethod
     def does_phone_exist(phone: str) -> bool:
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
-            select_script = '''
-                SELECT exists(
-                   SELECT phone
-                   FROM customer
-                   WHERE phone = %s);'''
-            cursor.execute(select_script, (phone,))
+        with db_pool.cursor() as cursor:
+            cursor.execute(does_phone_exist_script, (phone,))
             exists, = cursor.fetchone()
-        connection.commit()
-        connection.close()
         return exists
 
     @staticmethod
-    def add_message(tg_id: int, support_chat_message_id: int) -> None:
-        if SupportBotData.does_message_exist(support_chat_message_id):
+    def add_message(tg_id: int, support_chat_message_id: int,
+                    album_part_ids: list = ()) -> int:
+        """`album_part_ids` are the posts of an album whose keyboard is
+        support_chat_message_id, replies to any of them find the message"""
+        with db_pool.cursor() as cursor:
+            # the lock is taken in its own statement, so the insert below
+            # sees a row committed by whoever held it before
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock(%s, hashint8(%s));',
+                (MESSAGE_LOCK, support_chat_message_id))
+            insert_values = (tg_id, support_chat_message_id,
+                             support_chat_message_id)
+            cursor.execute(add_message_script, insert_values)
+            result = cursor.fetchone()
+            if result is not None and album_part_ids:
+                insert_script = '''
+                    INSERT INTO message_album_part (
+                        support_chat_message_id,
+                        post_support_chat_message_id)
+                    VALUES %s
+                    ON CONFLICT (support_chat_message_id) DO NOTHING;'''
+                execute_values(
+                    cursor, insert_script,
+                    [(part_id, support_chat_message_id)
+                     for part_id in album_part_ids])
+        if result is None:
             raise MsgAlreadyExists('db: support_chat_message already exists')
-        else:
-            connection = psycopg2.connect(**db_config)
-            with connection.cursor() as cursor:
-                insert_values = (tg_id, support_chat_message_id)
+        text_message_id, = result
+        return text_message_id
+
+    @staticmethod
+    def add_messages(rows: list) -> int:
+        """Insert (tg_id, support_chat_message_id, album_part_ids) rows
+        in one transaction, messages that exist already are skipped.
+        Returns the number of messages inserted"""
+        rows = {row[1]: row for row in rows}
+        with db_pool.cursor() as cursor:
+            # in support_chat_message_id order, so batches can't deadlock
+            lock_script = '''
+                SELECT pg_advisory_xact_lock(%s, hashint8(id))
+                FROM (SELECT id
+                      FROM unnest(%s::int8[]) AS id
+                      ORDER BY id) AS ids;'''
+            cursor.execute(lock_script, (MESSAGE_LOCK, sorted(rows)))
+            inserted = execute_values(
+                cursor, add_messages_script,
+                [(tg_id, support_chat_message_id)
+                 for tg_id, support_chat_message_id, _ in rows.values()],
+                page_size=len(rows), fetch=True)
+            parts = [(part_id, support_chat_message_id)
+                     for support_chat_message_id, in inserted
+                     for part_id in rows[support_chat_message_id][2]]
+            if parts:
                 insert_script = '''
-                    INSERT INTO message (tg_id, support_chat_message_id)
-                    VALUES (%s, %s);'''
-                cursor.execute(insert_script, insert_values)
-            connection.commit()
-            connection.close()
+                    INSERT INTO message_album_part (
+                        support_chat_message_id,
+                        post_support_chat_message_id)
+                    VALUES %s
+                    ON CONFLICT (support_chat_message_id) DO NOTHING;'''
+                execute_values(cursor, insert_script, parts,
+                               page_size=len(parts))
+        return len(inserted)
 
     @staticmethod
     def does_message_exist(support_chat_message_id: int) -> bool:
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
+        with db_pool.cursor() as cursor:
+            select_values = (support_chat_message_id,) * 2
             select_script = '''SELECT exists(
                                    SELECT support_chat_message_id
                                    FROM message
+                                   WHERE support_chat_message_id = %s
+                                   UNION ALL
+                                   SELECT support_chat_message_id
+                                   FROM message_archive
                                    WHERE support_chat_message_id = %s);'''
-            cursor.execute(select_script, (support_chat_message_id,))
+            cursor.execute(select_script, select_values)
             exists, = cursor.fetchone()
-        connection.commit()
-        connection.close()
         return exists
 
     @staticmethod
     def get_textmessage_id(support_chat_message_id: int) -> int:
-        if SupportBotData.does_message_exist(support_chat_message_id):
-            connection = psycopg2.connect(**db_config)
-            with connection.cursor() as cursor:
-                insert_script = '''
-                    SELECT text_message_id
-                    FROM message
-                    WHERE support_chat_message_id = %s;'''
-                cursor.execute(insert_script, (support_chat_message_id,))
-                text_message_id, = cursor.fetchone()
-            connection.commit()
-            connection.close()
-            return text_message_id
-        else:
+        with db_pool.cursor() as cursor:
+            # the archive is read only when message has no such row
+            select_values = (support_chat_message_id,) * 2
+            cursor.execute(get_textmessage_id_script, select_values)
+            result = cursor.fetchone()
+        if result is None:
             raise MsgNotFound('db: support_chat_message not found')
+        text_message_id, = result
+        return text_message_id
 
     @staticmethod
-    def get_customer_id(tg_id: int) -> int:
-        if SupportBotData.does_user_exist(tg_id):
-            connection = psycopg2.connect(**db_config)
-            with connection.cursor() as cursor:
-                insert_script = '''
-                    SELECT customer_id
-                    FROM customer
-                    WHERE tg_id = %s;'''
-                cursor.execute(insert_script, (tg_id,))
+    def get_message_view(support_chat_message_id: int) -> tuple:
+        """(text_message_id, tg_id, is_answered, is_banned,
+        support_chat_message_id) of a message, a photo of an album
+        gives the message of the album and its post"""
+        with db_pool.cursor() as cursor:
+            select_values = (support_chat_message_id,) * 2
+            cursor.execute(get_message_view_script, select_values)
+            result = cursor.fetchone()
+        if result is None:
+            raise MsgNotFound('db: support_chat_message not found')
+        return result
+
+    @staticmethod
+    def set_message_answered(
+            support_chat_message_id: int, is_answered: bool) -> tuple:
+        """Update is_answered and return the message view like above"""
+        with db_pool.cursor() as cursor:
+            update_values = (is_answered, is_answered,
+                             support_chat_message_id)
+            cursor.execute(set_message_answered_script, update_values)
+            result = cursor.fetchone()
+            if result is None and is_answered:
+                # archived messages are answered already
+                select_script = '''
+                    SELECT message_archive.text_message_id,
+                           message_archive.tg_id, TRUE, tg_user.is_banned,
+                           message_archive.support_chat_message_id
+                    FROM message_archive
+                    INNER JOIN tg_user
+                    ON tg_user.tg_id = message_archive.tg_id
+                    WHERE message_archive.support_chat_message_id = %s;'''
+                cursor.execute(select_script, (support_chat_message_id,))
                 result = cursor.fetchone()
-                if result:
-                    customer_id, = result
-                else:
-                    raise CustomerNotFound('db: customer_id not found')
-            connection.commit()
-            connection.close()
-            return customer_id
-        else:
+            elif result is None:
+                result = _restore_archived(
+                    cursor, 'support_chat_message_id',
+                    support_chat_message_id)
+        if result is None:
+            raise MsgNotFound('db: support_chat_message not found')
+        return result
+
+    @staticmethod
+    def get_customer_id(tg_id: int) -> int:
+        with db_pool.cursor() as cursor:
+            cursor.execute(get_customer_id_script, (tg_id,))
+            result = cursor.fetchone()
+        if result is None:
             raise UserNotFound('db: tg_user not found')
+        customer_id, = result
+        if customer_id is None:
+            raise CustomerNotFound('db: customer_id not found')
+        return customer_id
+
+    @staticmethod
+    def get_customer_name(tg_id: int) -> tuple | None:
+        """(first_name, last_name) of a customer, None for other tg users"""
+        with db_pool.cursor() as cursor:
+            cursor.execute(get_customer_name_script, (tg_id,))
+            return cursor.fetchone()
 
     @staticmethod
     def get_customer_list() -> list:
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
-            select_script = '''SELECT tg_user.tg_id FROM tg_user
-                                INNER JOIN customer
-                                ON tg_user.tg_id = customer.tg_id
-                                WHERE tg_user.is_banned = FALSE;'''
-            cursor.execute(select_script)
+        with db_pool.cursor() as cursor:
+            cursor.execute(get_customer_list_script)
             try:
                 id_list = cursor.fetchall()
             except TypeError:
                 id_list = []
-        connection.commit()
-        connection.close()
         return [id_tuple[0] for id_tuple in id_list]
 
     @staticmethod
     def get_tg_users() -> list:
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
-            select_script = '''SELECT tg_id FROM tg_user
-                                WHERE is_banned = FALSE
-                                EXCEPT SELECT tg_id FROM customer;'''
-            cursor.execute(select_script)
+        with db_pool.cursor() as cursor:
+            cursor.execute(get_tg_users_script)
             try:
                 id_list = cursor.fetchall()
             except TypeError:
                 id_list = []
-        connection.commit()
-        connection.close()
         return [id_tuple[0] for id_tuple in id_list]
 
     @staticmethod
     def get_ban_list() -> list:
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
-            select_script = '''SELECT tg_id FROM tg_user
-                                WHERE is_banned = TRUE;'''
-            cursor.execute(select_script)
+        with db_pool.cursor() as cursor:
+            cursor.execute(get_ban_list_script)
             try:
                 id_list = cursor.fetchall()
             except TypeError:
                 id_list = []
-        connection.commit()
-        connection.close()
         return [id_tuple[0] for id_tuple in id_list]
 
 
+load_tg_user_script = '''
+    SELECT tg_username, is_banned
+    FROM tg_user
+    WHERE tg_id = %s;'''
+
+
+@instrument_db
 class TgUserData:
     def __init__(self, tg_id: int):
         self._tg_id = tg_id
 
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
-            select_script = '''SELECT tg_username, is_banned
-                                FROM tg_user
-                                WHERE tg_id = %s;'''
-            cursor.execute(select_script, (tg_id,))
+        with db_pool.cursor() as cursor:
+            cursor.execute(load_tg_user_script, (tg_id,))
             select_username, is_banned = cursor.fetchone()
-        connection.commit()
-        connection.close()
 
         self._tg_username = select_username
         self._is_banned = is_banned
@@ -246,31 +482,26 @@ class TgUserData:
         return self._tg_username
 
     def is_banned(self) -> bool:
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
+        with db_pool.cursor() as cursor:
             select_script = '''
                         SELECT is_banned
                         FROM tg_user
                         WHERE tg_id = %s;'''
             cursor.execute(select_script, (self._tg_id,))
             is_banned, = cursor.fetchone()
-        connection.commit()
-        connection.close()
         return is_banned
 
 
+@instrument_db
 class OperatorData:
     def __init__(self, operator_id: int):
         self._operator_id = operator_id
 
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
+        with db_pool.cursor() as cursor:
             select_script = '''SELECT tg_id FROM operator
                                 WHERE operator_id = %s;'''
             cursor.execute(select_script, (operator_id,))
             tg_id, = cursor.fetchone()
-        connection.commit()
-        connection.close()
 
         self._tg_id = tg_id
 
@@ -279,47 +510,63 @@ class OperatorData:
 
     @staticmethod
     def ban(tg_id: int) -> None:
-        if SupportBotData.does_user_exist(tg_id):
-            connection = psycopg2.connect(**db_config)
-            with connection.cursor() as cursor:
-                update_script = '''UPDATE tg_user
-                                    SET is_banned = TRUE
-                                    WHERE tg_id = %s;'''
-                cursor.execute(update_script, (tg_id,))
-            connection.commit()
-            connection.close()
-        else:
-            raise UserNotFound('db: tg_user not found')
+        with db_pool.cursor() as cursor:
+            # other bot processes keep their ban index in sync
+            update_values = (tg_id, BAN_CHANNEL, f'{tg_id}:TRUE')
+            update_script = '''
+                WITH updated AS (
+                    UPDATE tg_user
+                    SET is_banned = TRUE
+                    WHERE tg_id = %s
+                    RETURNING tg_id)
+                SELECT pg_notify(%s, %s) FROM updated;'''
+            cursor.execute(update_script, update_values)
+            if cursor.fetchone() is None:
+                raise UserNotFound('db: tg_user not found')
 
     @staticmethod
     def unban(tg_id: int) -> None:
-        if SupportBotData.does_user_exist(tg_id):
-            connection = psycopg2.connect(**db_config)
-            with connection.cursor() as cursor:
-                update_script = '''UPDATE tg_user
-                                    SET is_banned = FALSE
-                                    WHERE tg_id = %s;'''
-                cursor.execute(update_script, (tg_id,))
-            connection.commit()
-            connection.close()
-        else:
-            raise UserNotFound('db: tg_user not found')
+        with db_pool.cursor() as cursor:
+            # other bot processes keep their ban index in sync
+            update_values = (tg_id, BAN_CHANNEL, f'{tg_id}:FALSE')
+            update_script = '''
+                WITH updated AS (
+                    UPDATE tg_user
+                    SET is_banned = FALSE
+                    WHERE tg_id = %s
+                    RETURNING tg_id)
+                SELECT pg_notify(%s, %s) FROM updated;'''
+            cursor.execute(update_script, update_values)
+            if cursor.fetchone() is None:
+                raise UserNotFound('db: tg_user not found')
+
 
+load_customer_script = '''
+    SELECT tg_id, phone, first_name, last_name
+    FROM customer
+    WHERE customer_id = %s;'''
 
+
+@instrument_db
 class CustomerData:
+    @classmethod
+    def from_row(cls, customer_id: int, tg_id: int, phone: str,
+                 first_name: str, last_name: str) -> CustomerData:
+        """A customer already read, e.g. by onboard_customer"""
+        customer_data = cls.__new__(cls)
+        customer_data._customer_id = customer_id
+        customer_data._tg_id = tg_id
+        customer_data._phone = phone
+        customer_data._first_name = first_name
+        customer_data._last_name = last_name
+        return customer_data
+
     def __init__(self, customer_id: int):
         self._customer_id = customer_id
 
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
-            select_script = '''
-                SELECT tg_id, phone, first_name, last_name
-                FROM customer
-                WHERE customer_id = %s;'''
-            cursor.execute(select_script, (customer_id,))
+        with db_pool.cursor() as cursor:
+            cursor.execute(load_customer_script, (customer_id,))
             tg_id, phone, first_name, last_name = cursor.fetchone()
-        connection.commit()
-        connection.close()
 
         self._tg_id = tg_id
         self._phone = phone
@@ -339,42 +586,43 @@ class CustomerData:
         return self._last_name
 
     def change_first_name(self, new_first_name: str) -> None:
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
+        with db_pool.cursor() as cursor:
             insert_values = (new_first_name, self._customer_id)
             update_script = '''UPDATE customer
                                 SET first_name = %s
                                 WHERE customer_id = %s;'''
             cursor.execute(update_script, insert_values)
-        connection.commit()
-        connection.close()
 
     def change_last_name(self, new_last_name: str) -> None:
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
+        with db_pool.cursor() as cursor:
             insert_values = (new_last_name, self._customer_id)
             update_script = '''UPDATE customer
                                 SET last_name = %s
                                 WHERE customer_id = %s;'''
             cursor.execute(update_script, insert_values)
-        connection.commit()
-        connection.close()
 
 
+load_text_message_script = '''
+    SELECT tg_id, support_chat_message_id,
+            is_answered
+    FROM message
+    WHERE text_message_id = %s
+    UNION ALL
+    SELECT tg_id, support_chat_message_id, TRUE
+    FROM message_archive
+    WHERE text_message_id = %s
+    LIMIT 1;'''
+
+
+@instrument_db
 class TextMessageData:
     def __init__(self, text_message_id: int):
         self._text_message_id = text_message_id
 
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
-            select_script = '''SELECT tg_id, support_chat_message_id,
-                                        is_answered
-                                FROM message
-                                WHERE text_message_id = %s;'''
-            cursor.execute(select_script, (text_message_id,))
+        with db_pool.cursor() as cursor:
+            select_values = (text_message_id,) * 2
+            cursor.execute(load_text_message_script, select_values)
             tg_id, support_chat_message_id, is_answered = cursor.fetchone()
-        connection.commit()
-        connection.close()
 
         self._tg_id = tg_id
         self._support_chat_message_id = support_chat_message_id
@@ -387,34 +635,551 @@ class TextMessageData:
         return self._support_chat_message_id
 
     def is_answered(self) -> bool:
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
+        with db_pool.cursor() as cursor:
+            select_values = (self._text_message_id,) * 2
             select_script = '''
                 SELECT is_answered
                 FROM message
-                WHERE text_message_id = %s;'''
-            cursor.execute(select_script, (self._text_message_id,))
+                WHERE text_message_id = %s
+                UNION ALL
+                SELECT TRUE
+                FROM message_archive
+                WHERE text_message_id = %s
+                LIMIT 1;'''
+            cursor.execute(select_script, select_values)
             is_answered, = cursor.fetchone()
-        connection.commit()
-        connection.close()
         return is_answered
 
     def mark_answered(self) -> None:
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
+        with db_pool.cursor() as cursor:
             update_script = '''UPDATE message
-                                SET is_answered = TRUE
+                                SET is_answered = TRUE,
+                                    answered_at = now()
                                 WHERE text_message_id = %s;'''
             cursor.execute(update_script, (self._text_message_id,))
-        connection.commit()
-        connection.close()
 
     def mark_unanswered(self) -> None:
-        connection = psycopg2.connect(**db_config)
-        with connection.cursor() as cursor:
+        with db_pool.cursor() as cursor:
             update_script = '''UPDATE message
-                                SET is_answered = FALSE
+                                SET is_answered = FALSE,
+                                    answered_at = NULL
                                 WHERE text_message_id = %s;'''
             cursor.execute(update_script, (self._text_message_id,))
-        connection.commit()
-        connection.close()
+            if not cursor.rowcount:
+                _restore_archived(
+                    cursor, 'text_message_id', self._text_message_id)
+
+
+get_fsm_state_script = '''
+    SELECT state, data
+    FROM fsm_state
+    WHERE chat_id = %s AND user_id = %s
+    AND updated_at > now() - make_interval(secs => %s);'''
+
+set_fsm_state_script = '''
+    INSERT INTO fsm_state (chat_id, user_id, state)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (chat_id, user_id)
+    DO UPDATE
+    SET state = EXCLUDED.state,
+        data = CASE
+            WHEN fsm_state.updated_at
+                > now() - make_interval(secs => %s)
+            THEN fsm_state.data
+            ELSE '{}' END,
+        updated_at = now();'''
+
+
+@instrument_db
+class FSMStateData:
+    """aiogram FSM state and data per (chat_id, user_id).
+
+    Rows untouched for longer than `ttl` seconds count as absent.
+    """
+
+    @staticmethod
+    def get(chat_id: int, user_id: int, ttl: int) -> tuple | None:
+        with db_pool.cursor() as cursor:
+            select_values = (chat_id, user_id, ttl)
+            cursor.execute(get_fsm_state_script, select_values)
+            result = cursor.fetchone()
+        return result
+
+    @staticmethod
+    def set_state(chat_id: int, user_id: int, state: str | None,
+                  ttl: int) -> None:
+        with db_pool.cursor() as cursor:
+            insert_values = (chat_id, user_id, state, ttl)
+            cursor.execute(set_fsm_state_script, insert_values)
+
+    @staticmethod
+    def set_data(chat_id: int, user_id: int, data: dict, ttl: int) -> None:
+        with db_pool.cursor() as cursor:
+            insert_values = (chat_id, user_id, Json(data), ttl)
+            insert_script = '''
+                INSERT INTO fsm_state (chat_id, user_id, data)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (chat_id, user_id)
+                DO UPDATE
+                SET data = EXCLUDED.data,
+                    state = CASE
+                        WHEN fsm_state.updated_at
+                            > now() - make_interval(secs => %s)
+                        THEN fsm_state.state
+                        ELSE NULL END,
+                    updated_at = now();'''
+            cursor.execute(insert_script, insert_values)
+
+    @staticmethod
+    def update_data(chat_id: int, user_id: int, data: dict,
+                    ttl: int) -> tuple:
+        """Merge `data` into the stored data, returns (state, data)"""
+        with db_pool.cursor() as cursor:
+            insert_values = (chat_id, user_id, Json(data), ttl, ttl)
+            insert_script = '''
+                INSERT INTO fsm_state (chat_id, user_id, data)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (chat_id, user_id)
+                DO UPDATE
+                SET data = CASE
+                        WHEN fsm_state.updated_at
+                            > now() - make_interval(secs => %s)
+                        THEN fsm_state.data
+                        ELSE '{}' END || EXCLUDED.data,
+                    state = CASE
+                        WHEN fsm_state.updated_at
+                            > now() - make_interval(secs => %s)
+                        THEN fsm_state.state
+                        ELSE NULL END,
+                    updated_at = now()
+                RETURNING state, data;'''
+            cursor.execute(insert_script, insert_values)
+            result = cursor.fetchone()
+        return result
+
+    @staticmethod
+    def delete(chat_id: int, user_id: int) -> None:
+        with db_pool.cursor() as cursor:
+            delete_script = '''DELETE FROM fsm_state
+                                WHERE chat_id = %s AND user_id = %s;'''
+            cursor.execute(delete_script, (chat_id, user_id))
+
+    @staticmethod
+    def purge_expired(ttl: int) -> int:
+        with db_pool.cursor() as cursor:
+            delete_script = '''
+                DELETE FROM fsm_state
+                WHERE updated_at < now() - make_interval(secs => %s);'''
+            cursor.execute(delete_script, (ttl,))
+            deleted = cursor.rowcount
+        return deleted
+
+
+@instrument_db
+class PhoneDirectoryData:
+    """Local copy of the phone -> name table from Airtable"""
+
+    @staticmethod
+    def load_all() -> list:
+        with db_pool.cursor() as cursor:
+            select_script = '''SELECT phone, name FROM phone_directory;'''
+            cursor.execute(select_script)
+            entries = cursor.fetchall()
+        return entries
+
+    @staticmethod
+    def upsert(entries: list) -> None:
+        with db_pool.cursor() as cursor:
+            insert_script = '''
+                INSERT INTO phone_directory (phone, name)
+                VALUES %s
+                ON CONFLICT (phone)
+                DO UPDATE
+                SET name = EXCLUDED.name,
+                    synced_at = now();'''
+            execute_values(cursor, insert_script, entries)
+
+    @staticmethod
+    def replace_all(entries: list) -> None:
+        """Full sync: phones removed from Airtable are removed here too"""
+        with db_pool.cursor() as cursor:
+            cursor.execute('DELETE FROM phone_directory;')
+            insert_script = '''
+                INSERT INTO phone_directory (phone, name)
+                VALUES %s
+                ON CONFLICT (phone) DO NOTHING;'''
+            execute_values(cursor, insert_script, entries)
+
+
+@instrument_db
+class BroadcastData:
+    """Broadcasts go through recipients in tg_id order, `last_tg_id` is
+    the last recipient that has been handled. A broadcast is sent by the
+    process (`owner`) that holds its lease."""
+
+    recipients_scripts = {
+        'customers': '''SELECT tg_user.tg_id FROM tg_user
+                        INNER JOIN customer
+                        ON tg_user.tg_id = customer.tg_id
+                        WHERE tg_user.is_banned = FALSE
+                        AND tg_user.tg_id > %s
+                        ORDER BY tg_user.tg_id
+                        LIMIT %s;''',
+        'tg_users': '''SELECT tg_id FROM tg_user
+                       WHERE is_banned = FALSE
+                       AND tg_id > %s
+                       AND NOT EXISTS (
+                           SELECT 1 FROM customer
+                           WHERE customer.tg_id = tg_user.tg_id)
+                       ORDER BY tg_id
+                       LIMIT %s;''',
+        'all': '''SELECT tg_id FROM tg_user
+                  WHERE is_banned = FALSE
+                  AND tg_id > %s
+                  ORDER BY tg_id
+                  LIMIT %s;''',
+    }
+
+    @staticmethod
+    def create(audience: str, from_chat_id: int, message_id: int,
+               owner: str, lease: int) -> int:
+        """A broadcast claimed by `owner` for `lease` seconds"""
+        with db_pool.cursor() as cursor:
+            insert_values = (audience, from_chat_id, message_id, owner, lease)
+            insert_script = '''
+                INSERT INTO broadcast
+                    (audience, from_chat_id, message_id, owner, lease_until)
+                VALUES (%s, %s, %s, %s, now() + make_interval(secs => %s))
+                RETURNING broadcast_id;'''
+            cursor.execute(insert_script, insert_values)
+            broadcast_id, = cursor.fetchone()
+        return broadcast_id
+
+    @staticmethod
+    def claim_unfinished(owner: str, lease: int) -> list:
+        """(broadcast_id, audience, from_chat_id, message_id, last_tg_id,
+        sent, failed) of interrupted broadcasts nobody holds a lease on,
+        now claimed by `owner` for `lease` seconds"""
+        with db_pool.cursor() as cursor:
+            update_script = '''
+                UPDATE broadcast
+                SET owner = %s,
+                    lease_until = now() + make_interval(secs => %s)
+                WHERE broadcast_id IN (
+                    SELECT broadcast_id FROM broadcast
+                    WHERE finished_at IS NULL
+                    AND (lease_until IS NULL OR lease_until < now())
+                    FOR UPDATE SKIP LOCKED)
+                RETURNING broadcast_id, audience, from_chat_id, message_id,
+                          last_tg_id, sent, failed;'''
+            cursor.execute(update_script, (owner, lease))
+            broadcasts = cursor.fetchall()
+        return sorted(broadcasts)
+
+    @staticmethod
+    def renew(broadcast_ids: list, owner: str, lease: int) -> list:
+        """Extend the leases `owner` still holds, returns their ids"""
+        with db_pool.cursor() as cursor:
+            update_script = '''
+                UPDATE broadcast
+                SET lease_until = now() + make_interval(secs => %s)
+                WHERE broadcast_id = ANY(%s) AND owner = %s
+                RETURNING broadcast_id;'''
+            cursor.execute(update_script, (lease, list(broadcast_ids), owner))
+            renewed = [broadcast_id for broadcast_id, in cursor.fetchall()]
+        return renewed
+
+    @staticmethod
+    def release(broadcast_ids: list, owner: str) -> None:
+        """Let the broadcasts be resumed at once, e.g. on shutdown"""
+        with db_pool.cursor() as cursor:
+            update_script = '''
+                UPDATE broadcast
+                SET lease_until = NULL
+                WHERE broadcast_id = ANY(%s) AND owner = %s;'''
+            cursor.execute(update_script, (list(broadcast_ids), owner))
+
+    @staticmethod
+    def get_recipients(audience: str, after_tg_id: int,
+                       chunk_size: int) -> list:
+        """The next at most `chunk_size` tg ids after `after_tg_id`, a short
+        query of its own per chunk"""
+        with db_pool.cursor() as cursor:
+            select_script = BroadcastData.recipients_scripts[audience]
+            cursor.execute(select_script, (after_tg_id, chunk_size))
+            recipients = [tg_id for tg_id, in cursor.fetchall()]
+        return recipients
+
+    @staticmethod
+    def save_progress(broadcast_id: int, owner: str, last_tg_id: int,
+                      sent: int, failures: list) -> bool:
+        """Add a handled chunk: `failures` are (tg_id, reason) pairs.
+        False if `owner` has lost the broadcast to another process"""
+        with db_pool.cursor() as cursor:
+            if failures:
+                insert_script = '''
+                    INSERT INTO broadcast_failure
+                        (broadcast_id, tg_id, reason)
+                    VALUES %s
+                    ON CONFLICT (broadcast_id, tg_id)
+                    DO UPDATE SET reason = EXCLUDED.reason;'''
+                execute_values(
+                    cursor, insert_script,
+                    [(broadcast_id, tg_id, reason[:255])
+                     for tg_id, reason in failures])
+            update_values = (last_tg_id, sent, len(failures), broadcast_id,
+                             owner)
+            update_script = '''UPDATE broadcast
+                                SET last_tg_id = %s,
+                                    sent = sent + %s,
+                                    failed = failed + %s
+                                WHERE broadcast_id = %s AND owner = %s;'''
+            cursor.execute(update_script, update_values)
+            owned = cursor.rowcount == 1
+        return owned
+
+    @staticmethod
+    def finish(broadcast_id: int) -> tuple:
+        """Mark the broadcast finished, returns (sent, failed)"""
+        with db_pool.cursor() as cursor:
+            update_script = '''UPDATE broadcast
+                                SET finished_at = now()
+                                WHERE broadcast_id = %s
+                                RETURNING sent, failed;'''
+            cursor.execute(update_script, (broadcast_id,))
+            result = cursor.fetchone()
+        return result
+
+
+archive_batch_script = '''
+    WITH batch AS (
+        SELECT text_message_id, created_at
+        FROM message
+        WHERE is_answered = TRUE
+        AND created_at < now() - make_interval(secs => %s)
+        ORDER BY created_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED),
+    moved AS (
+        DELETE FROM message
+        USING batch
+        WHERE message.text_message_id = batch.text_message_id
+        AND message.created_at = batch.created_at
+        RETURNING message.text_message_id, message.tg_id,
+                  message.support_chat_message_id,
+                  message.created_at, message.answered_at)
+    INSERT INTO message_archive (text_message_id, tg_id,
+                                 support_chat_message_id,
+                                 created_at, answered_at)
+    SELECT text_message_id, tg_id, support_chat_message_id,
+           created_at, answered_at
+    FROM moved
+    ON CONFLICT DO NOTHING;'''
+
+
+@instrument_db
+class MessageArchiveData:
+    """Monthly partitions of message and the move of old answered
+    messages to message_archive.
+
+    Every step is a short transaction of its own. Partitions are created
+    and dropped under `lock_timeout`, those DDL statements lock the whole
+    message table and are better skipped until the next run than waited
+    for while messages are coming in.
+    """
+
+    @staticmethod
+    def ensure_partitions(months_ahead: int, lock_timeout: str) -> int:
+        """Create the partitions up to `months_ahead`, returns how many"""
+        with db_pool.cursor() as cursor:
+            cursor.execute('SELECT set_config(%s, %s, TRUE);',
+                           ('lock_timeout', lock_timeout))
+            select_script = '''
+                SELECT message_ensure_partitions(
+                    now(), now() + make_interval(months => %s));'''
+            cursor.execute(select_script, (months_ahead,))
+            created, = cursor.fetchone()
+        return created
+
+    @staticmethod
+    def archive_batch(archive_after: int, batch_size: int) -> int:
+        """Move up to `batch_size` messages answered before
+        `archive_after` seconds ago, returns how many were moved"""
+        with db_pool.cursor() as cursor:
+            insert_values = (archive_after, batch_size)
+            cursor.execute(archive_batch_script, insert_values)
+            # rows skipped on conflict are gone from message all the same
+            moved = cursor.rowcount
+        return moved
+
+    @staticmethod
+    def drop_empty_partitions(archive_after: int, lock_timeout: str) -> list:
+        """Drop the monthly partitions that ended before `archive_after`
+        seconds ago and hold no messages any more"""
+        with db_pool.cursor() as cursor:
+            select_script = '''
+                SELECT child.relname
+                FROM pg_inherits
+                INNER JOIN pg_class AS child
+                ON child.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = 'message'::regclass
+                AND child.relname ~ '^message_p[0-9]{6}$'
+                AND to_timestamp(substr(child.relname, 10), 'YYYYMM')
+                    + interval '1 month'
+                    < now() - make_interval(secs => %s)
+                ORDER BY child.relname;'''
+            cursor.execute(select_script, (archive_after,))
+            partitions = [name for name, in cursor.fetchall()]
+
+        dropped = []
+        for name in partitions:
+            try:
+                with db_pool.cursor() as cursor:
+                    cursor.execute('SELECT set_config(%s, %s, TRUE);',
+                                   ('lock_timeout', lock_timeout))
+                    partition = sql.Identifier(name)
+                    # the parent first, in the order queries of message
+                    # lock them, or a query and the drop can deadlock;
+                    # a restored message can't slip in before the drop
+                    cursor.execute(sql.SQL(
+                        'LOCK TABLE message, {} IN ACCESS EXCLUSIVE MODE;'
+                    ).format(partition))
+                    cursor.execute(sql.SQL(
+                        'SELECT exists(SELECT 1 FROM {});').format(partition))
+                    not_empty, = cursor.fetchone()
+                    if not_empty:
+                        continue
+                    cursor.execute(
+                        sql.SQL('DROP TABLE {};').format(partition))
+            except (errors.LockNotAvailable, errors.DeadlockDetected):
+                continue
+            dropped.append(name)
+        return dropped
+
+
+assign_script = '''
+    WITH assigned AS (
+        INSERT INTO message_assignment
+            (support_chat_message_id, tg_id, operator_tg_id,
+             assigned_at)
+        VALUES (%s, %s, %s, to_timestamp(%s))
+        ON CONFLICT (support_chat_message_id)
+        DO UPDATE
+        SET operator_tg_id = EXCLUDED.operator_tg_id,
+            assigned_at = EXCLUDED.assigned_at
+        RETURNING tg_id, operator_tg_id)
+    INSERT INTO customer_operator (tg_id, operator_tg_id)
+    SELECT tg_id, operator_tg_id
+    FROM assigned
+    WHERE operator_tg_id IS NOT NULL
+    ON CONFLICT (tg_id)
+    DO UPDATE
+    SET operator_tg_id = EXCLUDED.operator_tg_id;'''
+
+
+@instrument_db
+class OperatorAssignmentData:
+    """State of the operator scheduler, reloaded after a restart"""
+
+    @staticmethod
+    def get_operators() -> list:
+        """(tg_id, tg_username, is_available) of every operator"""
+        with db_pool.cursor() as cursor:
+            select_script = '''
+                SELECT operator.tg_id, tg_user.tg_username,
+                       operator.is_available
+                FROM operator
+                INNER JOIN tg_user
+                ON tg_user.tg_id = operator.tg_id;'''
+            cursor.execute(select_script)
+            operators = cursor.fetchall()
+        return operators
+
+    @staticmethod
+    def set_available(tg_id: int, is_available: bool) -> None:
+        """Registers the user as an operator on first use"""
+        with db_pool.cursor() as cursor:
+            insert_values = (tg_id, is_available)
+            insert_script = '''
+                INSERT INTO operator (tg_id, is_available)
+                VALUES (%s, %s)
+                ON CONFLICT (tg_id)
+                DO UPDATE
+                SET is_available = EXCLUDED.is_available;'''
+            cursor.execute(insert_script, insert_values)
+
+    @staticmethod
+    def get_assignments() -> list:
+        """(support_chat_message_id, tg_id, operator_tg_id, assigned_at as
+        unix time) of unanswered messages, oldest first"""
+        with db_pool.cursor() as cursor:
+            select_script = '''
+                SELECT support_chat_message_id, tg_id, operator_tg_id,
+                       extract(epoch FROM assigned_at)::float8
+                FROM message_assignment
+                ORDER BY assigned_at;'''
+            cursor.execute(select_script)
+            assignments = cursor.fetchall()
+        return assignments
+
+    @staticmethod
+    def get_customer_operators() -> list:
+        with db_pool.cursor() as cursor:
+            select_script = '''SELECT tg_id, operator_tg_id
+                                FROM customer_operator;'''
+            cursor.execute(select_script)
+            customer_operators = cursor.fetchall()
+        return customer_operators
+
+    @staticmethod
+    def assign(support_chat_message_id: int, tg_id: int,
+               operator_tg_id: int | None, assigned_at: float) -> None:
+        with db_pool.cursor() as cursor:
+            insert_values = (support_chat_message_id, tg_id,
+                             operator_tg_id, assigned_at)
+            cursor.execute(assign_script, insert_values)
+
+    @staticmethod
+    def complete(support_chat_message_id: int) -> None:
+        with db_pool.cursor() as cursor:
+            delete_script = '''DELETE FROM message_assignment
+                                WHERE support_chat_message_id = %s;'''
+            cursor.execute(delete_script, (support_chat_message_id,))
+
+
+get_watermark_script = '''
+    SELECT update_id
+    FROM update_watermark
+    WHERE shard = %s
+    AND shards = %s
+    AND saved_at > now() - make_interval(secs => %s);'''
+
+save_watermark_script = '''
+    INSERT INTO update_watermark (shard, shards, update_id)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (shard)
+    DO UPDATE
+    SET shards = EXCLUDED.shards,
+        update_id = EXCLUDED.update_id,
+        saved_at = now();'''
+
+
+@instrument_db
+class UpdateWatermarkData:
+    @staticmethod
+    def get(shard: int, shards: int, max_age: int) -> int | None:
+        """update_id the worker `shard` of `shards` handled last, None if
+        saved more than `max_age` seconds ago: Telegram keeps updates for
+        a day, and after a week without updates it starts the ids anew.
+        With another number of workers updates go to other workers,
+        so their watermarks don't apply"""
+        with db_pool.cursor() as cursor:
+            cursor.execute(get_watermark_script, (shard, shards, max_age))
+            result = cursor.fetchone()
+        return result[0] if result else None
+
+    @staticmethod
+    def save(shard: int, shards: int, update_id: int) -> None:
+        with db_pool.cursor() as cursor:
+            insert_values = (shard, shards, update_id)
+            cursor.execute(save_watermark_script, insert_values)
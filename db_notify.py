@@ -0,0 +1,90 @@
+import asyncio
+import logging
+
+import psycopg2
+from psycopg2 import extensions
+
+from db_pool import db_config
+
+log = logging.getLogger('db_notify')
+
+RECONNECT_DELAY = 5
+
+
+class NotifyListener:
+    """LISTEN on a Postgres channel without blocking the event loop.
+
+    `on_notify(payload)` is called for every notification.
+    `on_connect()` is awaited after every (re)connect so the caller can
+    resync the state it may have missed while disconnected. If the first
+    connect fails, start() returns anyway and connecting is retried in
+    background, see `connected`.
+    """
+
+    def __init__(self, channel: str, on_notify, on_connect=None):
+        self._channel = channel
+        self._on_notify = on_notify
+        self._on_connect = on_connect
+        self._connection = None
+        self._fd = None
+        self._loop = None
+        self._stopped = False
+
+    @property
+    def connected(self) -> bool:
+        return self._connection is not None
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stopped = False
+        await self._connect()
+
+    def _open(self):
+        connection = psycopg2.connect(**db_config)
+        connection.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {self._channel};')
+        return connection
+
+    async def _connect(self) -> None:
+        try:
+            connection = await self._loop.run_in_executor(None, self._open)
+        except psycopg2.Error:
+            log.exception('LISTEN %s failed', self._channel)
+            self._schedule_reconnect()
+            return
+        self._connection = connection
+        self._fd = connection.fileno()
+        self._loop.add_reader(self._fd, self._poll)
+        log.info('listening on %s', self._channel)
+        if self._on_connect is not None:
+            await self._on_connect()
+
+    def _schedule_reconnect(self) -> None:
+        if not self._stopped:
+            self._loop.call_later(
+                RECONNECT_DELAY,
+                lambda: asyncio.ensure_future(self._connect())
+            )
+
+    def _poll(self) -> None:
+        try:
+            self._connection.poll()
+        except psycopg2.Error:
+            log.exception('lost LISTEN connection on %s', self._channel)
+            self._close()
+            self._schedule_reconnect()
+            return
+        while self._connection.notifies:
+            notify = self._connection.notifies.pop(0)
+            self._on_notify(notify.payload)
+
+    def _close(self) -> None:
+        if self._connection is not None:
+            self._loop.remove_reader(self._fd)
+            self._connection.close()
+            self._connection = None
+
+    def stop(self) -> None:
+        self._stopped = True
+        self._close()
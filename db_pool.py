@@ -0,0 +1,130 @@
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions, pool
+
+from config import DB_HOST, DB_NAME, DB_USER, DB_PASS, DB_PORT, \
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_HEALTH_CHECK_INTERVAL
+from metrics import DB_CONNECTION_WAIT_SECONDS
+
+log = logging.getLogger('db_pool')
+
+db_config = {'host': DB_HOST,
+             'dbname': DB_NAME,
+             'user': DB_USER,
+             'password': DB_PASS,
+             'port': DB_PORT}
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections.
+
+    Borrowers block while all `max_size` connections are in use.
+    Every borrowed connection is one transaction: commit on success,
+    rollback on exception.
+    """
+
+    def __init__(self, min_size: int, max_size: int,
+                 health_check_interval: float, **connection_kwargs):
+        self._min_size = min_size
+        self._max_size = max_size
+        self._health_check_interval = health_check_interval
+        self._connection_kwargs = connection_kwargs
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._last_used = {}
+
+    def _get_pool(self) -> pool.ThreadedConnectionPool:
+        # created lazily so that importing a module does not connect
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = pool.ThreadedConnectionPool(
+                        self._min_size,
+                        self._max_size,
+                        **self._connection_kwargs
+                    )
+        return self._pool
+
+    def _is_healthy(self, connection) -> bool:
+        if connection.closed:
+            return False
+        status = connection.info.transaction_status
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        last_used = self._last_used.get(id(connection))
+        if last_used is None or \
+                time.monotonic() - last_used < self._health_check_interval:
+            return True
+        # connection was idle for a long time, the server may have dropped it
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1;')
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _borrow(self):
+        db_pool = self._get_pool()
+        while True:
+            connection = db_pool.getconn()
+            if self._is_healthy(connection):
+                return connection
+            log.warning('dropping broken connection from pool')
+            self._last_used.pop(id(connection), None)
+            db_pool.putconn(connection, close=True)
+
+    def _give_back(self, connection, broken: bool = False) -> None:
+        if broken:
+            self._last_used.pop(id(connection), None)
+        else:
+            self._last_used[id(connection)] = time.monotonic()
+        self._get_pool().putconn(connection, close=broken)
+
+    @contextmanager
+    def connection(self):
+        started = time.perf_counter()
+        self._slots.acquire()
+        try:
+            connection = self._borrow()
+            DB_CONNECTION_WAIT_SECONDS.observe(time.perf_counter() - started)
+            try:
+                yield connection
+                connection.commit()
+            except BaseException:
+                try:
+                    connection.rollback()
+                    broken = bool(connection.closed)
+                except psycopg2.Error:
+                    broken = True
+                self._give_back(connection, broken=broken)
+                raise
+            self._give_back(connection)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def cursor(self):
+        with self.connection() as connection:
+            with connection.cursor() as cursor:
+                yield cursor
+
+    def close(self) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+            self._last_used.clear()
+
+
+db_pool = ConnectionPool(
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL,
+    **db_config
+)
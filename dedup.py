@@ -0,0 +1,145 @@
+from __future__ import annotations
+import asyncio
+from collections import deque
+import logging
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from db_async import AsyncUpdateWatermarkData
+from metrics import Counter
+
+log = logging.getLogger('dedup')
+
+DUPLICATE_UPDATES = Counter(
+    'bot_duplicate_updates_total', 'updates dropped as already handled')
+
+# Telegram keeps undelivered updates for a day
+WATERMARK_MAX_AGE = 24 * 60 * 60
+
+
+def current_update_id() -> int | None:
+    """update_id of the update being handled, None outside of one"""
+    update = types.Update.get_current()
+    return update.update_id if update is not None else None
+
+
+class UpdateDeduplicator(BaseMiddleware):
+    """Drops updates that have been handled already, before any handler.
+
+    The last `ring_size` update_ids are remembered in memory, which
+    catches webhook retries. With `persist`, every `flush_interval`
+    seconds the update_id up to which all updates have been handled is
+    saved to the database; updates Telegram delivers again after a
+    restart are at or below it and are dropped too. An update is handled
+    once its handler has returned and `buffered()` no longer lists its
+    update_id, i.e. the work it left in a buffer (a ticket waiting for
+    more texts, an album being collected) is done; `before_save()` is
+    awaited before the watermark is saved, to write what such work
+    queued. A crash loses at most the last `flush_interval` seconds of
+    the watermark.
+
+    The watermark relies on updates coming in update_id order, as they
+    do with polling. A webhook delivers them concurrently and out of
+    order, an update not handled yet may be below the watermark, so
+    without `persist` only the ring is used.
+
+    Each of `shards` worker processes keeps the watermark of the updates
+    routed to it, `shard` is the index of this one.
+    """
+
+    def __init__(self, ring_size: int, flush_interval: float,
+                 shard: int = 0, shards: int = 1, persist: bool = True,
+                 buffered=None, before_save=None):
+        super().__init__()
+        self._shard = shard
+        self._shards = shards
+        self._persist = persist
+        self._buffered = buffered
+        self._before_save = before_save
+        self._flush_interval = flush_interval
+        self._ring = deque(maxlen=ring_size)
+        self._seen = set()
+        self._in_flight = set()
+        # what was handled before this start
+        self._watermark = None
+        self._last = None
+        self._saved = None
+        self._data = AsyncUpdateWatermarkData()
+        self._task = None
+        self.dropped = 0
+
+    def _remember(self, update_id: int) -> None:
+        if len(self._ring) == self._ring.maxlen:
+            self._seen.discard(self._ring[0])
+        self._ring.append(update_id)
+        self._seen.add(update_id)
+
+    def is_duplicate(self, update_id: int) -> bool:
+        return update_id in self._seen or (
+            self._watermark is not None and update_id <= self._watermark)
+
+    async def on_pre_process_update(self, update: types.Update,
+                                    data: dict) -> None:
+        update_id = update.update_id
+        if self.is_duplicate(update_id):
+            DUPLICATE_UPDATES.inc()
+            self.dropped += 1
+            log.info(f'update {update_id} dropped as a duplicate')
+            raise CancelHandler()
+        self._remember(update_id)
+        self._in_flight.add(update_id)
+        self._last = update_id
+
+    async def on_post_process_update(self, update: types.Update,
+                                     results: list, data: dict) -> None:
+        self._in_flight.discard(update.update_id)
+
+    def handled_up_to(self) -> int | None:
+        """update_id up to which every update has been handled"""
+        pending = set(self._in_flight)
+        if self._buffered is not None:
+            pending.update(self._buffered())
+        if pending:
+            return min(pending) - 1
+        return self._last
+
+    async def flush(self) -> None:
+        if not self._persist:
+            return
+        update_id = self.handled_up_to()
+        if update_id is None or update_id == self._saved:
+            return
+        if self._before_save is not None:
+            await self._before_save()
+        await self._data.save(self._shard, self._shards, update_id)
+        self._saved = update_id
+
+    async def start(self) -> None:
+        if not self._persist:
+            log.info('update watermark off, duplicates are caught in memory')
+            return
+        self._watermark = await self._data.get(
+            self._shard, self._shards, WATERMARK_MAX_AGE)
+        self._saved = self._watermark
+        log.info(f'updates up to {self._watermark} handled before')
+        self._task = asyncio.create_task(self._flush_forever())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            # the rest of the shutdown goes on
+            log.exception('saving the update watermark failed')
+
+    async def _flush_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception('saving the update watermark failed')
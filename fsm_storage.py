@@ -0,0 +1,136 @@
+import asyncio
+import copy
+import logging
+import typing
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from cache import ObjectCache
+from db_async import AsyncFSMStateData
+
+log = logging.getLogger('fsm_storage')
+
+
+class PostgresStorage(BaseStorage):
+    """FSM storage in the fsm_state table, shared by all bot processes.
+
+    States and data untouched for `ttl` seconds expire, so abandoned
+    onboarding flows do not live forever. With `cache_size` > 0 reads are
+    served from a write-through in-memory layer; only use it when every
+    user is always handled by the same process.
+    """
+
+    def __init__(self, ttl: int, cache_size: int = 0,
+                 purge_interval: int = 3600):
+        self._ttl = ttl
+        self._purge_interval = purge_interval
+        self._purge_task = None
+        self._data = AsyncFSMStateData()
+        self._cache = None
+        if cache_size > 0:
+            self._cache = ObjectCache(capacity=cache_size, ttl=ttl)
+
+    def start_purging(self) -> None:
+        """Periodically delete expired rows"""
+        self._purge_task = asyncio.create_task(self._purge())
+
+    async def _purge(self) -> None:
+        while True:
+            await asyncio.sleep(self._purge_interval)
+            try:
+                deleted = await self._data.purge_expired(ttl=self._ttl)
+                log.info(f'expired fsm states purged: {deleted}')
+            except Exception:
+                log.exception('fsm states purge failed')
+
+    async def close(self) -> None:
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            self._purge_task = None
+
+    async def wait_closed(self) -> None:
+        pass
+
+    async def _load(self, chat: int, user: int) -> dict:
+        if self._cache is not None:
+            record = self._cache.get((chat, user))
+            if record is not None:
+                return record
+        result = await self._data.get(chat, user, ttl=self._ttl)
+        state, data = result if result is not None else (None, {})
+        record = {'state': state, 'data': data}
+        self._remember(chat, user, record)
+        return record
+
+    def _remember(self, chat: int, user: int, record: dict) -> None:
+        if self._cache is not None:
+            self._cache.put((chat, user), record)
+
+    def _write_through(self, chat: int, user: int, **fields) -> None:
+        if self._cache is not None:
+            record = self._cache.get((chat, user), count=False)
+            if record is not None:
+                record.update(fields)
+                self._cache.put((chat, user), record)
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None
+                        ) -> typing.Optional[str]:
+        chat, user = self.check_address(chat=chat, user=user)
+        record = await self._load(int(chat), int(user))
+        return record['state'] or self.resolve_state(default)
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None
+                       ) -> typing.Dict:
+        chat, user = self.check_address(chat=chat, user=user)
+        record = await self._load(int(chat), int(user))
+        return copy.deepcopy(record['data'] or default or {})
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.Optional[typing.AnyStr] = None):
+        chat, user = self.check_address(chat=chat, user=user)
+        chat, user = int(chat), int(user)
+        state = self.resolve_state(state)
+        await self._data.set_state(chat, user, state, ttl=self._ttl)
+        self._write_through(chat, user, state=state)
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        chat, user = self.check_address(chat=chat, user=user)
+        chat, user = int(chat), int(user)
+        data = copy.deepcopy(data or {})
+        await self._data.set_data(chat, user, data, ttl=self._ttl)
+        self._write_through(chat, user, data=data)
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None,
+                          **kwargs):
+        chat, user = self.check_address(chat=chat, user=user)
+        chat, user = int(chat), int(user)
+        new_data = dict(data or {}, **kwargs)
+        state, merged_data = await self._data.update_data(
+            chat, user, new_data, ttl=self._ttl)
+        self._remember(chat, user, {'state': state, 'data': merged_data})
+
+    async def reset_state(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          with_data: typing.Optional[bool] = True):
+        if not with_data:
+            await self.set_state(chat=chat, user=user, state=None)
+            return
+        chat, user = self.check_address(chat=chat, user=user)
+        chat, user = int(chat), int(user)
+        await self._data.delete(chat, user)
+        self._remember(chat, user, {'state': None, 'data': {}})
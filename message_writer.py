@@ -0,0 +1,136 @@
+import asyncio
+import logging
+
+import psycopg2
+
+from db_async import AsyncSupportBotData
+
+log = logging.getLogger('message_writer')
+
+# seconds before a batch that failed is tried again
+RETRY_AFTER = 1
+
+
+class MessageWriter:
+    """Write-behind for the message rows of support chat posts.
+
+    add() only queues a row. Queued rows are inserted by one
+    add_messages call, in one transaction, `interval` seconds after the
+    first of them or as soon as `batch_size` are queued, so a burst of
+    customer messages costs one commit instead of one per message.
+
+    A lookup of a queued support_chat_message_id, or of a photo of a
+    queued album, waits for the rows to be written (flush_for), so the
+    bot always reads its own writes. When a batch fails its rows are
+    written one by one: a row that still fails (e.g. of a tg user that is
+    gone) is logged and dropped, so it does not hold up the others. Only
+    when the database can't be reached the rows are kept and tried again;
+    close() writes what is left.
+    """
+
+    def __init__(self, interval: float, batch_size: int):
+        self._interval = interval
+        self._batch_size = batch_size
+        self._data = AsyncSupportBotData()
+        # support_chat_message_id -> (tg_id, support_chat_message_id,
+        #                             album_part_ids)
+        self._rows = {}
+        # support chat message ids not written yet, album photos included
+        self._pending = set()
+        self._lock = asyncio.Lock()
+        self._timer = None
+        self._tasks = set()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, tg_id: int, support_chat_message_id: int,
+            album_part_ids: list = ()) -> None:
+        self._rows[support_chat_message_id] = (
+            tg_id, support_chat_message_id, list(album_part_ids))
+        self._pending.add(support_chat_message_id)
+        self._pending.update(album_part_ids)
+        if len(self._rows) >= self._batch_size:
+            self._flush_now()
+        elif self._timer is None:
+            self._schedule(self._interval)
+
+    def _schedule(self, delay: float) -> None:
+        self._timer = asyncio.get_running_loop().call_later(
+            delay, self._flush_now)
+
+    def _flush_now(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        task = asyncio.create_task(self._flush_logged())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_logged(self) -> None:
+        try:
+            await self.flush()
+        except Exception:
+            log.exception('message rows not written, trying again')
+
+    async def flush(self) -> None:
+        """Write the queued rows now"""
+        async with self._lock:
+            rows, self._rows = self._rows, {}
+            if not rows:
+                return
+            try:
+                inserted = await self._write(rows)
+            except Exception:
+                # before the rows queued meanwhile
+                rows.update(self._rows)
+                self._rows = rows
+                if self._timer is None:
+                    self._schedule(RETRY_AFTER)
+                raise
+            for tg_id, support_chat_message_id, album_part_ids \
+                    in rows.values():
+                self._pending.discard(support_chat_message_id)
+                self._pending.difference_update(album_part_ids)
+            if inserted < len(rows):
+                log.warning(f'{len(rows) - inserted} messages existed '
+                            f'already or were dropped')
+
+    async def _write(self, rows: dict) -> int:
+        """Insert the rows in one batch or, if it fails, one by one,
+        dropping those that fail alone. If the database can't be reached
+        all of them are tried again later, the rows written by then are
+        skipped"""
+        try:
+            return await self._data.add_messages(list(rows.values()))
+        except psycopg2.OperationalError:
+            raise
+        except Exception:
+            log.exception(f'batch of {len(rows)} message rows failed, '
+                          f'writing them one by one')
+        inserted = 0
+        for row in rows.values():
+            try:
+                inserted += await self._data.add_messages([row])
+            except psycopg2.OperationalError:
+                raise
+            except Exception:
+                log.exception(f'message row {row} dropped')
+        return inserted
+
+    async def flush_for(self, support_chat_message_id: int) -> None:
+        """Make sure the row of a support chat message has been written"""
+        if support_chat_message_id in self._pending:
+            await self.flush()
+
+    async def close(self) -> None:
+        """Write everything queued, on shutdown"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        try:
+            await self.flush()
+        except Exception:
+            # the rest of the shutdown goes on
+            log.exception(f'{len(self._rows)} message rows not written')
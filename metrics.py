@@ -0,0 +1,222 @@
+"""Counters and histograms exposed in the Prometheus text format.
+
+Updating a metric is a dict lookup and a few additions under a lock,
+cheap enough for the hot path and safe from the db executor threads.
+"""
+from __future__ import annotations
+from bisect import bisect_left
+from contextlib import contextmanager
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+
+from aiohttp import web
+
+log = logging.getLogger('metrics')
+
+# seconds, from a cached lookup to a slow Bot API call
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+registry = []
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            values = {labels: self._copy(value)
+                      for labels, value in self._values.items()}
+        for labels, value in sorted(values.items()):
+            lines.extend(self._render_value(labels, value))
+        return lines
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    def _render_value(self, labels: tuple, value) -> list:
+        labels = _format_labels(self.labelnames, labels)
+        return [f'{self.name}{labels} {value}']
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = \
+                self._values.get(labelvalues, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value read from `func` on every scrape"""
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, func):
+        super().__init__(name, documentation)
+        self._func = func
+
+    def render(self) -> list:
+        try:
+            self._values = {(): self._func()}
+        except Exception:
+            log.exception(f'gauge {self.name} failed')
+            self._values = {}
+        return super().render()
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labelvalues) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                # per bucket counts (not cumulative), sum, count
+                state = self._values[labelvalues] = \
+                    [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, *labelvalues):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1], value[2]]
+
+    def _render_value(self, labels: tuple, value) -> list:
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += bucket_count
+            bucket_labels = _format_labels(
+                self.labelnames, labels, f'le="{bound}"')
+            lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+        labels = _format_labels(self.labelnames, labels)
+        lines.append(f'{self.name}_sum{labels} {total}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+#  ------------------------------------------------------------------ DATABASE
+DB_QUERY_SECONDS = Histogram(
+    'db_query_duration_seconds',
+    'db_managing calls, including the wait for a pooled connection',
+    ('query',))
+DB_QUERY_ERRORS = Counter(
+    'db_query_errors_total', 'db_managing calls that raised',
+    ('query', 'error'))
+DB_CONNECTION_WAIT_SECONDS = Histogram(
+    'db_connection_wait_seconds', 'time to get a connection from the pool')
+
+# [queries, seconds] of the update being handled, see UpdateMetrics
+db_usage = contextvars.ContextVar('db_usage', default=None)
+
+
+def _track_db(label: str, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception as error:
+            DB_QUERY_ERRORS.inc(label, type(error).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_QUERY_SECONDS.observe(elapsed, label)
+            usage = db_usage.get()
+            if usage is not None:
+                usage[0] += 1
+                usage[1] += elapsed
+    return wrapper
+
+
+def instrument_db(cls):
+    """Class decorator: time every method of a db_managing class"""
+    for name, attr in list(vars(cls).items()):
+        func = attr.__func__ if isinstance(attr, staticmethod) else attr
+        if not inspect.isfunction(func) or \
+                inspect.isgeneratorfunction(func):
+            continue
+        wrapper = _track_db(f'{cls.__name__}.{name}', func)
+        if isinstance(attr, staticmethod):
+            wrapper = staticmethod(wrapper)
+        setattr(cls, name, wrapper)
+    return cls
+
+
+#  ---------------------------------------------------------------- HTTP SERVER
+class MetricsServer:
+    """Serves GET /metrics on a local port"""
+
+    def __init__(self, host: str, port: int):
+        self._host = host
+        self._port = port
+        self._runner = None
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=render(),
+                            content_type='text/plain', charset='utf-8')
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get('/metrics', self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self._host, self._port).start()
+        log.info(f'metrics on http://{self._host}:{self._port}/metrics')
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,167 @@
+import glob
+import logging
+import os
+import re
+
+from psycopg2 import errors
+
+log = logging.getLogger('migrate')
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'migrations')
+
+# first line of a migration that must run outside of a transaction,
+# e.g. CREATE INDEX CONCURRENTLY
+NO_TRANSACTION_MARKER = '-- migrate: no-transaction'
+
+# pg_advisory_lock key, two deploys never migrate at the same time
+MIGRATION_LOCK_ID = 7_310_001
+
+# databases deployed before schema_migrations existed were created from
+# 001_init_tables.sql only, by the first db_deploy.py; it is recorded as
+# applied there
+UNTRACKED_BASELINE = 1
+
+create_version_table_script = '''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version int PRIMARY KEY,
+        name varchar(255) NOT NULL,
+        applied_at timestamptz NOT NULL DEFAULT now()
+    );'''
+
+select_version_script = '''
+    SELECT coalesce(max(version), 0) FROM schema_migrations;'''
+
+select_untracked_script = '''
+    SELECT to_regclass('schema_migrations') IS NULL
+           AND to_regclass('tg_user') IS NOT NULL;'''
+
+
+class SchemaOutdated(Exception):
+    """Database schema is older than the migrations of this code"""
+    pass
+
+
+def get_migrations() -> list:
+    """(version, path) of migrations/NNN_*.sql in the order to apply"""
+    paths = glob.glob(os.path.join(MIGRATIONS_DIR, '[0-9]*_*.sql'))
+    return sorted(
+        (int(os.path.basename(path).split('_', 1)[0]), path)
+        for path in paths
+    )
+
+
+def latest_version() -> int:
+    """Schema version the code expects"""
+    migrations = get_migrations()
+    return migrations[-1][0] if migrations else 0
+
+
+def split_statements(script: str) -> list:
+    """Statements of a script, each ends with ; at the end of a line"""
+    statements = []
+    for statement in re.split(r';[ \t]*(?:\n|$)', script):
+        code = [line for line in statement.splitlines()
+                if line.strip() and not line.strip().startswith('--')]
+        if code:
+            statements.append(statement.strip() + ';')
+    return statements
+
+
+def _applied_versions(cursor) -> set:
+    cursor.execute('SELECT version FROM schema_migrations;')
+    return {version for version, in cursor.fetchall()}
+
+
+def _baseline(cursor) -> None:
+    insert_script = '''
+        INSERT INTO schema_migrations (version, name) VALUES (%s, %s);'''
+    for version, path in get_migrations():
+        if version <= UNTRACKED_BASELINE:
+            cursor.execute(insert_script,
+                           (version, os.path.basename(path)))
+    log.info(f'untracked database, migrations up to '
+             f'{UNTRACKED_BASELINE} recorded as applied')
+
+
+def _apply(connection, version: int, path: str) -> None:
+    name = os.path.basename(path)
+    with open(path, 'r') as migration:
+        script = migration.read()
+    insert_script = '''
+        INSERT INTO schema_migrations (version, name) VALUES (%s, %s);'''
+
+    if not script.startswith(NO_TRANSACTION_MARKER):
+        log.info(f'applying {name}')
+        with connection.cursor() as cursor:
+            cursor.execute(script)
+            cursor.execute(insert_script, (version, name))
+        connection.commit()
+        return
+
+    # every statement runs and commits on its own: concurrent index builds
+    # are not allowed in a transaction and don't lock writes to the table
+    log.info(f'applying {name} outside of a transaction')
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            for statement in split_statements(script):
+                cursor.execute(statement)
+            cursor.execute(insert_script, (version, name))
+    except Exception:
+        log.error(f'{name} failed: a concurrent index build that failed '
+                  f'leaves an INVALID index, drop it before re-running')
+        raise
+    finally:
+        connection.autocommit = False
+
+
+def apply_migrations(connection) -> list:
+    """Apply the migrations that are not in schema_migrations yet.
+
+    Each migration runs in its own transaction together with its version
+    record, so a failed migration leaves the schema as it was and is
+    retried on the next run. Migrations only add to the schema, existing
+    data is never dropped. A database deployed before migrations were
+    tracked is baselined at UNTRACKED_BASELINE first, the migrations after
+    it (e.g. the partitioning of message) are not all idempotent. Returns
+    the applied versions.
+    """
+    applied = []
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_lock(%s);', (MIGRATION_LOCK_ID,))
+        cursor.execute(select_untracked_script)
+        untracked, = cursor.fetchone()
+        cursor.execute(create_version_table_script)
+        if untracked:
+            _baseline(cursor)
+        done = _applied_versions(cursor)
+    connection.commit()
+    try:
+        for version, path in get_migrations():
+            if version not in done:
+                _apply(connection, version, path)
+                applied.append(version)
+    finally:
+        connection.rollback()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_advisory_unlock(%s);', (MIGRATION_LOCK_ID,))
+        connection.commit()
+    return applied
+
+
+def check_schema_version(cursor) -> int:
+    """Raise SchemaOutdated unless every migration has been applied"""
+    expected = latest_version()
+    try:
+        cursor.execute(select_version_script)
+    except errors.UndefinedTable:
+        raise SchemaOutdated(
+            'schema_migrations not found, run db_deploy.py')
+    version, = cursor.fetchone()
+    if version < expected:
+        raise SchemaOutdated(
+            f'schema version {version}, expected {expected}: '
+            f'run db_deploy.py')
+    return version
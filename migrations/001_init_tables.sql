@@ -1,17 +1,15 @@
-DROP TABLE IF EXISTS tg_user, operator, customer, message CASCADE;
-
-CREATE TABLE tg_user (
+CREATE TABLE IF NOT EXISTS tg_user (
         tg_id int8 PRIMARY KEY,
         tg_username varchar(255) NOT NULL,
         is_banned bool NOT NULL DEFAULT FALSE
 );
 
-CREATE TABLE operator (
+CREATE TABLE IF NOT EXISTS operator (
         operator_id int GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
         tg_id int8 UNIQUE REFERENCES tg_user(tg_id) ON DELETE CASCADE
 );
 
-CREATE TABLE customer (
+CREATE TABLE IF NOT EXISTS customer (
         customer_id int GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
         tg_id int8 UNIQUE REFERENCES tg_user(tg_id) ON DELETE CASCADE,
         phone varchar(15) UNIQUE NOT NULL,
@@ -19,7 +17,7 @@ CREATE TABLE customer (
         last_name varchar(255)
 );
 
-CREATE TABLE message (
+CREATE TABLE IF NOT EXISTS message (
         text_message_id int GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
         tg_id int8 REFERENCES tg_user(tg_id) ON DELETE CASCADE,
         support_chat_message_id int8 UNIQUE,
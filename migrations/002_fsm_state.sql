@@ -0,0 +1,11 @@
+CREATE TABLE IF NOT EXISTS fsm_state (
+        chat_id int8 NOT NULL,
+        user_id int8 NOT NULL,
+        state varchar(255),
+        data jsonb NOT NULL DEFAULT '{}',
+        updated_at timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (chat_id, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS fsm_state_updated_at_idx
+        ON fsm_state (updated_at);
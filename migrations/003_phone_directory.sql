@@ -0,0 +1,5 @@
+CREATE TABLE IF NOT EXISTS phone_directory (
+        phone varchar(15) PRIMARY KEY,
+        name varchar(255) NOT NULL DEFAULT '',
+        synced_at timestamptz NOT NULL DEFAULT now()
+);
@@ -0,0 +1,18 @@
+CREATE TABLE IF NOT EXISTS broadcast (
+        broadcast_id int GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        audience varchar(15) NOT NULL,
+        from_chat_id int8 NOT NULL,
+        message_id int8 NOT NULL,
+        last_tg_id int8 NOT NULL DEFAULT 0,
+        sent int NOT NULL DEFAULT 0,
+        failed int NOT NULL DEFAULT 0,
+        created_at timestamptz NOT NULL DEFAULT now(),
+        finished_at timestamptz
+);
+
+CREATE TABLE IF NOT EXISTS broadcast_failure (
+        broadcast_id int REFERENCES broadcast(broadcast_id) ON DELETE CASCADE,
+        tg_id int8 NOT NULL,
+        reason varchar(255) NOT NULL,
+        PRIMARY KEY (broadcast_id, tg_id)
+);
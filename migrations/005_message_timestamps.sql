@@ -0,0 +1,6 @@
+ALTER TABLE message
+        ADD COLUMN IF NOT EXISTS created_at timestamptz NOT NULL DEFAULT now(),
+        ADD COLUMN IF NOT EXISTS answered_at timestamptz;
+
+UPDATE message SET answered_at = created_at
+        WHERE is_answered AND answered_at IS NULL;
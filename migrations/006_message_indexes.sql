@@ -0,0 +1,21 @@
+-- migrate: no-transaction
+-- indexes are built without locking writes to the live tables
+
+-- replies and keyboards look messages up by support_chat_message_id and
+-- only need these columns: the unique index covers them
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS message_support_chat_message_id_idx
+        ON message (support_chat_message_id)
+        INCLUDE (text_message_id, tg_id, is_answered);
+ALTER TABLE message
+        DROP CONSTRAINT IF EXISTS message_support_chat_message_id_key;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS message_tg_id_idx
+        ON message (tg_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS message_unanswered_idx
+        ON message (created_at)
+        WHERE is_answered = FALSE;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tg_user_banned_idx
+        ON tg_user (tg_id)
+        WHERE is_banned = TRUE;
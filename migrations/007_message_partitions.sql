@@ -0,0 +1,91 @@
+-- message becomes partitioned by month of created_at. The table is copied,
+-- so writes to message wait until this migration is committed.
+--
+-- A unique index of a partitioned table has to include created_at, so
+-- support_chat_message_id is no longer unique in the schema:
+-- SupportBotData.add_message serializes inserts of a message instead.
+
+CREATE OR REPLACE FUNCTION message_ensure_partitions(
+        from_time timestamptz, to_time timestamptz) RETURNS int AS $$
+DECLARE
+    month_start timestamptz := date_trunc('month', from_time);
+    partition_name text;
+    created int := 0;
+BEGIN
+    WHILE month_start <= to_time LOOP
+        partition_name := 'message_p' || to_char(month_start, 'YYYYMM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF message '
+                'FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start,
+                month_start + interval '1 month');
+            created := created + 1;
+        END IF;
+        month_start := month_start + interval '1 month';
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE message RENAME TO message_unpartitioned;
+
+CREATE SEQUENCE message_id_seq AS int8;
+SELECT setval('message_id_seq',
+        coalesce((SELECT max(text_message_id)
+                  FROM message_unpartitioned), 0) + 1,
+        false);
+
+CREATE TABLE message (
+        text_message_id int8 NOT NULL DEFAULT nextval('message_id_seq'),
+        tg_id int8 REFERENCES tg_user(tg_id) ON DELETE CASCADE,
+        support_chat_message_id int8,
+        is_answered bool NOT NULL DEFAULT FALSE,
+        created_at timestamptz NOT NULL DEFAULT now(),
+        answered_at timestamptz,
+        PRIMARY KEY (text_message_id, created_at)
+) PARTITION BY RANGE (created_at);
+ALTER SEQUENCE message_id_seq OWNED BY message.text_message_id;
+
+-- rows of a month without a partition, e.g. when partitions were not
+-- created ahead in time
+CREATE TABLE message_default PARTITION OF message DEFAULT;
+
+SELECT message_ensure_partitions(
+        coalesce((SELECT min(created_at) FROM message_unpartitioned), now()),
+        now() + interval '2 months');
+
+INSERT INTO message (text_message_id, tg_id, support_chat_message_id,
+                     is_answered, created_at, answered_at)
+        SELECT text_message_id, tg_id, support_chat_message_id,
+               is_answered, created_at, answered_at
+        FROM message_unpartitioned;
+
+DROP TABLE message_unpartitioned;
+
+-- replies and keyboards look messages up by support_chat_message_id and
+-- only need these columns
+CREATE INDEX message_support_chat_message_id_idx
+        ON message (support_chat_message_id)
+        INCLUDE (text_message_id, tg_id, is_answered);
+
+CREATE INDEX message_tg_id_idx
+        ON message (tg_id);
+
+CREATE INDEX message_unanswered_idx
+        ON message (created_at)
+        WHERE is_answered = FALSE;
+
+-- answered messages in the order they are archived
+CREATE INDEX message_answered_idx
+        ON message (created_at)
+        WHERE is_answered = TRUE;
+
+-- answered messages moved out of message, see MessageArchiveData
+CREATE TABLE message_archive (
+        text_message_id int8 PRIMARY KEY,
+        tg_id int8 REFERENCES tg_user(tg_id) ON DELETE CASCADE,
+        support_chat_message_id int8 UNIQUE,
+        created_at timestamptz NOT NULL,
+        answered_at timestamptz
+);
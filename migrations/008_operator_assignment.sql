@@ -0,0 +1,18 @@
+ALTER TABLE operator
+        ADD COLUMN IF NOT EXISTS is_available bool NOT NULL DEFAULT FALSE;
+
+-- unanswered messages and the operator they are assigned to,
+-- operator_tg_id is NULL while nobody is available
+CREATE TABLE IF NOT EXISTS message_assignment (
+        support_chat_message_id int8 PRIMARY KEY,
+        tg_id int8 NOT NULL REFERENCES tg_user(tg_id) ON DELETE CASCADE,
+        operator_tg_id int8 REFERENCES operator(tg_id) ON DELETE SET NULL,
+        assigned_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- the operator who got the last message of a customer
+CREATE TABLE IF NOT EXISTS customer_operator (
+        tg_id int8 PRIMARY KEY REFERENCES tg_user(tg_id) ON DELETE CASCADE,
+        operator_tg_id int8 NOT NULL
+                REFERENCES operator(tg_id) ON DELETE CASCADE
+);
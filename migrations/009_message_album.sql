@@ -0,0 +1,6 @@
+-- photos of an album in the support chat, the album is stored as one
+-- message whose post is the one with the keyboard
+CREATE TABLE IF NOT EXISTS message_album_part (
+        support_chat_message_id int8 PRIMARY KEY,
+        post_support_chat_message_id int8 NOT NULL
+);
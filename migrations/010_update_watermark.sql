@@ -0,0 +1,7 @@
+-- every update up to update_id has been handled, updates Telegram
+-- delivers again after a restart are dropped
+CREATE TABLE IF NOT EXISTS update_watermark (
+        id bool PRIMARY KEY DEFAULT TRUE CHECK (id),
+        update_id int8 NOT NULL,
+        saved_at timestamptz NOT NULL DEFAULT now()
+);
@@ -0,0 +1,7 @@
+-- a watermark per worker process, valid while the number of workers
+-- (shards) stays the same, see sharding.py
+ALTER TABLE update_watermark DROP COLUMN IF EXISTS id;
+ALTER TABLE update_watermark
+        ADD COLUMN IF NOT EXISTS shard int NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS shards int NOT NULL DEFAULT 1;
+ALTER TABLE update_watermark ADD PRIMARY KEY (shard);
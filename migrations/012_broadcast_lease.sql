@@ -0,0 +1,5 @@
+-- the bot process sending a broadcast, until lease_until; a broadcast
+-- without a valid lease is resumed by whichever process claims it first
+ALTER TABLE broadcast
+        ADD COLUMN IF NOT EXISTS owner varchar(64),
+        ADD COLUMN IF NOT EXISTS lease_until timestamptz;
@@ -0,0 +1,260 @@
+import asyncio
+from collections import deque
+import heapq
+import itertools
+import logging
+import time
+
+from aiogram.utils import exceptions
+
+log = logging.getLogger('outbound')
+
+# lower value is sent first
+OPERATOR_REPLY = 0
+SUPPORT_CHAT_MIRROR = 1
+BROADCAST = 2
+
+# seconds between sweeps of the buckets of chats idle long enough to be
+# forgotten
+BUCKET_SWEEP_INTERVAL = 60
+
+
+class TokenBucket:
+    """`rate` tokens per second, at most `capacity` saved up"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self._tokens >= self.capacity
+
+    def delay(self) -> float:
+        """Seconds until a token is available"""
+        self._refill()
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def take(self) -> None:
+        self._refill()
+        self._tokens -= 1
+
+    async def acquire(self) -> None:
+        delay = self.delay()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.delay()
+        self.take()
+
+
+class _Job:
+    def __init__(self, priority: int, chat_id: int, method: str,
+                 kwargs: dict, future: asyncio.Future):
+        self.priority = priority
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+class OutboundQueue:
+    """Sends Bot API requests within Telegram's flood limits.
+
+    Every chat has its own queue of requests, by priority and then in
+    the order they came, so an operator reply to the support chat goes
+    before the mirrors queued there and messages of one priority keep
+    their order. Chats whose next request may be sent wait in a priority
+    queue (by the priority of that request) for `workers` tasks, which
+    also respect a global token bucket. A chat that has used up its own
+    bucket, or got a RetryAfter, leaves the queue until it may send again,
+    so a slow chat never blocks a worker.
+
+    The bucket of a chat outlives its requests, so the chat's limit holds
+    across them; buckets full again, of chats idle for `capacity / rate`
+    seconds, are dropped every BUCKET_SWEEP_INTERVAL seconds.
+    """
+
+    def __init__(self, bot, global_rate: float, private_chat_rate: float,
+                 group_chat_rate: float, workers: int = 8,
+                 max_retries: int = 5, latency_window: int = 1000):
+        self._bot = bot
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._private_chat_rate = private_chat_rate
+        self._group_chat_rate = group_chat_rate
+        self._chat_buckets = {}
+        self._chat_jobs = {}
+        self._ready = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._workers_count = workers
+        self._workers = []
+        self._sweeper = None
+        self._max_retries = max_retries
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # metrics
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self._latencies = deque(maxlen=latency_window)
+
+    def start(self) -> None:
+        self._workers = [asyncio.create_task(self._work())
+                         for _ in range(self._workers_count)]
+        self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def close(self) -> None:
+        """Send everything already queued, then stop the workers"""
+        await self._idle.wait()
+        tasks = self._workers + [self._sweeper]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._sweeper = None
+
+    async def call(self, priority: int, chat_id: int, method: str,
+                   **kwargs):
+        """Queue `bot.<method>(chat_id=chat_id, **kwargs)` and
+        return its result once it has been sent"""
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(priority, chat_id, method, kwargs, future)
+        entry = (priority, next(self._sequence), job)
+        jobs = self._chat_jobs.get(chat_id)
+        if jobs is None:
+            jobs = self._chat_jobs[chat_id] = [entry]
+            self._schedule(chat_id)
+        else:
+            # the chat is already scheduled or being sent to
+            heapq.heappush(jobs, entry)
+        self.queued += 1
+        self._idle.clear()
+        return await future
+
+    async def send_message(self, priority: int, chat_id: int, **kwargs):
+        return await self.call(priority, chat_id, 'send_message', **kwargs)
+
+    async def send_photo(self, priority: int, chat_id: int, **kwargs):
+        return await self.call(priority, chat_id, 'send_photo', **kwargs)
+
+    async def send_media_group(self, priority: int, chat_id: int, **kwargs):
+        return await self.call(priority, chat_id, 'send_media_group',
+                               **kwargs)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # negative ids are groups, including the support chat
+            if chat_id < 0:
+                rate = self._group_chat_rate
+            else:
+                rate = self._private_chat_rate
+            bucket = TokenBucket(rate, max(rate, 1))
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _schedule(self, chat_id: int, delay: float = 0) -> None:
+        """Put the chat in the ready queue once its next job may be sent"""
+        delay = max(delay, self._chat_bucket(chat_id).delay())
+        if delay > 0:
+            asyncio.get_running_loop().call_later(
+                delay, self._schedule, chat_id)
+            return
+        priority = self._chat_jobs[chat_id][0][0]
+        self._ready.put_nowait((priority, next(self._sequence), chat_id))
+
+    def _finish(self, chat_id: int, job: _Job) -> None:
+        jobs = self._chat_jobs[chat_id]
+        if jobs[0][2] is job:
+            heapq.heappop(jobs)
+        else:
+            # a request of higher priority came while it was being sent
+            jobs[:] = [entry for entry in jobs if entry[2] is not job]
+            heapq.heapify(jobs)
+        self.queued -= 1
+        if jobs:
+            self._schedule(chat_id)
+        else:
+            del self._chat_jobs[chat_id]
+        if not self.queued:
+            self._idle.set()
+
+    def sweep_buckets(self) -> int:
+        """Drop the buckets of idle chats, a full bucket is the same as a
+        new one; returns how many were dropped"""
+        idle = [chat_id for chat_id, bucket in self._chat_buckets.items()
+                if chat_id not in self._chat_jobs and bucket.is_full()]
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+        return len(idle)
+
+    async def _sweep_forever(self) -> None:
+        while True:
+            await asyncio.sleep(BUCKET_SWEEP_INTERVAL)
+            self.sweep_buckets()
+
+    async def _work(self) -> None:
+        while True:
+            _, _, chat_id = await self._ready.get()
+            job = self._chat_jobs[chat_id][0][2]
+            if job.future.cancelled():
+                # nobody waits for it any more, e.g. a stopped broadcast
+                self._finish(chat_id, job)
+                continue
+            await self._global_bucket.acquire()
+            self._chat_bucket(chat_id).take()
+            try:
+                result = await getattr(self._bot, job.method)(
+                    chat_id=chat_id, **job.kwargs)
+            except exceptions.RetryAfter as error:
+                self.retries += 1
+                job.attempts += 1
+                log.warning(f'{job.method} to {chat_id}: '
+                            f'retry after {error.timeout} s')
+                if job.attempts > self._max_retries:
+                    self._fail(job, error)
+                    self._finish(chat_id, job)
+                else:
+                    self._schedule(chat_id, delay=error.timeout)
+            except Exception as error:
+                self._fail(job, error)
+                self._finish(chat_id, job)
+            else:
+                self.sent += 1
+                self._latencies.append(time.monotonic() - job.enqueued_at)
+                if not job.future.done():
+                    job.future.set_result(result)
+                self._finish(chat_id, job)
+
+    def _fail(self, job: _Job, error: Exception) -> None:
+        self.failed += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        if latencies:
+            p50 = latencies[len(latencies) // 2]
+            p99 = latencies[max(int(len(latencies) * 0.99) - 1, 0)]
+        else:
+            p50 = p99 = 0
+        return {'queue_depth': self.queued,
+                'ready_chats': self._ready.qsize(),
+                'chat_buckets': len(self._chat_buckets),
+                'sent': self.sent,
+                'failed': self.failed,
+                'retries': self.retries,
+                'send_latency_p50': p50,
+                'send_latency_p99': p99}
@@ -0,0 +1,123 @@
+from __future__ import annotations
+import asyncio
+from datetime import datetime, timedelta, timezone
+import logging
+
+from airtable_db import PhoneNotFound, fetch_phone_names, \
+    find_name_by_phone, normalize_phone
+from cache import ObjectCache
+from db_async import AsyncPhoneDirectoryData
+
+log = logging.getLogger('phone_directory')
+
+# Airtable's LAST_MODIFIED_TIME() is compared with the start of the
+# previous pull minus this margin, to survive clock skew
+SYNC_OVERLAP = timedelta(minutes=1)
+
+
+class PhoneDirectory:
+    """phone -> name lookups without touching Airtable on the hot path.
+
+    The directory lives in memory and in the phone_directory table. It is
+    pulled from Airtable in full every `full_sync_interval` seconds and
+    incrementally (records modified since the last pull) every
+    `sync_interval` seconds. Of several processes only one pulls, started
+    with `pull`; the others reload the table every `sync_interval`.
+    Unknown phones are remembered for `negative_ttl` seconds; with
+    `lookup_on_miss` a phone that is neither known nor remembered as
+    unknown is looked up in Airtable once.
+    """
+
+    def __init__(self, table, sync_interval: int, full_sync_interval: int,
+                 negative_ttl: int, negative_cache_size: int = 10000,
+                 lookup_on_miss: bool = True):
+        self._table = table
+        self._sync_interval = sync_interval
+        self._full_sync_interval = full_sync_interval
+        self._lookup_on_miss = lookup_on_miss
+        self._names = {}
+        self._unknown = ObjectCache(
+            capacity=negative_cache_size, ttl=negative_ttl)
+        self._data = AsyncPhoneDirectoryData()
+        self._last_pull = None
+        self._last_full_pull = None
+        self._sync_task = None
+        self._pull = True
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    async def start(self, pull: bool = True) -> None:
+        """Load the stored directory, then keep it in sync in background:
+        with Airtable or, without `pull`, with the table"""
+        self._pull = pull
+        await self.reload()
+        self._sync_task = asyncio.create_task(self._sync_forever())
+
+    async def close(self) -> None:
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+
+    async def _sync_forever(self) -> None:
+        if not self._pull:
+            # start() has just loaded the table
+            await asyncio.sleep(self._sync_interval)
+        while True:
+            try:
+                await (self.sync() if self._pull else self.reload())
+            except Exception:
+                log.exception('phone directory sync failed')
+            await asyncio.sleep(self._sync_interval)
+
+    async def reload(self) -> None:
+        """The directory as stored by the process that pulls"""
+        self._names = dict(await self._data.load_all())
+        log.info(f'phone directory loaded: {len(self._names)} phones')
+
+    async def sync(self) -> None:
+        loop = asyncio.get_running_loop()
+        started = datetime.now(timezone.utc)
+        full = (self._last_full_pull is None or
+                (started - self._last_full_pull).total_seconds()
+                >= self._full_sync_interval)
+        modified_after = None if full else self._last_pull - SYNC_OVERLAP
+        entries = await loop.run_in_executor(
+            None, fetch_phone_names, self._table, modified_after)
+        names = dict(entries)
+        if full:
+            await self._data.replace_all(list(names.items()))
+            self._names = names
+            self._last_full_pull = started
+        elif names:
+            await self._data.upsert(list(names.items()))
+            self._names.update(names)
+        for phone in names:
+            self._unknown.invalidate(phone)
+        self._last_pull = started
+        log.info(f'phone directory synced ({"full" if full else "delta"}): '
+                 f'{len(names)} phones pulled')
+
+    def get_name(self, phone: str) -> str | None:
+        """O(1) local lookup, None if the phone is not known yet"""
+        return self._names.get(normalize_phone(phone))
+
+    async def find_name(self, phone: str) -> str:
+        key = normalize_phone(phone)
+        name = self._names.get(key)
+        if name is not None:
+            return name
+        if key in self._unknown or not self._lookup_on_miss:
+            raise PhoneNotFound('phone directory: phone number not found')
+
+        # registered on the site after the last pull
+        loop = asyncio.get_running_loop()
+        try:
+            name = await loop.run_in_executor(
+                None, find_name_by_phone, phone, self._table)
+        except PhoneNotFound:
+            self._unknown.put(key, True)
+            raise
+        self._names[key] = name
+        await self._data.upsert([(key, name)])
+        return name
@@ -0,0 +1,271 @@
+from __future__ import annotations
+import asyncio
+from collections import deque
+import logging
+import time
+
+from db_async import AsyncOperatorAssignmentData
+
+log = logging.getLogger('scheduler')
+
+LEAST_OUTSTANDING = 'least_outstanding'
+ROUND_ROBIN = 'round_robin'
+
+
+class _Assignment:
+    __slots__ = ('tg_id', 'operator', 'assigned_at')
+
+    def __init__(self, tg_id: int, operator: int | None, assigned_at: float):
+        self.tg_id = tg_id
+        self.operator = operator
+        self.assigned_at = assigned_at
+
+
+class OperatorScheduler:
+    """Assigns every new customer message to an available operator.
+
+    A customer keeps the operator of their previous message while that
+    operator is available (`sticky`). Otherwise the operator with the
+    fewest unanswered messages is picked (LEAST_OUTSTANDING), or the next
+    one in turn (ROUND_ROBIN). A message still unanswered after
+    `reassign_after` seconds goes to another operator, and messages that
+    came while nobody was available are assigned as soon as someone is.
+
+    Decisions are made in memory: available operators are kept in buckets
+    by their number of unanswered messages, deadlines in assignment order.
+    Every change is also written to the database and loaded on start.
+
+    With several worker processes each schedules the messages of its own
+    customers, those for which `owns(tg_id)` is true, and balances the
+    load of its own messages only.
+    """
+
+    def __init__(self, strategy: str, reassign_after: int,
+                 check_interval: int, sticky: bool = True,
+                 on_reassign=None, owns=None):
+        if strategy not in (LEAST_OUTSTANDING, ROUND_ROBIN):
+            raise ValueError(f'unknown strategy: {strategy}')
+        self._strategy = strategy
+        self._reassign_after = reassign_after
+        self._check_interval = check_interval
+        self._sticky = sticky
+        self._on_reassign = on_reassign
+        self._owns = owns
+        self._data = AsyncOperatorAssignmentData()
+        self.names = {}
+        self._available = set()
+        self._load = {}
+        # load -> available operators with that load, in insertion order
+        self._buckets = {}
+        self._min_load = 0
+        self._rotation = deque()
+        self._customer_operator = {}
+        self._assignments = {}
+        self._by_operator = {}
+        # (assigned_at, support_chat_message_id) in assignment order
+        self._deadlines = deque()
+        self._unassigned = {}
+        self._task = None
+
+    # ------------------------------------------------------------ operators
+    def _bucket_add(self, operator: int) -> None:
+        load = self._load[operator]
+        self._buckets.setdefault(load, {})[operator] = None
+        self._min_load = min(self._min_load, load)
+
+    def _bucket_remove(self, operator: int) -> None:
+        load = self._load[operator]
+        bucket = self._buckets[load]
+        del bucket[operator]
+        if not bucket:
+            del self._buckets[load]
+
+    def _change_load(self, operator: int, delta: int) -> None:
+        available = operator in self._available
+        if available:
+            self._bucket_remove(operator)
+        self._load[operator] += delta
+        if available:
+            self._bucket_add(operator)
+
+    def _add_operator(self, operator: int, name: str) -> None:
+        self.names[operator] = name
+        self._load.setdefault(operator, 0)
+        self._by_operator.setdefault(operator, set())
+
+    def _make_available(self, operator: int) -> None:
+        if operator not in self._available:
+            self._available.add(operator)
+            self._bucket_add(operator)
+            self._rotation.append(operator)
+
+    def _make_away(self, operator: int) -> None:
+        if operator in self._available:
+            self._bucket_remove(operator)
+            self._available.discard(operator)
+            self._rotation.remove(operator)
+
+    def is_available(self, operator: int) -> bool:
+        return operator in self._available
+
+    def pick(self, tg_id: int, exclude: int | None = None) -> int | None:
+        """Operator for the next message of customer `tg_id`"""
+        if self._sticky:
+            operator = self._customer_operator.get(tg_id)
+            if operator in self._available and operator != exclude:
+                return operator
+        if not self._available:
+            return None
+
+        if self._strategy == ROUND_ROBIN:
+            for _ in range(len(self._rotation)):
+                operator = self._rotation[0]
+                self._rotation.rotate(-1)
+                if operator != exclude:
+                    return operator
+            return None
+
+        # every bucket's load is >= _min_load
+        load = self._min_load
+        while load not in self._buckets:
+            load += 1
+        self._min_load = load
+        for operator in self._buckets[load]:
+            if operator != exclude:
+                return operator
+        # only the excluded operator has the least load
+        others = [(self._load[operator], operator)
+                  for operator in self._available if operator != exclude]
+        return min(others)[1] if others else None
+
+    # ---------------------------------------------------------- assignments
+    def _track(self, support_chat_message_id: int, tg_id: int,
+               operator: int | None, assigned_at: float) -> None:
+        self._untrack(support_chat_message_id)
+        self._assignments[support_chat_message_id] = \
+            _Assignment(tg_id, operator, assigned_at)
+        if operator is None:
+            self._unassigned[support_chat_message_id] = None
+            return
+        if operator not in self._load:
+            # assigned before and no longer an operator
+            self._add_operator(operator, str(operator))
+        self._change_load(operator, 1)
+        self._by_operator[operator].add(support_chat_message_id)
+        self._customer_operator[tg_id] = operator
+        self._deadlines.append((assigned_at, support_chat_message_id))
+
+    def _untrack(self, support_chat_message_id: int) -> _Assignment | None:
+        assignment = self._assignments.pop(support_chat_message_id, None)
+        if assignment is None:
+            return None
+        self._unassigned.pop(support_chat_message_id, None)
+        if assignment.operator is not None:
+            self._change_load(assignment.operator, -1)
+            self._by_operator[assignment.operator].discard(
+                support_chat_message_id)
+        return assignment
+
+    def operator_of(self, support_chat_message_id: int) -> int | None:
+        assignment = self._assignments.get(support_chat_message_id)
+        return assignment.operator if assignment else None
+
+    async def assign(self, support_chat_message_id: int, tg_id: int,
+                     operator: int | None) -> None:
+        """Record the operator chosen by pick(), None if nobody was"""
+        assigned_at = time.time()
+        self._track(support_chat_message_id, tg_id, operator, assigned_at)
+        await self._data.assign(
+            support_chat_message_id, tg_id, operator, assigned_at)
+
+    async def complete(self, support_chat_message_id: int) -> None:
+        """The message has been answered"""
+        if self._untrack(support_chat_message_id) is not None:
+            await self._data.complete(support_chat_message_id)
+
+    async def _reassign(self, support_chat_message_id: int,
+                        operator: int | None) -> None:
+        tg_id = self._assignments[support_chat_message_id].tg_id
+        await self.assign(support_chat_message_id, tg_id, operator)
+        log.info(f'message {support_chat_message_id} '
+                 f'reassigned to {operator}')
+        if operator is not None and self._on_reassign is not None:
+            await self._on_reassign(support_chat_message_id, operator)
+
+    async def _assign_waiting(self) -> None:
+        for support_chat_message_id in list(self._unassigned):
+            tg_id = self._assignments[support_chat_message_id].tg_id
+            operator = self.pick(tg_id)
+            if operator is None:
+                return
+            await self._reassign(support_chat_message_id, operator)
+
+    async def set_available(self, operator: int, name: str,
+                            available: bool) -> None:
+        """An operator comes or goes, the messages of one who goes
+        are handed to the others"""
+        await self._data.set_available(operator, available)
+        self._add_operator(operator, name)
+        if available:
+            self._make_available(operator)
+            await self._assign_waiting()
+            return
+        self._make_away(operator)
+        for support_chat_message_id in list(self._by_operator[operator]):
+            tg_id = self._assignments[support_chat_message_id].tg_id
+            await self._reassign(support_chat_message_id, self.pick(tg_id))
+
+    async def _reassign_overdue(self) -> None:
+        overdue = time.time() - self._reassign_after
+        while self._deadlines and self._deadlines[0][0] <= overdue:
+            assigned_at, support_chat_message_id = self._deadlines.popleft()
+            assignment = self._assignments.get(support_chat_message_id)
+            if assignment is None or assignment.assigned_at != assigned_at:
+                # answered or reassigned since
+                continue
+            operator = self.pick(
+                assignment.tg_id, exclude=assignment.operator)
+            if operator is None:
+                # nobody else is available, wait for another timeout
+                assignment.assigned_at = time.time()
+                self._deadlines.append(
+                    (assignment.assigned_at, support_chat_message_id))
+                continue
+            await self._reassign(support_chat_message_id, operator)
+        await self._assign_waiting()
+
+    # ------------------------------------------------------------ lifecycle
+    async def start(self) -> None:
+        for operator, name, available in await self._data.get_operators():
+            self._add_operator(operator, name)
+            if available:
+                self._make_available(operator)
+        for tg_id, operator in await self._data.get_customer_operators():
+            self._customer_operator[tg_id] = operator
+        for support_chat_message_id, tg_id, operator, assigned_at \
+                in await self._data.get_assignments():
+            if self._owns is not None and not self._owns(tg_id):
+                continue
+            self._track(support_chat_message_id, tg_id, operator,
+                        assigned_at)
+        log.info(f'scheduler loaded: {len(self._available)} operators '
+                 f'available, {len(self._assignments)} messages assigned')
+        self._task = asyncio.create_task(self._check_forever())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _check_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self._check_interval)
+            try:
+                await self._reassign_overdue()
+            except Exception:
+                log.exception('reassigning overdue messages failed')
+
+    def stats(self) -> dict:
+        return {'available_operators': len(self._available),
+                'assigned': len(self._assignments) - len(self._unassigned),
+                'unassigned': len(self._unassigned)}
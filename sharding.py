@@ -0,0 +1,302 @@
+from __future__ import annotations
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+
+from db_async import AsyncSupportBotData
+from db_managing import MsgNotFound
+
+log = logging.getLogger('sharding')
+
+# commands of the support chat every worker process has to handle
+SHARED_COMMANDS = ('/available', '/away')
+# routing key of an update that goes to every worker process
+ALL_SHARDS = 'all'
+# seconds between checks that the worker processes are alive
+MONITOR_INTERVAL = 1
+# seconds a worker process gets to finish its updates on stop
+WORKER_STOP_TIMEOUT = 60
+# updates a worker process takes from its queue at a time
+TAKE_AT_MOST = 100
+
+
+def shard_of(tg_id: int | None, shards: int) -> int:
+    """Worker process of a customer, updates about nobody go to the first"""
+    if tg_id is None:
+        return 0
+    return tg_id % shards
+
+
+def _customer_in_callback_data(data: str) -> int | None:
+    # btn:customer_textmessage:<answer>:<tg_id>, see button_cb
+    prefix, question_name, _, tg_id = (data.split(':') + [''] * 4)[:4]
+    if prefix != 'btn' or question_name != 'customer_textmessage':
+        return None
+    try:
+        return int(tg_id) or None
+    except ValueError:
+        return None
+
+
+def customer_of_post(message: dict) -> int | None:
+    """tg_id of the customer a support chat post is about, read from its
+    keyboard; None for posts without one, e.g. the photos of an album"""
+    markup = message.get('reply_markup') or {}
+    for row in markup.get('inline_keyboard', ()):
+        for button in row:
+            tg_id = _customer_in_callback_data(
+                button.get('callback_data', ''))
+            if tg_id is not None:
+                return tg_id
+    return None
+
+
+def routing_key(update: dict) -> int | str | None:
+    """tg_id of the customer an update is about, ALL_SHARDS for the
+    updates every worker process needs, None if it is about nobody"""
+    message = update.get('message') or update.get('edited_message')
+    if message is not None:
+        if message['chat']['type'] == 'private':
+            return message['from']['id']
+        words = (message.get('text') or '').split()
+        if words and words[0].split('@')[0] in SHARED_COMMANDS:
+            return ALL_SHARDS
+        replied = message.get('reply_to_message')
+        if replied is not None:
+            return customer_of_post(replied)
+        return None
+    query = update.get('callback_query')
+    if query is not None:
+        chat = (query.get('message') or {}).get('chat') or {}
+        if chat.get('type') == 'private':
+            return query['from']['id']
+        return _customer_in_callback_data(query.get('data') or '')
+    # chat member updates and the like, by whoever caused them
+    for value in update.values():
+        if isinstance(value, dict) and 'from' in value:
+            return value['from']['id']
+    return None
+
+
+def post_id(update: dict) -> int | None:
+    """message_id of the support chat post an update replies to or whose
+    button was pressed"""
+    query = update.get('callback_query')
+    if query is not None:
+        post = query.get('message') or {}
+        if (post.get('chat') or {}).get('type') == 'private':
+            return None
+        return post.get('message_id')
+    message = update.get('message') or update.get('edited_message')
+    if message is None or message['chat']['type'] == 'private':
+        return None
+    replied = message.get('reply_to_message')
+    return replied['message_id'] if replied is not None else None
+
+
+class OrderedDispatch:
+    """Handles updates concurrently, except that the updates of one key
+    are handled one after another, in the order they were submitted.
+
+    Updates without a key are not ordered.
+    """
+
+    def __init__(self, handle):
+        self._handle = handle
+        # key -> task of its last submitted update
+        self._tails = {}
+        self._tasks = set()
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def submit(self, key, update) -> None:
+        previous = self._tails.get(key) if key is not None else None
+        task = asyncio.create_task(self._run(previous, update))
+        self._tasks.add(task)
+        if key is not None:
+            self._tails[key] = task
+        task.add_done_callback(lambda done: self._done(key, done))
+
+    def _done(self, key, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if key is not None and self._tails.get(key) is task:
+            del self._tails[key]
+
+    async def _run(self, previous: asyncio.Task | None, update) -> None:
+        if previous is not None:
+            # whether it failed or not
+            await asyncio.wait((previous,))
+        try:
+            await self._handle(update)
+        except Exception:
+            log.exception(f'update {update.get("update_id")} failed')
+
+    async def join(self) -> None:
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def _take(updates: multiprocessing.Queue) -> list:
+    while True:
+        try:
+            items = [updates.get(timeout=MONITOR_INTERVAL)]
+            break
+        except queue.Empty:
+            # nobody will ever stop a worker of a dead supervisor
+            if not multiprocessing.parent_process().is_alive():
+                return [None]
+    while len(items) < TAKE_AT_MOST and items[-1] is not None:
+        try:
+            items.append(updates.get_nowait())
+        except queue.Empty:
+            break
+    return items
+
+
+async def _work(updates: multiprocessing.Queue,
+                acks: multiprocessing.Queue | None) -> None:
+    from aiogram import Bot, Dispatcher, types
+    import support_bot
+
+    dp = support_bot.dp
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    await support_bot.on_startup(dp)
+
+    async def handle(update: dict) -> None:
+        try:
+            # through the update middlewares, like polling does
+            await dp.updates_handler.notify(types.Update.to_object(update))
+        finally:
+            if acks is not None:
+                acks.put(update['update_id'])
+
+    dispatch = OrderedDispatch(handle)
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            items = await loop.run_in_executor(None, _take, updates)
+            for item in items:
+                if item is None:
+                    return
+                key, update = item
+                dispatch.submit(key, update)
+    finally:
+        await dispatch.join()
+        await support_bot.on_shutdown(dp)
+        await dp.storage.close()
+        await dp.storage.wait_closed()
+        session = await dp.bot.get_session()
+        await session.close()
+
+
+def worker_main(shard: int, shards: int, overrides: dict,
+                updates: multiprocessing.Queue,
+                acks: multiprocessing.Queue | None = None) -> None:
+    """Entry point of a worker process: handles the updates put on
+    `updates` as (routing key, update dict) until it gets None"""
+    # the supervisor stops its workers itself, after the last update,
+    # also when the signal is sent to the whole process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(levelname)s:worker {shard}:%(name)s:%(message)s',
+        force=True)
+    # before support_bot reads the config
+    import config
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    config.SHARD = shard
+    config.WORKERS = shards
+    asyncio.run(_work(updates, acks))
+
+
+class Supervisor:
+    """Runs `workers` worker processes and routes every update to one of
+    them by the customer it is about, so a customer's updates are always
+    handled by the same process, in the order they came.
+
+    Updates about nobody go to the first worker process, the shared
+    support chat commands to all of them. A worker process that died is
+    started again on the same queue; the updates it had taken are lost.
+
+    `overrides` are config values set in every worker process, `acks`
+    gets the update_id of every handled update (for benchmarks).
+    """
+
+    def __init__(self, workers: int, overrides: dict = None,
+                 acks: multiprocessing.Queue = None):
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = workers
+        self._overrides = overrides or {}
+        self._acks = acks
+        self._queues = [self._context.Queue() for _ in range(workers)]
+        self._processes = [None] * workers
+        self._data = AsyncSupportBotData()
+        self._monitor = None
+        self.restarts = 0
+
+    def _start_worker(self, shard: int) -> None:
+        process = self._context.Process(
+            target=worker_main,
+            args=(shard, self._workers, self._overrides,
+                  self._queues[shard], self._acks),
+            name=f'worker-{shard}')
+        process.start()
+        self._processes[shard] = process
+        log.info(f'worker {shard} started, pid {process.pid}')
+
+    def start(self) -> None:
+        for shard in range(self._workers):
+            self._start_worker(shard)
+        self._monitor = asyncio.create_task(self._watch())
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(MONITOR_INTERVAL)
+            for shard, process in enumerate(self._processes):
+                if not process.is_alive():
+                    log.error(f'worker {shard} exited with '
+                              f'{process.exitcode}, starting it again')
+                    self.restarts += 1
+                    self._start_worker(shard)
+
+    async def _customer_of_post(self, support_chat_message_id: int):
+        try:
+            view = await self._data.get_message_view(support_chat_message_id)
+        except MsgNotFound:
+            return None
+        return view[1]
+
+    async def route(self, update: dict) -> None:
+        key = routing_key(update)
+        if key == ALL_SHARDS:
+            for updates in self._queues:
+                updates.put((None, update))
+            return
+        if key is None:
+            # posts without the customer in their keyboard: album photos
+            # and posts made before it was there (callback data ...:0)
+            support_chat_message_id = post_id(update)
+            if support_chat_message_id is not None:
+                key = await self._customer_of_post(support_chat_message_id)
+        self._queues[shard_of(key, self._workers)].put((key, update))
+
+    async def stop(self) -> None:
+        """Let the worker processes handle what they got and stop them"""
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+        for updates in self._queues:
+            updates.put(None)
+        loop = asyncio.get_running_loop()
+        for shard, process in enumerate(self._processes):
+            await loop.run_in_executor(
+                None, process.join, WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                log.error(f'worker {shard} did not stop, killing it')
+                process.kill()
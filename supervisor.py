@@ -0,0 +1,101 @@
+"""Runs the bot as WORKERS worker processes, see sharding.Supervisor.
+
+Receives the updates itself, by polling or by webhook like
+support_bot.py, and hands each one to the worker process of its
+customer.
+
+    python supervisor.py
+"""
+import asyncio
+import logging
+import signal
+
+from aiogram import Bot
+from aiogram.bot import api
+from aiogram.bot.api import TelegramAPIServer
+from aiohttp import web
+
+from config import API_TOKEN, TELEGRAM_API_SERVER, USE_WEBHOOK, \
+    WEBHOOK_HOST, WEBHOOK_PATH, WEBAPP_HOST, WEBAPP_PORT, \
+    WEBHOOK_MAX_CONNECTIONS, WEBHOOK_SHUTDOWN_TIMEOUT, WORKERS
+from db_async import db_executor
+from db_pool import db_pool
+from sharding import Supervisor
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger('supervisor')
+
+# seconds getUpdates waits for new updates
+LONG_POLL_TIMEOUT = 20
+# seconds before polling again after a failed getUpdates
+POLL_RETRY_AFTER = 5
+
+
+async def poll(bot: Bot, supervisor: Supervisor,
+               stopping: asyncio.Event) -> None:
+    offset = None
+    while not stopping.is_set():
+        payload = {'timeout': LONG_POLL_TIMEOUT}
+        if offset is not None:
+            payload['offset'] = offset
+        try:
+            # raw dicts, the workers parse the updates
+            updates = await bot.request(api.Methods.GET_UPDATES, payload)
+        except Exception:
+            log.exception('getUpdates failed')
+            await asyncio.sleep(POLL_RETRY_AFTER)
+            continue
+        for update in updates:
+            await supervisor.route(update)
+            offset = update['update_id'] + 1
+
+
+async def serve_webhook(bot: Bot, supervisor: Supervisor,
+                        stopping: asyncio.Event) -> None:
+    async def receive(request: web.Request) -> web.Response:
+        await supervisor.route(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, receive)
+    runner = web.AppRunner(app, shutdown_timeout=WEBHOOK_SHUTDOWN_TIMEOUT)
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+    await bot.set_webhook(url=WEBHOOK_HOST + WEBHOOK_PATH,
+                          max_connections=WEBHOOK_MAX_CONNECTIONS)
+    try:
+        await stopping.wait()
+    finally:
+        # the webhook stays registered: Telegram keeps updates until we
+        # are back
+        await runner.cleanup()
+
+
+async def main() -> None:
+    # the long poll must not time out on the client side first
+    bot = Bot(token=API_TOKEN, timeout=LONG_POLL_TIMEOUT + 10,
+              server=TelegramAPIServer.from_base(TELEGRAM_API_SERVER))
+    supervisor = Supervisor(workers=WORKERS)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    supervisor.start()
+    receive = serve_webhook if USE_WEBHOOK else poll
+    receiving = asyncio.create_task(receive(bot, supervisor, stopping))
+    await stopping.wait()
+    if not USE_WEBHOOK:
+        # the updates of an unfinished getUpdates come again next time
+        receiving.cancel()
+    await asyncio.gather(receiving, return_exceptions=True)
+    log.info('stopping the workers')
+    await supervisor.stop()
+    session = await bot.get_session()
+    await session.close()
+    db_executor.shutdown(wait=True)
+    db_pool.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
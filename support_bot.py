@@ -1,7 +1,10 @@
+from __future__ import annotations
 import logging
+import sys
 import typing
 
-from aiogram import Bot, Dispatcher, executor, types
+from aiogram import Dispatcher, executor, types
+from aiogram.bot.api import TelegramAPIServer
 from aiogram.utils import callback_data, exceptions
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
@@ -9,20 +12,102 @@ from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.types.message import ContentType
 
 # Import modules of this project
-from config import API_TOKEN, SUPPORT_CHAT_ID
-from business_logic import Operator, SupportBot, TextMessage, \
+from config import API_TOKEN, SUPPORT_CHAT_ID, BAN_LIST_SYNC, \
+    TELEGRAM_API_SERVER, USE_WEBHOOK, WEBHOOK_HOST, WEBHOOK_PATH, \
+    WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_MAX_CONNECTIONS, \
+    WEBHOOK_SHUTDOWN_TIMEOUT, FSM_STORAGE, FSM_STATE_TTL, \
+    FSM_MEMORY_CACHE_SIZE, OUTBOUND_GLOBAL_RATE, OUTBOUND_PRIVATE_CHAT_RATE, \
+    OUTBOUND_GROUP_CHAT_RATE, OUTBOUND_WORKERS, OUTBOUND_MAX_RETRIES, \
+    BROADCAST_CHUNK_SIZE, BROADCAST_LEASE, BROADCAST_PROGRESS_EVERY, \
+    MESSAGE_ARCHIVE_AFTER, MESSAGE_ARCHIVE_INTERVAL, \
+    MESSAGE_ARCHIVE_BATCH_SIZE, MESSAGE_ARCHIVE_BATCH_PAUSE, \
+    MESSAGE_PARTITIONS_AHEAD, METRICS_ENABLED, METRICS_HOST, METRICS_PORT, \
+    OPERATOR_ASSIGNMENT, OPERATOR_REASSIGN_AFTER, \
+    OPERATOR_ASSIGNMENT_CHECK_INTERVAL, TICKET_DEBOUNCE, TICKET_IDLE_TIMEOUT, \
+    MEDIA_GROUP_WINDOW, UPDATE_DEDUP_RING_SIZE, \
+    UPDATE_WATERMARK_FLUSH_INTERVAL, FLOOD_RATE, FLOOD_BURST, \
+    FLOOD_BAN_AFTER, WORKERS, SHARD
+from db_async import db_executor, run_in_db
+from db_pool import db_pool
+from fsm_storage import PostgresStorage
+from metrics import Gauge, MetricsServer
+from bot_metrics import InstrumentedBot, MetricsMiddleware
+from dedup import UpdateDeduplicator
+from throttle import FloodThrottle
+from sharding import shard_of
+from archive import MessageArchiver
+from scheduler import OperatorScheduler
+from tickets import TicketThreader
+from albums import AlbumCollector
+from migrate import check_schema_version
+from broadcast import AUDIENCES, Broadcaster
+from outbound import OutboundQueue, OPERATOR_REPLY, SUPPORT_CHAT_MIRROR
+from business_logic import MessageView, Operator, SupportBot, \
     UserNotFoundOnSite, PhoneAlreadyBelongsCustomer
 from texts_for_replay import instruction_text, phone_found_text, \
     phone_not_found_text, help_text, instruction_how_use_support, \
-    phone_already_belong_customer_text, help_for_opertor_text
+    phone_already_belong_customer_text, help_for_opertor_text, \
+    broadcast_usage_text, broadcast_started_text, broadcast_finished_text, \
+    assigned_operator_text, reassigned_operator_text, \
+    operator_available_text, operator_away_text, album_text, flood_text
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger('support_bot')
 
 # Initialize bot and dispatcher
-bot = Bot(token=API_TOKEN, parse_mode="HTML")
-dp = Dispatcher(bot, storage=MemoryStorage())
+bot = InstrumentedBot(
+    token=API_TOKEN,
+    parse_mode="HTML",
+    server=TelegramAPIServer.from_base(TELEGRAM_API_SERVER)
+)
+if FSM_STORAGE == 'postgres':
+    storage = PostgresStorage(
+        ttl=FSM_STATE_TTL,
+        cache_size=FSM_MEMORY_CACHE_SIZE
+    )
+else:
+    storage = MemoryStorage()
+dp = Dispatcher(bot, storage=storage)
+# first, so a duplicate update goes no further; an update whose text or
+# photo still waits in the threader or the album collector is not handled
+# yet, the message rows are written before the watermark
+deduplicator = UpdateDeduplicator(
+    ring_size=UPDATE_DEDUP_RING_SIZE,
+    flush_interval=UPDATE_WATERMARK_FLUSH_INTERVAL,
+    shard=SHARD,
+    shards=WORKERS,
+    persist=not USE_WEBHOOK,
+    buffered=lambda: [*threader.pending_update_ids(),
+                      *albums.pending_update_ids()],
+    before_save=lambda: support_bot.message_writer.flush()
+)
+dp.middleware.setup(deduplicator)
+if METRICS_ENABLED:
+    dp.middleware.setup(MetricsMiddleware())
+# a port per worker process
+metrics_server = MetricsServer(host=METRICS_HOST, port=METRICS_PORT + SHARD)
+# rate limited sending of customer messages and operator replies, the
+# worker processes share the limits of the bot and of the support chat;
+# a private chat is only written to by the worker of its customer
+outbox = OutboundQueue(
+    bot=bot,
+    global_rate=OUTBOUND_GLOBAL_RATE / WORKERS,
+    private_chat_rate=OUTBOUND_PRIVATE_CHAT_RATE,
+    group_chat_rate=OUTBOUND_GROUP_CHAT_RATE / WORKERS,
+    workers=OUTBOUND_WORKERS,
+    max_retries=OUTBOUND_MAX_RETRIES
+)
+Gauge('outbound_queue_depth', 'requests waiting in the outbound queue',
+      lambda: outbox.queued)
+# moves old answered messages out of the message table
+archiver = MessageArchiver(
+    archive_after=MESSAGE_ARCHIVE_AFTER,
+    interval=MESSAGE_ARCHIVE_INTERVAL,
+    batch_size=MESSAGE_ARCHIVE_BATCH_SIZE,
+    batch_pause=MESSAGE_ARCHIVE_BATCH_PAUSE,
+    partitions_ahead=MESSAGE_PARTITIONS_AHEAD
+)
 
 # Sructure of callback buttons
 button_cb = callback_data.CallbackData(
@@ -32,6 +117,32 @@ button_cb = callback_data.CallbackData(
 support_bot = SupportBot()
 
 
+#  ------------------------------------------------------------ ЗАЩИТА ОТ ФЛУДА
+async def report_flood(message: types.Message, dropped: int):
+    """Первое отброшенное сообщение - предупреждение клиенту,
+    FLOOD_BAN_AFTER подряд - бан"""
+    tg_id = message.from_user.id
+    if support_bot.is_banned(tg_id):
+        return
+    if dropped == 1:
+        await outbox.send_message(
+            OPERATOR_REPLY,
+            chat_id=message.chat.id,
+            text=flood_text
+        )
+    if FLOOD_BAN_AFTER and dropped == FLOOD_BAN_AFTER:
+        log.warning(f'flood of {tg_id}: banned')
+        await Operator.ban(tg_id=tg_id)
+
+
+throttle = FloodThrottle(
+    rate=FLOOD_RATE,
+    burst=FLOOD_BURST,
+    on_flood=report_flood
+)
+dp.middleware.setup(throttle)
+
+
 #  -------------------------------------------------------------- ВХОД ТГ ЮЗЕРА
 def get_empty_keyboard():
     keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -60,7 +171,7 @@ class CustomerState(StatesGroup):
 async def start_command(message: types.Message, state: FSMContext):
     log.info('start command from: %r', message.from_user.id)
 
-    support_bot.add_tg_user(
+    await support_bot.add_tg_user(
         tg_id=message.from_user.id,
         tg_username=message.from_user.username
     )
@@ -80,7 +191,7 @@ async def new_contact(message: types.Message, state: FSMContext):
 
     phone = message.contact.phone_number.strip('+')
     try:
-        customer = support_bot.add_customer(
+        customer = await support_bot.add_customer(
             tg_id=message.from_user.id,
             phone=phone
         )
@@ -89,11 +200,13 @@ async def new_contact(message: types.Message, state: FSMContext):
             text=phone_not_found_text,
             reply_markup=get_phone_keyboard()
         )
+        return
     except PhoneAlreadyBelongsCustomer:
         await message.answer(
             text=phone_already_belong_customer_text,
             reply_markup=get_phone_keyboard()
         )
+        return
 
     await message.reply(
         text=phone_found_text,
@@ -130,6 +243,59 @@ async def send_help_to_operator(message: types.Message, state: FSMContext):
     )
 
 
+#  ------------------------------------------------------ НАЗНАЧЕНИЕ ОПЕРАТОРОВ
+def operator_mention(operator_tg_id: int) -> str:
+    name = scheduler.names.get(operator_tg_id) or operator_tg_id
+    return f'<a href="tg://user?id={operator_tg_id}">{name}</a>'
+
+
+async def report_reassigned(support_chat_message_id: int,
+                            operator_tg_id: int):
+    await outbox.send_message(
+        SUPPORT_CHAT_MIRROR,
+        chat_id=SUPPORT_CHAT_ID,
+        reply_to_message_id=support_chat_message_id,
+        text=reassigned_operator_text.format(
+            operator=operator_mention(operator_tg_id))
+    )
+
+
+def is_own_customer(tg_id: int) -> bool:
+    return shard_of(tg_id, WORKERS) == SHARD
+
+
+if OPERATOR_ASSIGNMENT:
+    scheduler = OperatorScheduler(
+        strategy=OPERATOR_ASSIGNMENT,
+        reassign_after=OPERATOR_REASSIGN_AFTER,
+        check_interval=OPERATOR_ASSIGNMENT_CHECK_INTERVAL,
+        on_reassign=report_reassigned,
+        owns=is_own_customer if WORKERS > 1 else None
+    )
+else:
+    scheduler = None
+
+
+@dp.message_handler(
+    lambda message: message.chat.id == SUPPORT_CHAT_ID,
+    commands=['available', 'away'], state="*")
+async def operator_shift(message: types.Message, state: FSMContext):
+    log.info('operator_shift from: %r', message.from_user.id)
+    if scheduler is None:
+        return
+    available = message.get_command(pure=True) == 'available'
+    name = message.from_user.username or message.from_user.full_name
+    await support_bot.add_tg_user(
+        tg_id=message.from_user.id,
+        tg_username=name
+    )
+    await scheduler.set_available(message.from_user.id, name, available)
+    # every worker process gets the command, the first one answers
+    if SHARD == 0:
+        await message.reply(
+            operator_available_text if available else operator_away_text)
+
+
 #  ------------------------------------------------------------ ПРИЕМ ОБРАЩЕНИЙ
 answered_button = 'Отвечено ✔️'
 unanswered_button = 'Не отвечено❗'
@@ -164,130 +330,308 @@ def make_inline_keyboard(
 
 
 def keyboard_for_message_in_support_chat(
-        answers: list) -> types.InlineKeyboardMarkup:
+        answers: list, tg_id: int) -> types.InlineKeyboardMarkup:
+    """Кнопки поста клиента, tg_id клиента в callback data нужен
+    супервизору, чтобы отправить нажатия и ответы его воркеру"""
     keyboard = make_inline_keyboard(
         question_name='customer_textmessage',
         answers=answers,
-        data=0
+        data=tg_id
     )
     return keyboard
 
 
+async def get_signature(message: types.Message) -> tuple:
+    """Подпись поста в чате поддержки и назначенный оператор"""
+    profile = await support_bot.get_customer_name(message.from_user.id)
+    if profile:
+        first_name, last_name = profile
+        signature = f'<b>От: 🧑 {first_name} {last_name}</b>\n'
+    else:
+        signature = (
+            f'<b>От: 🐨 {message.from_user.full_name} '
+            f'{message.from_user.id}</b>\n'
+        )
+    operator_tg_id = None
+    if scheduler is not None:
+        operator_tg_id = scheduler.pick(message.from_user.id)
+        if operator_tg_id is not None:
+            signature += assigned_operator_text.format(
+                operator=operator_mention(operator_tg_id)) + '\n'
+    return signature, operator_tg_id
+
+
+async def register_post(message: types.Message, support_chat_message_id: int,
+                        operator_tg_id: int | None, album_part_ids: list = ()):
+    await support_bot.add_textmessage(
+        tg_id=message.from_user.id,
+        support_chat_message_id=support_chat_message_id,
+        album_part_ids=album_part_ids
+    )
+    if scheduler is not None:
+        await scheduler.assign(
+            support_chat_message_id,
+            message.from_user.id,
+            operator_tg_id
+        )
+
+
+async def open_ticket(message: types.Message, body: str) -> tuple:
+    signature, operator_tg_id = await get_signature(message)
+    text = signature + body
+    support_chat_msg = await outbox.send_message(
+        SUPPORT_CHAT_MIRROR,
+        chat_id=SUPPORT_CHAT_ID,
+        text=text,
+        reply_markup=keyboard_for_message_in_support_chat(
+            [ban_button, unanswered_button], message.from_user.id)
+    )
+    await register_post(message, support_chat_msg.message_id, operator_tg_id)
+    return support_chat_msg.message_id, text
+
+
+async def edit_ticket(support_chat_message_id: int, text: str, tg_id: int):
+    await outbox.call(
+        SUPPORT_CHAT_MIRROR,
+        chat_id=SUPPORT_CHAT_ID,
+        method='edit_message_text',
+        message_id=support_chat_message_id,
+        text=text,
+        reply_markup=keyboard_for_message_in_support_chat(
+            [ban_button, unanswered_button], tg_id)
+    )
+
+
+# a burst of texts from a customer becomes one post in the support chat
+threader = TicketThreader(
+    open_ticket=open_ticket,
+    edit_ticket=edit_ticket,
+    debounce=TICKET_DEBOUNCE,
+    idle_timeout=TICKET_IDLE_TIMEOUT
+)
+
+
+async def forward_album(messages: list):
+    """Альбом уходит в чат поддержки одним send_media_group, кнопки -
+    отдельным сообщением в ответ на него: у альбома их быть не может"""
+    first = messages[0]
+    await threader.close_customer(first.from_user.id)
+    signature, operator_tg_id = await get_signature(first)
+    media = types.MediaGroup()
+    for number, message in enumerate(messages):
+        caption = str(message.caption) if message.caption else ''
+        if number == 0:
+            caption = signature + caption
+        media.attach_photo(
+            message.photo[-1].file_id,
+            caption=caption or None,
+            parse_mode='HTML'
+        )
+    album = await outbox.send_media_group(
+        SUPPORT_CHAT_MIRROR,
+        chat_id=SUPPORT_CHAT_ID,
+        media=media
+    )
+    support_chat_msg = await outbox.send_message(
+        SUPPORT_CHAT_MIRROR,
+        chat_id=SUPPORT_CHAT_ID,
+        text=signature + album_text.format(count=len(album)),
+        reply_to_message_id=album[0].message_id,
+        reply_markup=keyboard_for_message_in_support_chat(
+            [ban_button, unanswered_button], first.from_user.id)
+    )
+    await register_post(
+        first,
+        support_chat_msg.message_id,
+        operator_tg_id,
+        album_part_ids=[part.message_id for part in album]
+    )
+
+
+# photos of an album come as separate updates and are posted together
+albums = AlbumCollector(
+    on_album=forward_album,
+    window=MEDIA_GROUP_WINDOW
+)
+
+
 @dp.message_handler(
     lambda message: message.chat.type == 'private',
     content_types=[ContentType.TEXT, ContentType.PHOTO],
     state='*')
 async def new_text_message(message: types.Message, state: FSMContext):
-    if message.from_user.id in support_bot.get_ban_list():
+    if support_bot.is_banned(message.from_user.id):
         return
     log.info('new_text_message_for_support from: %r', message.from_user.id)
-    customer = support_bot.get_customer_by_tg_id(message.from_user.id)
-    if customer:
-        signature = (
-            f'<b>От: 🧑 {customer.get_first_name()} '
-            f'{customer.get_last_name()}</b>\n'
-        )
-    else:
-        signature = (
-            f'<b>От: 🐨 {message.from_user.full_name} '
-            f'{message.from_user.id}</b>\n'
-        )
 
     if message.content_type == ContentType.TEXT:
-        support_chat_msg = await bot.send_message(
-            chat_id=SUPPORT_CHAT_ID,
-            text=signature + message.text,
-            reply_markup=keyboard_for_message_in_support_chat(
-                [ban_button, unanswered_button])
-        )
-    if message.content_type == ContentType.PHOTO:
-        if message.caption:
-            text = signature + str(message.caption)
-        else:
-            text = signature
+        threader.add(message)
+        return
+    if message.media_group_id:
+        albums.add(message)
+        return
 
-        support_chat_msg = await bot.send_photo(
-            chat_id=SUPPORT_CHAT_ID,
-            photo=message.photo[0]['file_id'],
-            caption=text,
-            reply_markup=keyboard_for_message_in_support_chat(
-                [ban_button, unanswered_button])
-        )
+    # a photo is a post of its own, after the texts sent before it
+    await threader.close_customer(message.from_user.id)
+    signature, operator_tg_id = await get_signature(message)
+    if message.caption:
+        text = signature + str(message.caption)
+    else:
+        text = signature
+
+    support_chat_msg = await outbox.send_photo(
+        SUPPORT_CHAT_MIRROR,
+        chat_id=SUPPORT_CHAT_ID,
+        photo=message.photo[-1].file_id,
+        caption=text,
+        reply_markup=keyboard_for_message_in_support_chat(
+            [ban_button, unanswered_button], message.from_user.id)
+    )
+    await register_post(message, support_chat_msg.message_id, operator_tg_id)
 
-    support_bot.add_textmessage(
-        tg_id=message.from_user.id,
-        support_chat_message_id=support_chat_msg.message_id
+
+#  ------------------------------------------------------------------ РАССЫЛКА
+async def report_broadcast(broadcast_id: int, sent: int, failed: int):
+    await outbox.send_message(
+        OPERATOR_REPLY,
+        chat_id=SUPPORT_CHAT_ID,
+        text=broadcast_finished_text.format(
+            broadcast_id=broadcast_id, sent=sent, failed=failed)
+    )
+
+
+broadcaster = Broadcaster(
+    outbox=outbox,
+    chunk_size=BROADCAST_CHUNK_SIZE,
+    lease=BROADCAST_LEASE,
+    progress_every=BROADCAST_PROGRESS_EVERY,
+    on_finished=report_broadcast
+)
+
+
+# registered before replay_on_message, which takes every reply
+@dp.message_handler(
+    lambda message: message.chat.id == SUPPORT_CHAT_ID,
+    commands=['broadcast'], state='*')
+async def broadcast_command(message: types.Message, state: FSMContext):
+    log.info('broadcast_command from: %r', message.from_user.id)
+    audience = message.get_args() or 'customers'
+    if not message.reply_to_message or audience not in AUDIENCES:
+        await message.reply(text=broadcast_usage_text)
+        return
+
+    broadcast_id = await broadcaster.start(
+        audience=audience,
+        from_chat_id=SUPPORT_CHAT_ID,
+        message_id=message.reply_to_message.message_id
+    )
+    await message.reply(
+        text=broadcast_started_text.format(broadcast_id=broadcast_id)
     )
 
 
 #  --------------------------------------------------------- ОТВЕТ НА ОБРАЩЕНИЕ
+async def answered_changed(support_chat_message_id: int,
+                           message_view: MessageView):
+    """Отвеченное обращение закрывает тикет и снимается с оператора,
+    неотвеченное назначается оператору"""
+    if not message_view:
+        return
+    if message_view.is_answered:
+        threader.close(support_chat_message_id)
+    if scheduler is None:
+        return
+    if message_view.is_answered:
+        await scheduler.complete(support_chat_message_id)
+    elif scheduler.operator_of(support_chat_message_id) is None:
+        await scheduler.assign(
+            support_chat_message_id,
+            message_view.tg_id,
+            scheduler.pick(message_view.tg_id)
+        )
+
+
 def get_keyboard_for_current_message(
-        textmessage: TextMessage) -> types.InlineKeyboardMarkup:
+        message_view: MessageView) -> types.InlineKeyboardMarkup:
     """Возвращает актуальную клавиатуру
         для этого сообщения и пользователя
 
     Returns:
         types.InlineKeyboardMarkup: _description_
     """
-    tg_user = textmessage.get_tg_user()
-
-    if tg_user.is_banned():
+    if message_view.is_banned:
         first_button = unban_button
     else:
         first_button = ban_button
 
-    if textmessage.is_answered():
+    if message_view.is_answered:
         second_button = answered_button
     else:
         second_button = unanswered_button
 
     keyboard = keyboard_for_message_in_support_chat(
-        [first_button, second_button]
+        [first_button, second_button], message_view.tg_id
     )
     return keyboard
 
 
+async def update_keyboard(support_chat_message_id: int,
+                          message_view: MessageView):
+    """Кнопки под сообщением в чате поддержки - через очередь отправки,
+    раньше копий сообщений, ждущих там"""
+    try:
+        await outbox.call(
+            OPERATOR_REPLY,
+            chat_id=SUPPORT_CHAT_ID,
+            method='edit_message_reply_markup',
+            message_id=support_chat_message_id,
+            reply_markup=get_keyboard_for_current_message(
+                message_view=message_view
+            )
+        )
+    except exceptions.MessageNotModified:
+        pass
+    except exceptions.MessageToEditNotFound:
+        log.warning('message was deleted')
+
+
 @dp.message_handler(
     lambda message: 'reply_to_message' in message,
     lambda message: message.chat.id == SUPPORT_CHAT_ID,
     content_types=[ContentType.PHOTO, ContentType.TEXT])
 async def replay_on_message(message: types.Message, state: FSMContext):
     log.info('replay_on_message from: %r', message.from_user.id)
-    msg_id = message.reply_to_message.message_id
-    textmessage = support_bot.get_textmessage_by(
-        support_chat_message_id=msg_id
+    message_view = await support_bot.get_message_view(
+        support_chat_message_id=message.reply_to_message.message_id
     )
-    if not textmessage:
+    if not message_view:
         await message.reply(text='Не удалось отправить')
         return
+    # the post with the keyboard, also for a reply to a photo of an album
+    msg_id = message_view.support_chat_message_id
 
     # send answer to customer
     if message.content_type == ContentType.TEXT:
-        await bot.send_message(
-            chat_id=textmessage.get_tg_id(),
+        await outbox.send_message(
+            OPERATOR_REPLY,
+            chat_id=message_view.tg_id,
             text=message.text
         )
     if message.content_type == ContentType.PHOTO:
-        await bot.send_photo(
-            chat_id=textmessage.get_tg_id(),
-            photo=message.photo[0]['file_id'],
+        await outbox.send_photo(
+            OPERATOR_REPLY,
+            chat_id=message_view.tg_id,
+            photo=message.photo[-1].file_id,
             caption=message.caption
         )
-    textmessage.mark_answered()
+    message_view = await support_bot.set_message_answered(
+        support_chat_message_id=msg_id,
+        is_answered=True
+    )
+    await answered_changed(msg_id, message_view)
 
     # edit buttons under message in support chat
-    try:
-        await bot.edit_message_reply_markup(
-            chat_id=SUPPORT_CHAT_ID,
-            message_id=msg_id,
-            reply_markup=get_keyboard_for_current_message(
-                textmessage=textmessage
-            )
-        )
-    except exceptions.MessageNotModified:
-        pass
-    except exceptions.MessageToEditNotFound:
-        log.warning('message was deleted')
+    await update_keyboard(msg_id, message_view)
 
 
 @dp.callback_query_handler(
@@ -302,21 +646,21 @@ async def callback_ban(
         state: FSMContext):
     log.info('Got this callback data: %r', callback_data)
 
-    textmessage = support_bot.get_textmessage_by(
+    message_view = await support_bot.get_message_view(
         support_chat_message_id=query.message.message_id
     )
-    tg_id = textmessage.get_tg_id()
+    if not message_view:
+        await query.answer()
+        return
+    tg_id = message_view.tg_id
 
     if callback_data['answer'] == ban_button:
-        Operator.ban(tg_id=tg_id)
+        await Operator.ban(tg_id=tg_id)
     elif callback_data['answer'] == unban_button:
-        Operator.unban(tg_id=tg_id)
+        await Operator.unban(tg_id=tg_id)
+    message_view.is_banned = support_bot.is_banned(tg_id)
 
-    await query.message.edit_reply_markup(
-        reply_markup=get_keyboard_for_current_message(
-            textmessage=textmessage
-        )
-    )
+    await update_keyboard(query.message.message_id, message_view)
     await query.answer()
 
 
@@ -332,20 +676,16 @@ async def callback_answered_button(
         state: FSMContext):
     log.info('Got this callback data: %r', callback_data)
 
-    textmessage = support_bot.get_textmessage_by(
-        support_chat_message_id=query.message.message_id
+    message_view = await support_bot.set_message_answered(
+        support_chat_message_id=query.message.message_id,
+        is_answered=callback_data['answer'] == unanswered_button
     )
+    if not message_view:
+        await query.answer()
+        return
+    await answered_changed(query.message.message_id, message_view)
 
-    if callback_data['answer'] == answered_button:
-        textmessage.mark_unanswered()
-    elif callback_data['answer'] == unanswered_button:
-        textmessage.mark_answered()
-
-    await query.message.edit_reply_markup(
-        reply_markup=get_keyboard_for_current_message(
-            textmessage=textmessage
-        )
-    )
+    await update_keyboard(query.message.message_id, message_view)
     await query.answer()
 
 
@@ -354,12 +694,94 @@ async def callback_answered_button(
     content_types=ContentType.ANY,
     state='*')
 async def other_message_types(message: types.Message, state: FSMContext):
-    if message.from_user.id in support_bot.get_ban_list():
+    if support_bot.is_banned(message.from_user.id):
         return
     log.info('other_message_types from: %r', message.from_user.id)
     await message.reply(
         text='Вы можете отправлять только текст или фото',
         reply_markup=types.ReplyKeyboardRemove())
 
+
+def check_schema() -> None:
+    with db_pool.cursor() as cursor:
+        version = check_schema_version(cursor)
+    log.info(f'schema version {version}')
+
+
+async def on_startup(dp: Dispatcher):
+    # fail fast instead of on the first query to a missing column
+    await run_in_db(check_schema)
+    await deduplicator.start()
+    if METRICS_ENABLED:
+        await metrics_server.start()
+    outbox.start()
+    threader.start()
+    # the first worker process pulls Airtable, the others read its copy
+    await support_bot.phone_directory.start(pull=SHARD == 0)
+    # a broadcast is claimed by one worker process at a time
+    broadcaster.start_resuming()
+    # jobs for the whole bot run in the first worker process only
+    if SHARD == 0:
+        if isinstance(dp.storage, PostgresStorage):
+            dp.storage.start_purging()
+        archiver.start()
+    if scheduler is not None:
+        await scheduler.start()
+    # a ban made by one worker process reaches the others
+    if BAN_LIST_SYNC or WORKERS > 1:
+        await support_bot.start_ban_sync()
+    else:
+        await support_bot.load_ban_list()
+
+
+async def on_startup_webhook(dp: Dispatcher):
+    await on_startup(dp)
+    await bot.set_webhook(
+        url=WEBHOOK_HOST + WEBHOOK_PATH,
+        max_connections=WEBHOOK_MAX_CONNECTIONS
+    )
+
+
+async def on_shutdown(dp: Dispatcher):
+    # the webhook stays registered: Telegram keeps updates until we are back
+    await albums.close()
+    await threader.close_all()
+    await deduplicator.close()
+    # the posts of the flushed tickets and albums included
+    await support_bot.message_writer.close()
+    await broadcaster.close()
+    await archiver.close()
+    if scheduler is not None:
+        await scheduler.close()
+    await outbox.close()
+    await metrics_server.close()
+    await support_bot.phone_directory.close()
+    support_bot.ban_listener.stop()
+    db_executor.shutdown(wait=True)
+    db_pool.close()
+
+
 if __name__ == '__main__':
-    executor.start_polling(dp, skip_updates=False)
+    if WORKERS > 1:
+        sys.exit('WORKERS > 1: start the bot with python supervisor.py')
+    if USE_WEBHOOK:
+        # aiohttp serves every update in its own task, stops accepting
+        # on SIGTERM and waits up to shutdown_timeout for running handlers
+        # before on_shutdown closes the database
+        executor.start_webhook(
+            dispatcher=dp,
+            webhook_path=WEBHOOK_PATH,
+            skip_updates=False,
+            on_startup=on_startup_webhook,
+            on_shutdown=on_shutdown,
+            host=WEBAPP_HOST,
+            port=WEBAPP_PORT,
+            shutdown_timeout=WEBHOOK_SHUTDOWN_TIMEOUT
+        )
+    else:
+        executor.start_polling(
+            dp,
+            skip_updates=False,
+            on_startup=on_startup,
+            on_shutdown=on_shutdown
+        )
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+# the modules of the bot live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2  # noqa: E402
+
+import config  # noqa: E402
+from benchmarks import _schema  # noqa: E402
+
+# any well-formed token will do, the tests never reach Telegram
+config.API_TOKEN = '123:abc'
+
+SCHEMA = 'bot_tests'
+
+
+@pytest.fixture(scope='session')
+def database():
+    """Scratch schema with every migration applied, the bot's pool and
+    every other connection work in it"""
+    _schema.use(SCHEMA)
+    try:
+        _schema.create()
+    except psycopg2.OperationalError as error:
+        pytest.skip(f'database not reachable: {error}')
+    yield _schema
+    _schema.drop()
@@ -0,0 +1,98 @@
+import asyncio
+
+from broadcast import Broadcaster
+from db_managing import BroadcastData
+
+LEASE = 60
+
+
+def test_a_broadcast_is_sent_by_one_process_at_a_time(database):
+    broadcast_id = BroadcastData.create('customers', -1, 1, 'a', LEASE)
+    try:
+        # held by its creator
+        assert BroadcastData.claim_unfinished('b', LEASE) == []
+
+        # a stopped process releases it, the first one to claim it wins
+        BroadcastData.release([broadcast_id], 'a')
+        claimed = BroadcastData.claim_unfinished('b', LEASE)
+        assert [row[0] for row in claimed] == [broadcast_id]
+        assert BroadcastData.claim_unfinished('c', LEASE) == []
+
+        assert BroadcastData.renew([broadcast_id], 'a', LEASE) == []
+        assert not BroadcastData.save_progress(broadcast_id, 'a', 10, 1, [])
+        assert BroadcastData.renew([broadcast_id], 'b', LEASE) \
+            == [broadcast_id]
+        assert BroadcastData.save_progress(broadcast_id, 'b', 10, 1, [])
+    finally:
+        BroadcastData.finish(broadcast_id)
+
+
+def test_a_broadcast_with_an_expired_lease_is_resumed(database):
+    # of a process that died
+    broadcast_id = BroadcastData.create('customers', -1, 1, 'a', -1)
+    try:
+        claimed = BroadcastData.claim_unfinished('b', LEASE)
+        assert [row[0] for row in claimed] == [broadcast_id]
+    finally:
+        BroadcastData.finish(broadcast_id)
+
+
+def test_recipients_are_read_a_chunk_at_a_time(database):
+    database.execute('''INSERT INTO tg_user (tg_id, tg_username, is_banned)
+                        SELECT g, 'user' || g, g = 9_000_000_005
+                        FROM generate_series(9_000_000_001, 9_000_000_010) g
+                        ON CONFLICT (tg_id) DO NOTHING;''')
+    after = 9_000_000_000
+    chunks = []
+    while True:
+        chunk = BroadcastData.get_recipients('all', after, 4)
+        if not chunk:
+            break
+        chunks.append([tg_id - 9_000_000_000 for tg_id in chunk])
+        after = chunk[-1]
+    assert chunks == [[1, 2, 3, 4], [6, 7, 8, 9], [10]]
+
+
+class FakeOutbox:
+    """copy_message to tg id 3 times out"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def call(self, priority, chat_id, method, **kwargs):
+        if chat_id == 3:
+            raise asyncio.TimeoutError()
+        self.sent.append(chat_id)
+
+
+class FakeBroadcastData:
+    def __init__(self, recipients: list):
+        self.recipients = recipients
+        self.progress = []
+
+    async def get_recipients(self, audience, after_tg_id, chunk_size):
+        return [tg_id for tg_id in self.recipients
+                if tg_id > after_tg_id][:chunk_size]
+
+    async def save_progress(self, broadcast_id, owner, last_tg_id, sent,
+                            failures):
+        self.progress.append((last_tg_id, sent, [tg_id for tg_id, _
+                                                 in failures]))
+        return True
+
+    async def finish(self, broadcast_id):
+        return 0, 0
+
+
+def test_progress_is_saved_every_few_recipients():
+    outbox = FakeOutbox()
+    broadcaster = Broadcaster(outbox=outbox, chunk_size=5, lease=LEASE,
+                              progress_every=2)
+    broadcaster._data = FakeBroadcastData(list(range(1, 8)))
+
+    asyncio.run(broadcaster._run(1, 'all', -1, 1, 0))
+
+    assert outbox.sent == [1, 2, 4, 5, 6, 7]
+    # a chunk of 5 and one of 2, the unreachable recipient is a failure
+    assert broadcaster._data.progress == [
+        (2, 2, []), (4, 1, [3]), (5, 1, []), (7, 2, [])]
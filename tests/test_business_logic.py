@@ -0,0 +1,134 @@
+import asyncio
+
+import psycopg2
+import pytest
+
+import business_logic
+from business_logic import CacheMixin, Operator, SupportBot, TextMessage, \
+    TgUser, ban_index
+from db_notify import NotifyListener
+
+TG_ID = 1001
+TEXT_MESSAGE_ID = 2001
+SUPPORT_CHAT_MESSAGE_ID = 3001
+
+
+class TgData:
+    def get_tg_username(self) -> str:
+        return 'user'
+
+
+class TextMessageData:
+    def get_tg_id(self) -> int:
+        return TG_ID
+
+
+async def no_op(*args, **kwargs) -> None:
+    pass
+
+
+@pytest.fixture(autouse=True)
+def clean_caches():
+    yield
+    for class_ in (TgUser, Operator, TextMessage):
+        class_.cache().clear()
+    ban_index.reload([])
+
+
+def test_instances_of_a_class_share_one_bounded_cache():
+    class Cached(CacheMixin):
+        cache_capacity = 2
+
+        def __init__(self, key):
+            super().__init__(key)
+
+        @classmethod
+        async def load(cls, key):
+            return cls(key)
+
+    for key in range(5):
+        Cached(key)
+    assert len(Cached.cache()) == 2
+    assert Cached.cache() is not TgUser.cache()
+    assert 'Cached' in CacheMixin.cache_stats()
+
+
+def test_a_cached_class_must_implement_load():
+    class Cached(CacheMixin):
+        pass
+
+    with pytest.raises(TypeError):
+        Cached(1)
+
+
+def test_get_loads_once():
+    loads = []
+
+    class Cached(CacheMixin):
+        def __init__(self, key):
+            super().__init__(key)
+
+        @classmethod
+        async def load(cls, key):
+            loads.append(key)
+            return cls(key)
+
+    async def get_twice():
+        return await Cached.get(1), await Cached.get(1)
+
+    first, second = asyncio.run(get_twice())
+    assert first is second
+    assert loads == [1]
+
+
+@pytest.mark.parametrize('action, banned', [('ban', True), ('unban', False)])
+def test_ban_and_unban_invalidate_the_tg_user(monkeypatch, action, banned):
+    monkeypatch.setattr(business_logic.AsyncOperatorData, action,
+                        staticmethod(no_op))
+    if not banned:
+        ban_index.ban(TG_ID)
+    TgUser(TG_ID, TgData())
+    assert TgUser.cache().get(TG_ID) is not None
+
+    asyncio.run(getattr(Operator, action)(TG_ID))
+
+    assert TgUser.cache().get(TG_ID) is None
+    assert (TG_ID in ban_index) is banned
+
+
+def test_set_message_answered_invalidates_the_text_message():
+    support_bot = SupportBot()
+
+    async def set_message_answered(support_chat_message_id, is_answered):
+        return (TEXT_MESSAGE_ID, TG_ID, is_answered, False,
+                support_chat_message_id)
+
+    support_bot.support_bot_data.set_message_answered = set_message_answered
+    TextMessage(TEXT_MESSAGE_ID, TextMessageData())
+    assert TextMessage.cache().get(TEXT_MESSAGE_ID) is not None
+
+    view = asyncio.run(support_bot.set_message_answered(
+        SUPPORT_CHAT_MESSAGE_ID, True))
+
+    assert view.is_answered
+    assert TextMessage.cache().get(TEXT_MESSAGE_ID) is None
+
+
+def test_the_ban_list_is_loaded_without_listen(monkeypatch):
+    support_bot = SupportBot()
+
+    def refuse(self):
+        raise psycopg2.OperationalError('connection refused')
+
+    async def get_ban_list():
+        return [TG_ID]
+
+    monkeypatch.setattr(NotifyListener, '_open', refuse)
+    support_bot.support_bot_data.get_ban_list = get_ban_list
+
+    async def scenario():
+        await support_bot.start_ban_sync()
+        support_bot.ban_listener.stop()
+
+    asyncio.run(scenario())
+    assert support_bot.is_banned(TG_ID)
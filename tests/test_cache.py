@@ -0,0 +1,81 @@
+import pytest
+
+import cache
+from cache import ObjectCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_capacity_bounds_size():
+    object_cache = ObjectCache(capacity=3)
+    for key in range(10):
+        object_cache.put(key, str(key))
+    assert len(object_cache) == 3
+    assert object_cache.evictions == 7
+    assert [object_cache.get(key) for key in (7, 8, 9)] == ['7', '8', '9']
+    assert object_cache.get(0) is None
+
+
+def test_least_recently_used_is_evicted():
+    object_cache = ObjectCache(capacity=2)
+    object_cache.put('a', 1)
+    object_cache.put('b', 2)
+    assert object_cache.get('a') == 1
+    object_cache.put('c', 3)
+    assert 'a' in object_cache
+    assert 'b' not in object_cache
+    assert 'c' in object_cache
+
+
+def test_put_of_a_cached_key_does_not_grow():
+    object_cache = ObjectCache(capacity=2)
+    for _ in range(5):
+        object_cache.put('a', 1)
+    assert len(object_cache) == 1
+    assert object_cache.evictions == 0
+
+
+def test_entries_expire_after_ttl(clock):
+    object_cache = ObjectCache(capacity=10, ttl=60)
+    object_cache.put('a', 1)
+    clock[0] += 59
+    assert object_cache.get('a') == 1
+    clock[0] += 1
+    assert object_cache.get('a') is None
+    assert len(object_cache) == 0
+    assert object_cache.stats()['misses'] == 1
+
+
+def test_put_renews_ttl(clock):
+    object_cache = ObjectCache(capacity=10, ttl=60)
+    object_cache.put('a', 1)
+    clock[0] += 50
+    object_cache.put('a', 2)
+    clock[0] += 50
+    assert object_cache.get('a') == 2
+
+
+def test_no_ttl_keeps_entries(clock):
+    object_cache = ObjectCache(capacity=10)
+    object_cache.put('a', 1)
+    clock[0] += 10 ** 9
+    assert object_cache.get('a') == 1
+
+
+def test_invalidate():
+    object_cache = ObjectCache(capacity=10)
+    object_cache.put('a', 1)
+    object_cache.invalidate('a')
+    object_cache.invalidate('missing')
+    assert object_cache.get('a') is None
+    assert object_cache.invalidations == 1
+
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        ObjectCache(capacity=0)
@@ -0,0 +1,142 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+
+from dedup import UpdateDeduplicator, current_update_id
+
+
+class WatermarkData:
+    def __init__(self, watermark: int = None):
+        self.watermark = watermark
+        self.saved = []
+
+    async def get(self, shard: int, shards: int, max_age: int):
+        return self.watermark
+
+    async def save(self, shard: int, shards: int, update_id: int) -> None:
+        self.saved.append(update_id)
+
+
+def deduplicator(watermark: int = None, **kwargs) -> UpdateDeduplicator:
+    deduplicator = UpdateDeduplicator(ring_size=3, flush_interval=3600,
+                                      **kwargs)
+    deduplicator._data = WatermarkData(watermark)
+    return deduplicator
+
+
+def update(update_id: int) -> types.Update:
+    return types.Update(update_id=update_id)
+
+
+async def passes(deduplicator: UpdateDeduplicator, update_id: int) -> bool:
+    try:
+        await deduplicator.on_pre_process_update(update(update_id), {})
+    except CancelHandler:
+        return False
+    return True
+
+
+async def handle(deduplicator: UpdateDeduplicator, update_id: int) -> bool:
+    if not await passes(deduplicator, update_id):
+        return False
+    await deduplicator.on_post_process_update(update(update_id), [], {})
+    return True
+
+
+def test_an_update_seen_recently_is_dropped():
+    async def run():
+        dedup = deduplicator()
+        assert await handle(dedup, 1)
+        assert not await handle(dedup, 1)
+        # out of the ring of 3
+        for update_id in (2, 3, 4):
+            assert await handle(dedup, update_id)
+        assert await handle(dedup, 1)
+        assert dedup.dropped == 1
+
+    asyncio.run(run())
+
+
+def test_updates_up_to_the_saved_watermark_are_dropped_after_a_start():
+    async def run():
+        dedup = deduplicator(watermark=10)
+        await dedup.start()
+        results = [await handle(dedup, update_id) for update_id in (9, 10, 11)]
+        await dedup.close()
+        return results, dedup._data.saved
+
+    results, saved = asyncio.run(run())
+    assert results == [False, False, True]
+    assert saved == [11]
+
+
+def test_the_watermark_stays_below_an_update_being_handled():
+    async def run():
+        dedup = deduplicator()
+        await dedup.start()
+        assert await passes(dedup, 1)
+        assert await handle(dedup, 2)
+        await dedup.flush()
+        assert dedup._data.saved == [0]
+        await dedup.on_post_process_update(update(1), [], {})
+        await dedup.close()
+        return dedup._data.saved
+
+    assert asyncio.run(run()) == [0, 2]
+
+
+def test_the_watermark_stays_below_buffered_work():
+    buffered = {5}
+    order = []
+
+    async def before_save():
+        order.append('before_save')
+
+    async def run():
+        dedup = deduplicator(buffered=lambda: buffered,
+                             before_save=before_save)
+        await dedup.start()
+        for update_id in (5, 6, 7):
+            assert await handle(dedup, update_id)
+        await dedup.flush()
+        buffered.clear()
+        await dedup.flush()
+        await dedup.close()
+        return dedup._data.saved
+
+    assert asyncio.run(run()) == [4, 7]
+    assert order == ['before_save', 'before_save']
+
+
+def test_without_persist_nothing_is_loaded_or_saved():
+    async def run():
+        dedup = deduplicator(watermark=10, persist=False)
+        await dedup.start()
+        # delivered out of order by a webhook
+        results = [await handle(dedup, update_id) for update_id in (3, 1, 2)]
+        await dedup.close()
+        return results, dedup._data.saved
+
+    assert asyncio.run(run()) == ([True, True, True], [])
+
+
+def test_current_update_id():
+    def in_update():
+        types.Update.set_current(update(42))
+        return current_update_id()
+
+    assert current_update_id() is None
+    assert contextvars.copy_context().run(in_update) == 42
+
+
+def test_a_replayed_backlog_causes_no_side_effects(database, monkeypatch):
+    # first, it lifts the outbound rate limits before support_bot reads them
+    from benchmarks import replay_updates
+    import support_bot
+
+    # on_shutdown stops the executor of run_in_db, other tests need it
+    monkeypatch.setattr(support_bot, 'db_executor', ThreadPoolExecutor())
+    assert asyncio.run(replay_updates.main(update_count=200, users=10))
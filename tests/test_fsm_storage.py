@@ -0,0 +1,51 @@
+import asyncio
+
+import config
+from fsm_storage import PostgresStorage
+
+
+class FakeStateData:
+    """fsm_state rows in a dict, counts the reads"""
+
+    def __init__(self):
+        self.rows = {}
+        self.reads = 0
+
+    async def get(self, chat: int, user: int, ttl: int):
+        self.reads += 1
+        return self.rows.get((chat, user))
+
+    async def set_state(self, chat: int, user: int, state, ttl: int):
+        _, data = self.rows.get((chat, user), (None, {}))
+        self.rows[chat, user] = (state, data)
+
+
+def storage(cache_size: int) -> tuple:
+    storage = PostgresStorage(ttl=60, cache_size=cache_size)
+    storage._data = FakeStateData()
+    return storage, storage._data
+
+
+def test_states_are_cached_by_default():
+    storage_, data = storage(config.FSM_MEMORY_CACHE_SIZE)
+
+    async def scenario():
+        for _ in range(3):
+            assert await storage_.get_state(chat=1, user=1) is None
+        await storage_.set_state(chat=1, user=1, state='waiting')
+        assert await storage_.get_state(chat=1, user=1) == 'waiting'
+
+    asyncio.run(scenario())
+    assert data.reads == 1
+    assert data.rows[1, 1] == ('waiting', {})
+
+
+def test_without_a_cache_every_state_is_read():
+    storage_, data = storage(0)
+
+    async def scenario():
+        for _ in range(3):
+            await storage_.get_state(chat=1, user=1)
+
+    asyncio.run(scenario())
+    assert data.reads == 3
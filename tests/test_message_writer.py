@@ -0,0 +1,56 @@
+import asyncio
+
+import psycopg2
+
+from message_writer import MessageWriter
+
+TG_ID = 9_100_000_001
+# no tg_user of this id, the row breaks the foreign key
+UNKNOWN_TG_ID = 9_100_000_002
+
+
+def written(database, support_chat_message_ids: list) -> list:
+    connection = database.connect()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('''SELECT support_chat_message_id FROM message
+                              WHERE support_chat_message_id = ANY(%s)
+                              ORDER BY 1;''', (support_chat_message_ids,))
+            return [row[0] for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+
+def test_a_row_that_fails_does_not_hold_up_the_others(database):
+    database.execute('''INSERT INTO tg_user (tg_id, tg_username)
+                        VALUES (%s, 'writer') ON CONFLICT DO NOTHING;''',
+                     (TG_ID,))
+
+    async def scenario():
+        writer = MessageWriter(interval=60, batch_size=100)
+        writer.add(UNKNOWN_TG_ID, 9_100_000_011)
+        writer.add(TG_ID, 9_100_000_012)
+        await writer.flush_for(9_100_000_012)
+        assert len(writer) == 0
+        await writer.flush_for(9_100_000_011)
+        await writer.close()
+
+    asyncio.run(scenario())
+    assert written(database, [9_100_000_011, 9_100_000_012]) \
+        == [9_100_000_012]
+
+
+def test_rows_are_kept_while_the_database_is_away():
+    async def scenario():
+        writer = MessageWriter(interval=60, batch_size=100)
+
+        async def unreachable(rows):
+            raise psycopg2.OperationalError('connection refused')
+
+        writer._data.add_messages = unreachable
+        writer.add(TG_ID, 9_100_000_021)
+        # logged, the shutdown goes on
+        await writer.close()
+        assert len(writer) == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,70 @@
+import migrate
+
+SCHEMA = 'migrate_tests'
+
+# what the first db_deploy.py created, migrations/001_init_tables.sql as
+# it was then
+UNTRACKED_SCHEMA = '''
+    CREATE TABLE tg_user (
+            tg_id int8 PRIMARY KEY,
+            tg_username varchar(255) NOT NULL,
+            is_banned bool NOT NULL DEFAULT FALSE
+    );
+
+    CREATE TABLE operator (
+            operator_id int GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            tg_id int8 UNIQUE REFERENCES tg_user(tg_id) ON DELETE CASCADE
+    );
+
+    CREATE TABLE customer (
+            customer_id int GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            tg_id int8 UNIQUE REFERENCES tg_user(tg_id) ON DELETE CASCADE,
+            phone varchar(15) UNIQUE NOT NULL,
+            first_name varchar(255),
+            last_name varchar(255)
+    );
+
+    CREATE TABLE message (
+            text_message_id int GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            tg_id int8 REFERENCES tg_user(tg_id) ON DELETE CASCADE,
+            support_chat_message_id int8 UNIQUE,
+            is_answered bool NOT NULL DEFAULT FALSE
+    );
+
+    INSERT INTO tg_user (tg_id, tg_username) VALUES (1, 'user1');
+    INSERT INTO message (tg_id, support_chat_message_id) VALUES (1, 10);'''
+
+
+def test_an_untracked_database_is_baselined(database):
+    connection = database.connect()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;')
+            cursor.execute(f'CREATE SCHEMA {SCHEMA};')
+            cursor.execute(f'SET search_path = {SCHEMA};')
+            # deployed before migrations were tracked
+            cursor.execute(UNTRACKED_SCHEMA)
+        connection.commit()
+
+        applied = migrate.apply_migrations(connection)
+
+        versions = [version for version, _ in migrate.get_migrations()]
+        assert applied == [version for version in versions
+                           if version > migrate.UNTRACKED_BASELINE]
+        with connection.cursor() as cursor:
+            assert migrate.check_schema_version(cursor) == versions[-1]
+            cursor.execute('''SELECT relkind FROM pg_class
+                              WHERE oid = 'message'::regclass;''')
+            assert cursor.fetchone() == ('p',)
+            cursor.execute('SELECT tg_id, support_chat_message_id '
+                           'FROM message;')
+            assert cursor.fetchall() == [(1, 10)]
+            cursor.execute("SELECT to_regclass('broadcast') IS NOT NULL;")
+            assert cursor.fetchone() == (True,)
+        assert migrate.apply_migrations(connection) == []
+    finally:
+        connection.rollback()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;')
+        connection.commit()
+        connection.close()
@@ -0,0 +1,66 @@
+import asyncio
+
+import outbound
+from outbound import OutboundQueue, OPERATOR_REPLY, SUPPORT_CHAT_MIRROR
+
+SUPPORT_CHAT_ID = -100
+
+
+class Bot:
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.sent = []
+
+    async def send_message(self, chat_id: int, text: str):
+        await asyncio.sleep(self.latency)
+        self.sent.append((chat_id, text))
+        return text
+
+    async def edit_message_text(self, chat_id: int, text: str):
+        return await self.send_message(chat_id, text)
+
+
+def test_buckets_of_idle_chats_are_dropped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(outbound.time, 'monotonic', lambda: now[0])
+
+    async def run():
+        outbox = OutboundQueue(bot=Bot(), global_rate=10_000,
+                               private_chat_rate=1, group_chat_rate=1)
+        outbox.start()
+        await asyncio.gather(*(outbox.send_message(OPERATOR_REPLY, tg_id,
+                                                   text='hi')
+                               for tg_id in range(1, 5001)))
+        assert outbox.stats()['chat_buckets'] == 5000
+        # just used, the limit still applies
+        assert outbox.sweep_buckets() == 0
+        now[0] += 1
+        assert outbox.sweep_buckets() == 5000
+        assert outbox.stats()['chat_buckets'] == 0
+        await outbox.close()
+
+    asyncio.run(run())
+
+
+def test_operator_replies_go_before_queued_mirrors_of_the_chat():
+    async def run():
+        bot = Bot(latency=0.01)
+        outbox = OutboundQueue(bot=bot, global_rate=10_000,
+                               private_chat_rate=1000, group_chat_rate=1000,
+                               workers=1)
+        outbox.start()
+        mirrors = [asyncio.create_task(outbox.send_message(
+            SUPPORT_CHAT_MIRROR, SUPPORT_CHAT_ID, text=f'mirror {i}'))
+            for i in range(5)]
+        await asyncio.sleep(0)
+        reply = asyncio.create_task(outbox.call(
+            OPERATOR_REPLY, SUPPORT_CHAT_ID, 'edit_message_text',
+            text='edit'))
+        await asyncio.gather(reply, *mirrors)
+        await outbox.close()
+        return [text for _, text in bot.sent]
+
+    sent = asyncio.run(run())
+    # the first mirror was being sent already
+    assert sent[:2] == ['mirror 0', 'edit']
+    assert sent[2:] == [f'mirror {i}' for i in range(1, 5)]
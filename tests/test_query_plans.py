@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from benchmarks.explain_queries import fill_scripts, plan_nodes, queries
+
+USERS = 1000
+ROWS = 20_000
+
+
+@pytest.fixture(scope='module')
+def cursor(database):
+    connection = database.connect()
+    with connection.cursor() as cursor:
+        for script in fill_scripts:
+            cursor.execute(script.format(users=USERS, rows=ROWS))
+        connection.commit()
+        # a sequential scan is planned only where no index can be used
+        cursor.execute('SET enable_seqscan = off;')
+        yield cursor
+    connection.rollback()
+    connection.close()
+
+
+@pytest.mark.parametrize(
+    'name, query, params',
+    [(name, query, params)
+     for name, query, params, needs_index in queries if needs_index])
+def test_lookup_uses_an_index(cursor, name, query, params):
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + query, params)
+    plan, = cursor.fetchone()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    seq_scans = sorted({node['Relation Name']
+                        for node in plan_nodes(plan[0]['Plan'])
+                        if node['Node Type'] == 'Seq Scan'})
+    assert not seq_scans, f'{name} scans {", ".join(seq_scans)}'
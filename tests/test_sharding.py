@@ -0,0 +1,50 @@
+import asyncio
+
+from db_managing import MsgNotFound
+from sharding import Supervisor, shard_of
+
+SUPPORT_CHAT_ID = -100
+CUSTOMER_ID = 1003
+
+
+class FakeSupportBotData:
+    """support chat post 10 is about CUSTOMER_ID"""
+
+    async def get_message_view(self, support_chat_message_id: int):
+        if support_chat_message_id != 10:
+            raise MsgNotFound
+        return 'text', CUSTOMER_ID
+
+
+class FakeQueue(list):
+    put = list.append
+
+
+def supervisor(workers: int) -> Supervisor:
+    supervisor = Supervisor(workers=workers)
+    supervisor._queues = [FakeQueue() for _ in range(workers)]
+    supervisor._data = FakeSupportBotData()
+    return supervisor
+
+
+def button_press(data: str, post_id: int) -> dict:
+    return {'update_id': 1, 'callback_query': {
+        'id': '1', 'from': {'id': 7}, 'data': data,
+        'message': {'message_id': post_id,
+                    'chat': {'id': SUPPORT_CHAT_ID, 'type': 'supergroup'}}}}
+
+
+def test_a_button_of_a_post_without_the_customer_goes_to_its_shard():
+    supervisor_ = supervisor(4)
+    # posts made before the customer was put in the callback data
+    update = button_press('btn:customer_textmessage:answered:0', 10)
+    asyncio.run(supervisor_.route(update))
+    shard = shard_of(CUSTOMER_ID, 4)
+    assert supervisor_._queues[shard] == [(CUSTOMER_ID, update)]
+
+
+def test_a_button_of_an_unknown_post_goes_to_the_first_shard():
+    supervisor_ = supervisor(4)
+    update = button_press('btn:customer_textmessage:answered:0', 11)
+    asyncio.run(supervisor_.route(update))
+    assert supervisor_._queues[0] == [(None, update)]
@@ -0,0 +1,39 @@
+import asyncio
+from types import SimpleNamespace
+
+from aiogram.dispatcher.handler import CancelHandler
+
+from throttle import FloodThrottle
+
+
+def message(tg_id: int) -> SimpleNamespace:
+    return SimpleNamespace(chat=SimpleNamespace(type='private'),
+                           from_user=SimpleNamespace(id=tg_id))
+
+
+def test_a_dropped_message_does_not_wait_for_the_warning():
+    warned = asyncio.Event()
+    reports = []
+
+    async def on_flood(message_, dropped):
+        # e.g. a warning waiting for the chat's send slot
+        await warned.wait()
+        reports.append(dropped)
+
+    async def scenario():
+        throttle = FloodThrottle(rate=0.001, burst=1, on_flood=on_flood)
+        await throttle.on_pre_process_message(message(1), {})
+        for _ in range(2):
+            try:
+                await asyncio.wait_for(
+                    throttle.on_pre_process_message(message(1), {}), 1)
+            except CancelHandler:
+                pass
+            else:
+                raise AssertionError('the message was not dropped')
+        assert reports == []
+        warned.set()
+        await asyncio.gather(*throttle._tasks)
+
+    asyncio.run(scenario())
+    assert sorted(reports) == [1, 2]
@@ -0,0 +1,82 @@
+import asyncio
+from types import SimpleNamespace
+
+import tickets
+from tickets import TicketThreader
+
+IDLE_TIMEOUT = 60
+
+
+def text(tg_id: int, text_: str) -> SimpleNamespace:
+    return SimpleNamespace(from_user=SimpleNamespace(id=tg_id), text=text_)
+
+
+def threader(posts: list) -> TicketThreader:
+    async def open_ticket(message, body):
+        await asyncio.sleep(0.01)
+        posts.append(body)
+        return len(posts), body
+
+    async def edit_ticket(support_chat_message_id, text_, tg_id):
+        posts[support_chat_message_id - 1] = text_
+
+    return TicketThreader(open_ticket=open_ticket, edit_ticket=edit_ticket,
+                          debounce=0.01, idle_timeout=IDLE_TIMEOUT)
+
+
+def test_close_all_waits_for_a_running_flush():
+    posts = []
+
+    async def scenario():
+        threader_ = threader(posts)
+        threader_.add(text(1, 'hello'))
+        # the debounce is over, the post is being sent
+        await asyncio.sleep(0.015)
+        assert threader_._tasks
+        await threader_.close_all()
+
+    asyncio.run(scenario())
+    assert posts == ['hello']
+
+
+def test_idle_tickets_are_forgotten(monkeypatch):
+    posts = []
+    clock = [1000.0]
+    # not time.monotonic itself, the event loop's clock
+    monkeypatch.setattr(tickets, 'time',
+                        SimpleNamespace(monotonic=lambda: clock[0]))
+
+    async def scenario():
+        threader_ = threader(posts)
+        for tg_id in (1, 2):
+            threader_.add(text(tg_id, f'hello from {tg_id}'))
+        await threader_.close_all()
+        assert threader_.sweep() == 0
+
+        clock[0] += IDLE_TIMEOUT / 2
+        threader_.add(text(2, 'still here'))
+        await threader_.close_all()
+        clock[0] += IDLE_TIMEOUT / 2 + 1
+        assert threader_.sweep() == 1
+        assert list(threader_._threads) == [2]
+        assert list(threader_._customers.values()) == [2]
+
+    asyncio.run(scenario())
+    assert posts == ['hello from 1', 'hello from 2\nstill here']
+
+
+def test_a_burst_too_long_for_one_post_is_split():
+    posts = []
+    long_line = 'x' * (tickets.MAX_BODY_LENGTH - 2)
+
+    async def scenario():
+        threader_ = threader(posts)
+        for line in ('first', long_line, 'last',
+                     'y' * (tickets.MAX_BODY_LENGTH + 1)):
+            threader_.add(text(1, line))
+        await threader_.close_all()
+
+    asyncio.run(scenario())
+    assert posts == ['first', long_line, 'last',
+                     'y' * tickets.MAX_BODY_LENGTH, 'y']
+    assert all(len(post) <= tickets.MAX_BODY_LENGTH for post in posts)
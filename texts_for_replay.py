@@ -23,6 +23,13 @@ help_for_opertor_text = """
 
 [🚫 Забанен] - означает, что человек в "черном списке". Если нажать, то человек будет удален из черного списка.
 
+<b>+ Как назначаются обращения?</b>
+
+/available - начать смену: новые обращения будут назначаться вам
+/away - закончить смену: ваши обращения получат другие операторы
+
+Если на обращение не ответили вовремя, оно передается другому оператору.
+
 <b>+ Что можно использовать?</b>
 
 Для сообщений доступны:
@@ -48,4 +55,25 @@ phone_already_belong_customer_text = """
 
 instruction_how_use_support = """
 Теперь вы можете написать сюда любой вопрос, и вам ответит первый освободившийся оператор.
-"""
\ No newline at end of file
+"""
+broadcast_usage_text = """
+Чтобы сделать рассылку, ответьте на сообщение, которое нужно разослать, командой:
+
+/broadcast customers - зарегистрированным пользователям
+/broadcast tg_users - незарегистрированным пользователям
+/broadcast all - всем
+
+Забаненным пользователям рассылка не отправляется.
+"""
+broadcast_started_text = 'Рассылка {broadcast_id} запущена'
+broadcast_finished_text = """
+Рассылка {broadcast_id} завершена
+Отправлено: {sent}
+Не доставлено: {failed}
+"""
+assigned_operator_text = 'Оператор: {operator}'
+reassigned_operator_text = '⏰ Нет ответа, обращение передано: {operator}'
+operator_available_text = 'Вы на смене, новые обращения будут назначаться вам'
+operator_away_text = 'Смена закончена, ваши обращения переданы другим операторам'
+album_text = '🖼 Альбом: {count} фото, ответьте на любое из них или на это сообщение'
+flood_text = 'Слишком много сообщений подряд, подождите немного, и оператор ответит вам'
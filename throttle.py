@@ -0,0 +1,95 @@
+from __future__ import annotations
+import asyncio
+from collections import OrderedDict
+import logging
+import time
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from metrics import Counter
+
+log = logging.getLogger('throttle')
+
+THROTTLED_MESSAGES = Counter(
+    'bot_throttled_messages_total', 'customer messages dropped as a flood')
+
+
+class FloodThrottle(BaseMiddleware):
+    """Drops the private messages of a customer who writes faster than
+    `rate` messages per second, after a burst of `burst` messages.
+
+    Runs before the message handlers, so a dropped message costs no
+    query and no Bot API request. `on_flood(message, dropped)` is run in
+    background for every dropped message with the number dropped in a
+    row, e.g. to warn the customer or ban them; the message is dropped
+    without waiting for it.
+
+    Buckets are kept in order of last use, one [tokens, updated, dropped]
+    list per customer; a customer silent long enough for the bucket to
+    refill is forgotten, so only customers active in the last
+    `burst / rate` seconds take memory.
+    """
+
+    def __init__(self, rate: float, burst: int, on_flood=None):
+        super().__init__()
+        self._rate = rate
+        self._burst = burst
+        self._idle_after = burst / rate
+        self._on_flood = on_flood
+        # tg_id -> [tokens, updated, dropped], least recently used first
+        self._buckets = OrderedDict()
+        self._tasks = set()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _evict(self, now: float) -> None:
+        idle = now - self._idle_after
+        buckets = self._buckets
+        while buckets:
+            tg_id = next(iter(buckets))
+            if buckets[tg_id][1] > idle:
+                return
+            del buckets[tg_id]
+
+    def hit(self, tg_id: int) -> int:
+        """Take a token of `tg_id`: 0 if the message may pass, otherwise
+        the number of its messages dropped in a row"""
+        now = time.monotonic()
+        self._evict(now)
+        bucket = self._buckets.get(tg_id)
+        if bucket is None:
+            bucket = self._buckets[tg_id] = [self._burst, now, 0]
+        else:
+            self._buckets.move_to_end(tg_id)
+            bucket[0] = min(self._burst,
+                            bucket[0] + (now - bucket[1]) * self._rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = 0
+            return 0
+        bucket[2] += 1
+        return bucket[2]
+
+    async def on_pre_process_message(self, message: types.Message,
+                                     data: dict) -> None:
+        if message.chat.type != 'private':
+            return
+        dropped = self.hit(message.from_user.id)
+        if not dropped:
+            return
+        THROTTLED_MESSAGES.inc()
+        if self._on_flood is not None:
+            task = asyncio.create_task(self._report(message, dropped))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        raise CancelHandler()
+
+    async def _report(self, message: types.Message, dropped: int) -> None:
+        try:
+            await self._on_flood(message, dropped)
+        except Exception:
+            log.exception(f'flood of {message.from_user.id} not handled')
@@ -0,0 +1,208 @@
+from __future__ import annotations
+import asyncio
+import logging
+import time
+
+from aiogram import types
+from aiogram.utils import exceptions
+
+from dedup import current_update_id
+
+log = logging.getLogger('tickets')
+
+# Bot API limit for the text of a message
+MAX_TEXT_LENGTH = 4096
+# of a new ticket's post, the rest is left for the signature open_ticket
+# puts before it
+MAX_BODY_LENGTH = MAX_TEXT_LENGTH - 512
+# seconds between sweeps of the threads of tickets idle for idle_timeout
+THREAD_SWEEP_INTERVAL = 60
+
+
+class _Thread:
+    __slots__ = ('pending', 'update_ids', 'timer', 'support_chat_message_id',
+                 'text', 'updated_at', 'lock')
+
+    def __init__(self):
+        self.pending = []
+        # of the pending messages and of those being sent
+        self.update_ids = []
+        self.timer = None
+        self.support_chat_message_id = None
+        self.text = ''
+        self.updated_at = 0.0
+        self.lock = asyncio.Lock()
+
+
+def split_bodies(messages: list) -> list:
+    """(first message, body) of the posts the texts of `messages` need:
+    texts are joined while the body stays within MAX_BODY_LENGTH, a
+    longer text is cut"""
+    posts = []
+    for message in messages:
+        text = message.text
+        if posts and \
+                len(posts[-1][1]) + 1 + len(text) <= MAX_BODY_LENGTH:
+            posts[-1][1] += '\n' + text
+            continue
+        for start in range(0, max(len(text), 1), MAX_BODY_LENGTH):
+            posts.append([message, text[start:start + MAX_BODY_LENGTH]])
+    return [tuple(post) for post in posts]
+
+
+class TicketThreader:
+    """Collects a customer's burst of text messages into one ticket.
+
+    Texts coming within `debounce` seconds of each other are sent as one
+    support chat post by `open_ticket(message, body)`, which returns the
+    post's support_chat_message_id and full text. Later texts are appended
+    to that post by `edit_ticket(support_chat_message_id, text, tg_id)`
+    while the ticket is open: not answered, not idle for `idle_timeout`
+    seconds and short enough for one message. So a customer writing five
+    lines costs one post, a few edits and one message row. Texts too long
+    for one post are opened as several tickets, see split_bodies.
+
+    Tickets live in memory, after a restart the next message opens a new
+    ticket. Tickets nobody answers are forgotten once idle, every
+    THREAD_SWEEP_INTERVAL seconds after start(). pending_update_ids() are
+    the updates of the texts not sent yet, see dedup.UpdateDeduplicator.
+    """
+
+    def __init__(self, open_ticket, edit_ticket, debounce: float,
+                 idle_timeout: float):
+        self._open_ticket = open_ticket
+        self._edit_ticket = edit_ticket
+        self._debounce = debounce
+        self._idle_timeout = idle_timeout
+        self._threads = {}
+        self._customers = {}
+        self._tasks = set()
+        self._sweeper = None
+
+    def start(self) -> None:
+        self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    def add(self, message: types.Message) -> None:
+        """Queue a text message of a customer"""
+        tg_id = message.from_user.id
+        thread = self._threads.get(tg_id)
+        if thread is None:
+            thread = self._threads[tg_id] = _Thread()
+        thread.pending.append(message)
+        update_id = current_update_id()
+        if update_id is not None:
+            thread.update_ids.append(update_id)
+        if thread.timer is not None:
+            thread.timer.cancel()
+        thread.timer = asyncio.get_running_loop().call_later(
+            self._debounce, self._flush_later, tg_id)
+
+    def _flush_later(self, tg_id: int) -> None:
+        task = asyncio.create_task(self.flush(tg_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, tg_id: int) -> None:
+        """Send the queued messages of a customer now"""
+        thread = self._threads.get(tg_id)
+        if thread is None:
+            return
+        if thread.timer is not None:
+            thread.timer.cancel()
+            thread.timer = None
+        async with thread.lock:
+            messages, thread.pending = thread.pending, []
+            sending = len(thread.update_ids)
+            if messages:
+                try:
+                    await self._send(tg_id, thread, messages)
+                except Exception:
+                    log.exception(f'ticket of {tg_id} not sent')
+            # done with, sent or not; texts added meanwhile are after them
+            del thread.update_ids[:sending]
+            if not thread.pending and \
+                    thread.support_chat_message_id is None:
+                self._threads.pop(tg_id, None)
+
+    async def _send(self, tg_id: int, thread: _Thread,
+                    messages: list) -> None:
+        body = '\n'.join(message.text for message in messages)
+        now = time.monotonic()
+        text = f'{thread.text}\n{body}'
+        if thread.support_chat_message_id is not None and \
+                now - thread.updated_at < self._idle_timeout and \
+                len(text) <= MAX_TEXT_LENGTH:
+            try:
+                await self._edit_ticket(
+                    thread.support_chat_message_id, text, tg_id)
+                thread.text = text
+                thread.updated_at = now
+                return
+            except exceptions.MessageToEditNotFound:
+                log.warning('ticket post was deleted')
+            except exceptions.MessageNotModified:
+                return
+        # the last post stays open
+        for message, body in split_bodies(messages):
+            support_chat_message_id, text = \
+                await self._open_ticket(message, body)
+            self._forget(tg_id, thread)
+            thread.support_chat_message_id = support_chat_message_id
+            thread.text = text
+            thread.updated_at = now
+            self._customers[support_chat_message_id] = tg_id
+
+    def pending_update_ids(self):
+        for thread in self._threads.values():
+            yield from thread.update_ids
+
+    def _forget(self, tg_id: int, thread: _Thread) -> None:
+        self._customers.pop(thread.support_chat_message_id, None)
+        thread.support_chat_message_id = None
+        thread.text = ''
+
+    def close(self, support_chat_message_id: int) -> None:
+        """The ticket is answered, the next message opens a new one"""
+        tg_id = self._customers.pop(support_chat_message_id, None)
+        thread = self._threads.get(tg_id)
+        if thread is None or \
+                thread.support_chat_message_id != support_chat_message_id:
+            return
+        thread.support_chat_message_id = None
+        thread.text = ''
+        if not thread.pending and not thread.lock.locked():
+            del self._threads[tg_id]
+
+    async def close_customer(self, tg_id: int) -> None:
+        """Send what is queued and close the open ticket of a customer,
+        e.g. before a photo goes as a post of its own"""
+        await self.flush(tg_id)
+        thread = self._threads.get(tg_id)
+        if thread is not None and \
+                thread.support_chat_message_id is not None:
+            self.close(thread.support_chat_message_id)
+
+    def sweep(self) -> int:
+        """Forget the tickets idle for idle_timeout, the next message of
+        their customer opens a new one anyway; returns how many"""
+        idle_since = time.monotonic() - self._idle_timeout
+        idle = [tg_id for tg_id, thread in self._threads.items()
+                if not thread.pending and not thread.lock.locked()
+                and thread.updated_at < idle_since]
+        for tg_id in idle:
+            self._forget(tg_id, self._threads.pop(tg_id))
+        return len(idle)
+
+    async def _sweep_forever(self) -> None:
+        while True:
+            await asyncio.sleep(THREAD_SWEEP_INTERVAL)
+            self.sweep()
+
+    async def close_all(self) -> None:
+        """Send everything queued, on shutdown"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        await asyncio.gather(*(self.flush(tg_id)
+                               for tg_id in list(self._threads)))
+        await asyncio.gather(*self._tasks, return_exceptions=True)